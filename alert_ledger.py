@@ -0,0 +1,110 @@
+# alert_ledger.py
+# Версия: 1.1 (Окно охлаждения считается по барам хранилища, а не по календарному времени)
+# Назначение: Состояние алертов хранится локально и не зависит от перезаписи листа 'Analysis'.
+# Ключ записи - (тикер, таймфрейм, сигнал, время бара). Повторная отправка по тому же бару
+# невозможна, а по новым барам - только после окна охлаждения, измеряемого в барах таймфрейма:
+# считаются бары партиции хранилища, поэтому выходные и ночи окно не расходуют.
+# Решение по каждому кандидату - поиск в словаре и, для ранее отправленных, чтение дат партиции,
+# без запросов к базе и к Google Sheets.
+
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+import ohlcv_store
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+LEDGER_FILE = 'alert_ledger.db'
+COOLDOWN_BARS = 5  # Сигнал по паре не повторяется раньше чем через столько баров
+TIMEFRAME_MINUTES = {'D1': 24 * 60, 'H1': 60, 'm30': 30, 'm10': 10, 'm1': 1}
+
+def cooldown_for(timeframe: str, bars: int = COOLDOWN_BARS) -> timedelta:
+    """
+    Календарная длительность bars баров таймфрейма (для неизвестных таймфреймов 'mN' - N минут на бар).
+    Используется, только если у пары нет партиции хранилища, по которой можно посчитать бары.
+    """
+    minutes = TIMEFRAME_MINUTES.get(timeframe)
+    if minutes is None:
+        minutes = int(timeframe[1:]) if timeframe[1:].isdigit() else 24 * 60
+    return timedelta(minutes=minutes * bars)
+
+# =============================================================================
+# --- БЛОК 2: ЖУРНАЛ ---
+# =============================================================================
+class AlertLedger:
+    """Журнал отправленных алертов: SQLite на диске и индекс последних отправок в памяти."""
+
+    def __init__(self, path: str = LEDGER_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS alerts ("
+            " ticker TEXT NOT NULL, timeframe TEXT NOT NULL, signal TEXT NOT NULL,"
+            " bar_ts TEXT NOT NULL, sent_at TEXT NOT NULL,"
+            " PRIMARY KEY (ticker, timeframe, signal, bar_ts))"
+        )
+        self._conn.commit()
+        # {(тикер, таймфрейм, сигнал): время бара последнего отправленного алерта}
+        self._last_sent: Dict[Tuple[str, str, str], datetime] = {}
+        rows = self._conn.execute(
+            "SELECT ticker, timeframe, signal, MAX(bar_ts) FROM alerts GROUP BY ticker, timeframe, signal"
+        )
+        for ticker, timeframe, signal, bar_ts in rows:
+            self._last_sent[(ticker, timeframe, signal)] = datetime.fromisoformat(bar_ts)
+        logging.info(f"📒 Журнал алертов '{path}': {len(self._last_sent)} пар с отправленными сигналами.")
+
+    def should_send(self, ticker: str, timeframe: str, signal: str, bar_ts: datetime,
+                    cooldown_bars: Optional[int] = None, store_dir: str = ohlcv_store.STORE_DIR) -> bool:
+        """
+        True, если по (тикер, таймфрейм, сигнал) еще не отправлялся алерт на этом баре
+        и с бара последней отправки прошло не меньше cooldown_bars баров хранилища
+        (None - COOLDOWN_BARS, 0 - без окна охлаждения).
+        """
+        last_bar = self._last_sent.get((ticker, timeframe, signal))
+        if last_bar is None:
+            return True
+        if bar_ts <= last_bar:
+            return False
+        if cooldown_bars is None:
+            cooldown_bars = COOLDOWN_BARS
+        if cooldown_bars <= 0:
+            return True
+        dates = ohlcv_store.read_partition(ticker, timeframe, store_dir)['Date']
+        if dates.shape[0] == 0:
+            return bar_ts - last_bar >= cooldown_for(timeframe, cooldown_bars)
+        passed = np.count_nonzero((dates > np.datetime64(last_bar, 's')) & (dates <= np.datetime64(bar_ts, 's')))
+        return passed >= cooldown_bars
+
+    def record(self, entries: Iterable[Tuple[str, str, str, datetime]]) -> None:
+        """Фиксирует отправленные алерты (тикер, таймфрейм, сигнал, время бара) одной транзакцией."""
+        entries = list(entries)
+        if not entries:
+            return
+        sent_at = datetime.now().isoformat(timespec='seconds')
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO alerts (ticker, timeframe, signal, bar_ts, sent_at) VALUES (?, ?, ?, ?, ?)",
+                [(ticker, timeframe, signal, bar_ts.isoformat(), sent_at) for ticker, timeframe, signal, bar_ts in entries]
+            )
+        for ticker, timeframe, signal, bar_ts in entries:
+            key = (ticker, timeframe, signal)
+            if key not in self._last_sent or bar_ts > self._last_sent[key]:
+                self._last_sent[key] = bar_ts
+
+    def close(self) -> None:
+        self._conn.close()
+
+_ledgers: Dict[str, AlertLedger] = {}
+
+def get_ledger(path: str = LEDGER_FILE) -> AlertLedger:
+    """Журнал процесса: открывается один раз, индекс в памяти переживает циклы режима демона."""
+    key = os.path.abspath(path)
+    if key not in _ledgers:
+        _ledgers[key] = AlertLedger(path)
+    return _ledgers[key]
@@ -1,134 +1,160 @@
 # alerter.py
-# Версия: 1.9.2 (исправлена инициализация логирования)
+# Версия: 1.18 (ALERT_COOLDOWN_BARS = 0 отключает окно охлаждения; окно считается в барах хранилища)
 
-import gspread
-from google.oauth2.service_account import Credentials
 import pandas as pd
-import requests
 import logging
 from datetime import datetime
+from typing import Any, Dict, Optional
 
-# ИЗМЕНЕНО: Инициализация логирования перенесена на уровень модуля
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("alerter.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import ohlcv_store
+import rule_engine
+from alert_ledger import get_ledger
+from sheets_context import SheetsContext, get_default_context
+from log_setup import setup_logging
+from sheets_io import get_sheets_io
+from telegram_dispatcher import DIGEST_THRESHOLD, get_dispatcher
 
 # ... (остальной код модуля без изменений) ...
 # =============================================================================
 # --- БЛОК 1: КОНФИГУРАЦИЯ И ПОДКЛЮЧЕНИЕ ---
 # =============================================================================
-CREDS_FILE = 'credentials.json'
-SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1qBYS_DhGNsTo-Dnph3g_H27aHQOoY0EOcmCIKarb7Zc/"
-SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file']
-
-def get_worksheet(sheet_name):
-    """Подключается к Google Sheets и возвращает объект листа."""
+def get_worksheet(sheet_name, ctx: Optional[SheetsContext] = None):
+    """Возвращает объект листа из контекста запуска (авторизация выполняется один раз)."""
     try:
-        creds = Credentials.from_service_account_file(CREDS_FILE, scopes=SCOPE)
-        client = gspread.authorize(creds)
-        spreadsheet = client.open_by_url(SPREADSHEET_URL)
-        return spreadsheet.worksheet(sheet_name)
+        ctx = ctx or get_default_context()
+        if ctx is None:
+            return None
+        return ctx.worksheet(sheet_name)
     except Exception as e:
         logging.error(f"❌ Ошибка доступа к листу '{sheet_name}': {e}")
         return None
 
 # =============================================================================
-# --- БЛОК 2: ЛОГИКА ОТПРАВКИ АЛЕРТОВ ---
+# --- БЛОК 2: ФОРМАТИРОВАНИЕ СООБЩЕНИЙ ---
 # =============================================================================
 def escape_markdown(text: str) -> str:
     """Экранирует специальные символы MarkdownV2 для безопасной отправки в Telegram."""
     escape_chars = r'_*[]()~`>#+-=|{}.!'
     return ''.join(f'\\{char}' if char in escape_chars else char for char in text)
 
-def send_telegram_alert(bot_token, chat_id, message):
-    """Отправляет сообщение в Telegram и возвращает True в случае успеха."""
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    params = {'chat_id': chat_id, 'text': message, 'parse_mode': 'MarkdownV2'}
-    try:
-        response = requests.post(url, json=params, timeout=10)
-        response.raise_for_status()
-        logging.info(f"    >> ✅ Алерт успешно отправлен в Telegram!")
-        return True
-    except requests.exceptions.RequestException as e:
-        logging.error(f"    >> ❌ Ошибка отправки алерта в Telegram: {e}")
-        if e.response:
-            logging.error(f"    >> ❌ Ответ сервера: {e.response.text}")
-        return False
-
 # =============================================================================
 # --- БЛОК 3: ГЛАВНАЯ ЛОГИКА АЛЕРТЕРА ---
 # =============================================================================
-def main_alerter(interval: int = 24):
+def main_alerter(interval: int = 24, ctx: Optional[SheetsContext] = None,
+                 config: Optional[Dict[str, Any]] = None, analysis_df: Optional[pd.DataFrame] = None):
     """
     Основная функция алертера. Ищет сигналы для заданного интервала.
+
+    Args:
+        config: Параметры листа Config, уже прочитанные конвейером.
+        analysis_df: Строки анализа, только что рассчитанные анализатором.
+            Листы читаются из таблицы только для того, что не передано.
     """
     timeframe_map = {24: 'D1', 60: 'H1', 30: 'm30', 10: 'm10', 1: 'm1'}
     timeframe_label = timeframe_map.get(interval, f'm{interval}')
     
     logging.info("\n" + "="*50)
-    logging.info(f"--- 🔔 АСУП ИИ: Система Оповещений v1.9.2 (Таймфрейм: {timeframe_label}) 🔔 ---")
+    logging.info(f"--- 🔔 АСУП ИИ: Система Оповещений v1.18 (Таймфрейм: {timeframe_label}) 🔔 ---")
     logging.info("="*50)
     
-    config_sheet = get_worksheet('Config')
-    analysis_sheet = get_worksheet('Analysis')
-    if not all([config_sheet, analysis_sheet]): 
-        logging.critical("Не удалось получить доступ к одному или нескольким листам Google. Завершение работы.")
-        return
+    sheets_io = get_sheets_io()
+    if config is None:
+        config_sheet = get_worksheet('Config', ctx)
+        if not config_sheet:
+            logging.critical("Не удалось получить доступ к листу 'Config'. Завершение работы.")
+            return
+        logging.info("🔄 Читаю настройки...")
+        config = {item['Parameter']: item['Value'] for item in sheets_io.get_all_records(config_sheet)}
 
-    logging.info("🔄 Читаю настройки и данные для анализа...")
-    configs_raw = config_sheet.get_all_records()
-    configs = {item['Parameter']: item['Value'] for item in configs_raw}
-    analysis_data = analysis_sheet.get_all_records()
-    
-    if len(analysis_data) < 2:
-        logging.info("ℹ️ Лист 'Analysis' пуст. Пропускаю.")
-        return
+    if analysis_df is None:
+        analysis_sheet = get_worksheet('Analysis', ctx)
+        if not analysis_sheet:
+            logging.critical("Не удалось получить доступ к листу 'Analysis'. Завершение работы.")
+            return
+        logging.info("🔄 Читаю данные для анализа...")
+        analysis_df = pd.DataFrame(sheets_io.get_all_records(analysis_sheet))
 
-    analysis_df = pd.DataFrame(analysis_data[1:], columns=analysis_data[0])
+    if analysis_df.empty:
+        logging.info("ℹ️ Нет строк анализа для проверки. Пропускаю.")
+        return
     
     analysis_df_filtered = analysis_df[analysis_df['Timeframe'] == timeframe_label].copy()
     if analysis_df_filtered.empty:
         logging.info(f"ℹ️ Нет данных для анализа на таймфрейме {timeframe_label}. Пропускаю.")
         return
 
-    bot_token = configs.get('TELEGRAM_BOT_TOKEN')
-    chat_id = configs.get('TELEGRAM_CHAT_ID')
+    bot_token = config.get('TELEGRAM_BOT_TOKEN')
+    chat_id = config.get('TELEGRAM_CHAT_ID')
     
     logging.info(f"⚙️ Проверяю условия для таймфрейма {timeframe_label}...")
     
-    alerts_to_send = analysis_df_filtered[
-        (analysis_df_filtered['State'] == 'Oversold') &
-        (analysis_df_filtered['Recommendation'] != 'Alert Sent')
-    ]
-    
+    # Все правила вычисляются одной маской на правило по всем строкам таймфрейма
+    rules = rule_engine.load_rules(config, rule_engine.ALERT_RULE_PREFIX, rule_engine.DEFAULT_ALERT_RULES)
+    rules_by_name = {rule.name: rule for rule in rules}
+    candidates = rule_engine.evaluate_rules(analysis_df_filtered, rules, config)
+
+    # Решение об отправке принимает журнал алертов: один поиск по (тикер, таймфрейм, сигнал, бар).
+    # Сигнал - имя правила, поэтому окно охлаждения у каждого правила свое.
+    ledger = get_ledger()
+    # Пустой параметр - окно по умолчанию, 0 - без окна охлаждения
+    cooldown_setting = str(config.get('ALERT_COOLDOWN_BARS', '')).strip()
+    cooldown_bars = int(float(cooldown_setting.replace(',', '.'))) if cooldown_setting else None
+    now = datetime.now().replace(second=0, microsecond=0)
+    bar_times = {}
+    for ticker in candidates['Ticker'].astype(str).unique():
+        # Время бара - последняя дата партиции хранилища (читается одна запись); без партиции - текущая минута
+        bar_ts = ohlcv_store.last_timestamp(ticker, timeframe_label)
+        bar_times[ticker] = bar_ts.to_pydatetime() if bar_ts is not None else now
+    is_new = [ledger.should_send(ticker, timeframe_label, signal, bar_times[ticker], cooldown_bars)
+              for ticker, signal in zip(candidates['Ticker'].astype(str), candidates['Rule'])]
+    alerts_to_send = candidates[pd.Series(is_new, index=candidates.index, dtype=bool)]
+    if len(candidates) > len(alerts_to_send):
+        logging.info(f"ℹ️ {len(candidates) - len(alerts_to_send)} сигналов уже отправлены ранее (журнал алертов).")
+
     if alerts_to_send.empty:
-        logging.info("✅ Новых сигналов 'Oversold' для отправки не найдено.")
+        logging.info(f"✅ Новых сигналов по правилам {list(rules_by_name)} для отправки не найдено.")
     else:
-        logging.info(f"Найдено {len(alerts_to_send)} новых сигналов 'Oversold'. Отправка...")
-        for index, alert_row in alerts_to_send.iterrows():
-            ticker = alert_row['Ticker']
-            rsi_value = float(str(alert_row['RSI_14']).replace(',', '.'))
-            
+        logging.info(f"Найдено {len(alerts_to_send)} новых сигналов по правилам. Отправка...")
+        now_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rsi_values = rule_engine.numeric_column(alerts_to_send['RSI_14'])
+        alerts, sent_signals = [], {}
+        for ticker, signal, rsi_value in zip(alerts_to_send['Ticker'].astype(str), alerts_to_send['Rule'], rsi_values):
+            rule = rules_by_name[signal]
             safe_ticker = escape_markdown(ticker)
-            now_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
+            safe_title = escape_markdown(rule.title)
+            rsi_text = f"{rsi_value:.2f}" if pd.notna(rsi_value) else "N/A"
+            if rule.expression == rule_engine.DEFAULT_ALERT_RULES.get(rule.name):
+                condition = "вошел в зону перепроданности"
+            else:
+                condition = escape_markdown(f"выполнил условие: {rule.expression}")
             message = (
-                f"🚨 *СИГНАЛ: ПЕРЕПРОДАННОСТЬ ({timeframe_label})*\n\n"
-                f"*{safe_ticker}* вошел в зону перепроданности\n\n"
-                f"*Текущий RSI\\(14\\):* `{rsi_value:.2f}`\n"
+                f"🚨 *СИГНАЛ: {safe_title} \\({timeframe_label}\\)*\n\n"
+                f"*{safe_ticker}* {condition}\n\n"
+                f"*Текущий RSI\\(14\\):* `{rsi_text}`\n"
                 f"*Время сигнала:* `{now_time_str}`\n\n"
                 f"*Рекомендация:* Искать точку для покупки на таймфрейме {timeframe_label}\\."
             )
+            summary = f"• *{safe_ticker}* RSI\\(14\\) `{rsi_text}`"
+            if len(rules) > 1:
+                summary += f" \\- {safe_title}"
+            key = f"{ticker}|{signal}"
+            sent_signals[key] = (ticker, timeframe_label, signal, bar_times[ticker])
+            alerts.append({'key': key, 'text': message, 'summary': summary})
 
-            if send_telegram_alert(bot_token, chat_id, message):
-                logging.info(f"  - Алерт по {ticker} отправлен. Анализатор обновит статус при следующем запуске.")
+        digest_name = escape_markdown(rules[0].title) if len(rules) == 1 else "ПРАВИЛА АЛЕРТОВ"
+        digest_title = (
+            f"🚨 *СИГНАЛЫ: {digest_name} \\({timeframe_label}\\)*\n"
+            f"*Время сигналов:* `{now_time_str}`\n"
+        )
+        digest_threshold = int(config.get('ALERT_DIGEST_THRESHOLD', DIGEST_THRESHOLD) or DIGEST_THRESHOLD)
+        delivered = get_dispatcher(bot_token).dispatch(chat_id, alerts, digest_title, digest_threshold)
+        ledger.record(sent_signals[key] for key, ok in delivered.items() if ok)
+        for key, ok in delivered.items():
+            if ok:
+                logging.info(f"  - Алерт {key} отправлен и записан в журнал алертов.")
 
     logging.info("--- 🏁 РАБОТА СИСТЕМЫ ОПОВЕЩЕНИЙ ЗАВЕРШЕНА 🏁 ---")
 
 if __name__ == "__main__":
+    setup_logging("alerter.log")
     main_alerter(interval=24)
\ No newline at end of file
@@ -0,0 +1,150 @@
+# analysis_writer.py
+# Версия: 1.3 (Строки вызывающего не изменяются: время обновления подставляется в копию)
+# Назначение: Вместо clear() + полной перезаписи отправляет одним batch_update только
+# изменившиеся ячейки; строки добавляются или удаляются, только когда пары появляются
+# или исчезают. Лист ни в какой момент не бывает пустым для дашборда и алертера.
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Tuple
+
+from gspread.utils import rowcol_to_a1
+
+from sheets_io import get_sheets_io
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+ANALYSIS_HEADERS = ['Ticker', 'Timeframe', 'State', 'Last_Update', 'RSI_14', 'MA_20', 'MA_50', 'BB_Upper', 'BB_Lower', 'Pattern_Found', 'Recommendation']
+SNAPSHOT_FILE = 'analysis_snapshot.json'
+LAST_UPDATE_COL = ANALYSIS_HEADERS.index('Last_Update')
+
+def _row_key(row: List[Any]) -> str:
+    return f"{row[0]}|{row[1]}"
+
+def load_snapshot(path: str = SNAPSHOT_FILE) -> Dict[str, List[Any]]:
+    """Последние записанные в лист строки: {'тикер|таймфрейм': строка}."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Снимок листа 'Analysis' не прочитан ({e}), все строки будут записаны заново.")
+        return {}
+
+def save_snapshot(snapshot: Dict[str, List[Any]], path: str = SNAPSHOT_FILE) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# =============================================================================
+# --- БЛОК 2: РАСЧЕТ РАЗНИЦЫ ---
+# =============================================================================
+def diff_row(old_row: List[Any] | None, new_row: List[Any]) -> Tuple[int, int] | None:
+    """
+    Возвращает (первый, последний) индексы изменившихся столбцов или None, если строка не изменилась.
+    Last_Update сам по себе изменением не считается и обновляется только вместе с данными.
+    """
+    if old_row is None or len(old_row) != len(new_row):
+        return 0, len(new_row) - 1
+    changed = [i for i, (old, new) in enumerate(zip(old_row, new_row)) if i != LAST_UPDATE_COL and str(old) != str(new)]
+    if not changed:
+        return None
+    return min(changed + [LAST_UPDATE_COL]), max(changed + [LAST_UPDATE_COL])
+
+def _contiguous_ranges(row_numbers: List[int]) -> List[Tuple[int, int]]:
+    """Группирует номера строк в непрерывные диапазоны (начало, конец)."""
+    ranges: List[Tuple[int, int]] = []
+    for number in sorted(row_numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], number)
+        else:
+            ranges.append((number, number))
+    return ranges
+
+# =============================================================================
+# --- БЛОК 3: ЗАПИСЬ ---
+# =============================================================================
+def write_analysis_diff(analysis_sheet, rows: List[List[Any]], prune_missing: bool = True,
+                        snapshot_path: str = SNAPSHOT_FILE) -> Dict[str, int]:
+    """
+    Приводит лист 'Analysis' к строкам rows минимальным числом изменений.
+
+    Args:
+        analysis_sheet: Лист gspread.
+        rows: Строки анализа в порядке ANALYSIS_HEADERS.
+        prune_missing: Удалять строки пар, которых нет в rows.
+
+    Returns:
+        Статистика: число обновленных ячеек, добавленных и удаленных строк.
+        Строки rows не изменяются.
+    """
+    sheets_io = get_sheets_io()
+    snapshot = load_snapshot(snapshot_path)
+    # Позиции строк берем из самого листа (только столбцы ключа), значения - из снимка
+    key_columns = sheets_io.read(analysis_sheet.get, 'A:B')
+    stats = {'cells': 0, 'appended': 0, 'deleted': 0}
+
+    if not key_columns or key_columns[0][:2] != ANALYSIS_HEADERS[:2]:
+        logging.info("ℹ️ Лист 'Analysis' пуст или без заголовков: выполняю полную запись.")
+        sheets_io.write(analysis_sheet.clear)
+        sheets_io.write(analysis_sheet.update, range_name='A1', values=[ANALYSIS_HEADERS] + rows, row_count=len(rows))
+        save_snapshot({_row_key(row): row for row in rows}, snapshot_path)
+        stats['cells'] = len(rows) * len(ANALYSIS_HEADERS)
+        stats['appended'] = len(rows)
+        return stats
+
+    positions = {}
+    for sheet_row, key_cells in enumerate(key_columns[1:], start=2):
+        if len(key_cells) >= 2:
+            positions[f"{key_cells[0]}|{key_cells[1]}"] = sheet_row
+
+    updates = []
+    new_rows = []
+    written_rows = []  # Строки в том виде, в каком они оказываются в листе (для снимка)
+    for row in rows:
+        key = _row_key(row)
+        if key not in positions:
+            new_rows.append(row)
+            written_rows.append(row)
+            continue
+        changed = diff_row(snapshot.get(key), row)
+        if changed is None:
+            # Время обновления берем из снимка, чтобы снимок совпадал с листом
+            written = list(row)
+            written[LAST_UPDATE_COL] = snapshot[key][LAST_UPDATE_COL]
+            written_rows.append(written)
+            continue
+        written_rows.append(row)
+        first, last = changed
+        sheet_row = positions[key]
+        updates.append({
+            'range': f"{rowcol_to_a1(sheet_row, first + 1)}:{rowcol_to_a1(sheet_row, last + 1)}",
+            'values': [row[first:last + 1]],
+        })
+        stats['cells'] += last - first + 1
+
+    if updates:
+        sheets_io.write(analysis_sheet.batch_update, updates, value_input_option='USER_ENTERED', row_count=len(updates))
+
+    written_keys = {_row_key(row) for row in rows}
+    if prune_missing:
+        missing_rows = [number for key, number in positions.items() if key not in written_keys]
+        # Удаляем снизу вверх, чтобы номера оставшихся строк не сдвигались
+        for start, end in reversed(_contiguous_ranges(missing_rows)):
+            sheets_io.write(analysis_sheet.delete_rows, start, end)
+            stats['deleted'] += end - start + 1
+        for key in [key for key in positions if key not in written_keys]:
+            snapshot.pop(key, None)
+
+    if new_rows:
+        sheets_io.append_rows(analysis_sheet, new_rows)
+        stats['appended'] = len(new_rows)
+        stats['cells'] += len(new_rows) * len(ANALYSIS_HEADERS)
+
+    snapshot.update({_row_key(row): row for row in written_rows})
+    save_snapshot(snapshot, snapshot_path)
+    return stats
@@ -0,0 +1,191 @@
+# backfill_planner.py
+# Версия: 1.1 (Дни без торгов запоминаются только после расчетного лага и периодически перепроверяются)
+# Назначение: Дельта от последней даты не чинит дыры в середине ряда (сбойные запуски,
+# недоступность источника), а полная загрузка ради надежности перекачивает два года истории.
+# Планировщик сравнивает сохраненные дневные бары тикера с календарем торговых дней MOEX и
+# возвращает точные диапазоны недостающих дат, объединенные в минимальное число запросов.
+# Календарь - даты торгов индекса IMOEX из ISS, кэшируется локально и дополняется инкрементально.
+# Даты, которые источник не вернул (бумага не торговалась), запоминаются и не запрашиваются
+# HOLE_RECHECK_DAYS дней; последние HOLE_SETTLEMENT_SESSIONS сессий не запоминаются: итоги
+# вечерней сессии и поздние публикации еще могут появиться.
+
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+import ohlcv_store
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+CALENDAR_FILE = 'trading_calendar.json'  # Лежат в корне STORE_DIR
+HOLES_FILE = 'backfill_holes.json'
+CALENDAR_URL = "https://iss.moex.com/iss/history/engines/stock/markets/index/securities/IMOEX.json"
+# Пропуски, между которыми не больше стольких сохраненных баров, загружаются одним запросом:
+# ISS отдает историю страницами по 100 строк, лишние бары дешевле отдельного запроса
+GAP_MERGE_BARS = 20
+# Дни без данных запоминаются, только если после них прошло столько торговых сессий
+HOLE_SETTLEMENT_SESSIONS = 2
+HOLE_RECHECK_DAYS = 30  # Через столько дней запомненный день запрашивается снова
+
+Range = Tuple[str, Optional[str]]  # (с даты, по дату включительно; None - до последних данных)
+
+# =============================================================================
+# --- БЛОК 2: КАЛЕНДАРЬ ТОРГОВ ---
+# =============================================================================
+def _fetch_trade_dates(since: str, till: str, session: Optional[requests.Session]) -> List[str]:
+    """Даты торгов IMOEX за [since, till] со всех страниц ISS."""
+    dates: List[str] = []
+    start = 0
+    while True:
+        params = {'from': since, 'till': till, 'start': start, 'iss.meta': 'off',
+                  'iss.only': 'history,history.cursor', 'history.columns': 'TRADEDATE'}
+        response = (session or requests).get(CALENDAR_URL, params=params, timeout=15)
+        response.raise_for_status()
+        payload = response.json()
+        rows = payload.get('history', {}).get('data', [])
+        dates.extend(row[0] for row in rows)
+        cursor = payload.get('history.cursor', {})
+        total = dict(zip(cursor.get('columns', []), cursor['data'][0])).get('TOTAL', 0) if cursor.get('data') else 0
+        start += len(rows)
+        if not rows or start >= int(total):
+            return dates
+
+def _load_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Файл '{path}' не прочитан ({e}), будет создан заново.")
+        return {}
+
+def _save_json(path: str, payload: dict) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def load_calendar(since: str, session: Optional[requests.Session] = None,
+                  store_dir: str = ohlcv_store.STORE_DIR) -> Optional[np.ndarray]:
+    """
+    Торговые дни MOEX начиная с since (datetime64[D], по возрастанию).
+    Из ISS запрашиваются только даты, которых нет в кэше: более ранние, чем since кэша,
+    и новые с момента последней проверки (не чаще раза в день).
+    Возвращает None, если календарь недоступен (тогда вызывающий использует обычную дельту).
+    """
+    path = os.path.join(store_dir, CALENDAR_FILE)
+    cache = _load_json(path)
+    dates = set(cache.get('dates', []))
+    today = date.today().isoformat()
+    try:
+        if not cache:
+            dates.update(_fetch_trade_dates(since, today, session))
+            cache = {'since': since, 'checked': today}
+        elif since < cache['since']:
+            dates.update(_fetch_trade_dates(since, cache['since'], session))
+            cache['since'] = since
+        if cache['checked'] < today:
+            dates.update(_fetch_trade_dates(max(dates) if dates else since, today, session))
+            cache['checked'] = today
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logging.error(f"❌ Календарь торгов MOEX не обновлен: {e}")
+        if not cache:
+            return None
+    if not dates:
+        return None
+    cache['dates'] = sorted(dates)
+    _save_json(path, cache)
+    calendar = np.array(cache['dates'], dtype='datetime64[D]')
+    calendar = calendar[calendar >= np.datetime64(since, 'D')]
+    return calendar if calendar.shape[0] else None
+
+def expected_days(calendar: np.ndarray, today: Optional[date] = None) -> np.ndarray:
+    """
+    Дни, за которые ожидаются бары: календарь плюс сегодняшний будний день, если его еще нет
+    в календаре (итоги дня публикуются после закрытия торгов).
+    """
+    today = np.datetime64(today or date.today(), 'D')
+    if calendar.shape[0] and today > calendar[-1] and today.astype(datetime).weekday() < 5:
+        return np.append(calendar, today)
+    return calendar
+
+# =============================================================================
+# --- БЛОК 3: ПЛАН ДОГРУЗКИ ---
+# =============================================================================
+def plan_ranges(stored: np.ndarray, days: np.ndarray, holes: Iterable[str] = (),
+                default_start: Optional[str] = None) -> Tuple[List[Range], np.ndarray]:
+    """
+    Диапазоны недостающих дат ряда.
+
+    Args:
+        stored: Даты сохраненных баров (datetime64).
+        days: Ожидаемые торговые дни по возрастанию (см. expected_days).
+        holes: Даты, которые источник уже не вернул; повторно не запрашиваются.
+        default_start: Начало загрузки для пустого ряда.
+
+    Returns:
+        (диапазоны, недостающие даты). Ряд проверяется с его первого бара: история до
+        начала торгов бумагой пропуском не считается. Последний диапазон, доходящий
+        до конца days, открыт (по последние данные источника).
+    """
+    stored = np.asarray(stored).astype('datetime64[D]')
+    if stored.shape[0] == 0:
+        start = np.datetime64(default_start, 'D') if default_start else days[0]
+        return [(str(start), None)], days[days >= start]
+    days = days[days >= stored.min()]
+    missing_idx = np.flatnonzero(~np.isin(days, stored) & ~np.isin(days, np.array(list(holes), dtype='datetime64[D]')))
+    if missing_idx.shape[0] == 0:
+        return [], days[:0]
+    # Новый запрос начинается, только если между пропусками больше GAP_MERGE_BARS баров
+    breaks = np.flatnonzero(np.diff(missing_idx) > GAP_MERGE_BARS + 1) + 1
+    starts = missing_idx[np.r_[0, breaks]]
+    ends = missing_idx[np.r_[breaks - 1, missing_idx.shape[0] - 1]]
+    ranges = [(str(days[s]), None if e == days.shape[0] - 1 else str(days[e])) for s, e in zip(starts, ends)]
+    return ranges, days[missing_idx]
+
+# =============================================================================
+# --- БЛОК 4: ДАТЫ БЕЗ ТОРГОВ ---
+# =============================================================================
+def _holes_key(ticker: str, timeframe: str, source: str) -> str:
+    return f"{ticker}|{timeframe}|{source}"
+
+def settled_until(calendar: np.ndarray) -> Optional[np.datetime64]:
+    """Последний торговый день, отсутствие данных за который можно запомнить (None - таких нет)."""
+    if calendar.shape[0] <= HOLE_SETTLEMENT_SESSIONS:
+        return None
+    return calendar[-HOLE_SETTLEMENT_SESSIONS - 1]
+
+def load_holes(store_dir: str = ohlcv_store.STORE_DIR) -> Dict[str, Dict[str, str]]:
+    """
+    {'тикер|таймфрейм|источник': {дата без бара: дата, когда это было установлено}}.
+    Записи прежнего формата (список дат) без даты проверки и будут перепроверены.
+    """
+    index = _load_json(os.path.join(store_dir, HOLES_FILE))
+    return {key: dict.fromkeys(days, '') if isinstance(days, list) else days for key, days in index.items()}
+
+def get_holes(index: Dict[str, Dict[str, str]], ticker: str, timeframe: str, source: str,
+              today: Optional[date] = None) -> List[str]:
+    """Даты без бара, проверенные не раньше чем HOLE_RECHECK_DAYS дней назад."""
+    fresh_since = ((today or date.today()) - timedelta(days=HOLE_RECHECK_DAYS)).isoformat()
+    return [day for day, checked in index.get(_holes_key(ticker, timeframe, source), {}).items() if checked >= fresh_since]
+
+def record_holes(updates: Dict[Tuple[str, str, str], Iterable[str]], store_dir: str = ohlcv_store.STORE_DIR,
+                 today: Optional[date] = None) -> None:
+    """Дописывает даты без данных по (тикер, таймфрейм, источник) с сегодняшней датой проверки."""
+    updates = {key: list(dates) for key, dates in updates.items()}
+    if not any(updates.values()):
+        return
+    checked = (today or date.today()).isoformat()
+    index = load_holes(store_dir)
+    for (ticker, timeframe, source), dates in updates.items():
+        days = index.setdefault(_holes_key(ticker, timeframe, source), {})
+        days.update(dict.fromkeys(dates, checked))
+    _save_json(os.path.join(store_dir, HOLES_FILE), index)
@@ -0,0 +1,235 @@
+# backtest.py
+# Версия: 1.1 (Пороги состояний берутся из indicator_state)
+# Назначение: Подбор RSI_ALERT_LEVEL, RSI_WARNING_LEVEL и PROXIMITY_PERCENTAGE листа Config
+# по всей истории локального хранилища (копия листа History_OHLCV). Состояния пар определяются
+# той же логикой, что в анализаторе (indicator_state.state_thresholds), но на каждом баре
+# истории и сразу для всех тикеров: RSI считается один раз, сигналы - маски NumPy.
+# Сетка параметров делится между процессами, ряды RSI и доходностей передаются через
+# разделяемую память.
+#
+# Запуск: python backtest.py --timeframes D1 --workers 8
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import indicator_kernels
+import ohlcv_store
+from indicator_state import state_thresholds
+from log_setup import setup_logging
+from technical_analyzer import get_worksheet, prepare_batch
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+HORIZONS = [1, 5, 10, 20]          # Горизонты форвардной доходности, баров
+MIN_BARS = 50                      # Анализатор не оценивает пары короче 50 свечей
+STATES = ['Oversold', 'Warning', 'Proximity']
+DEFAULT_ALERT_LEVELS = '15:40:1'   # начало:конец:шаг (включительно) или список через запятую
+DEFAULT_WARNING_LEVELS = '20:50:1'
+DEFAULT_PROXIMITY_PCTS = '0:30:5'
+RESULTS_FILE = 'backtest_results.csv'
+LOG_FILE = 'backtest.log'
+
+def parse_levels(spec: str) -> np.ndarray:
+    """'15:40:1' -> 15, 16, ..., 40; '25,30,35' -> 25, 30, 35."""
+    if ':' in spec:
+        start, stop, step = (float(part) for part in spec.split(':'))
+        return np.round(np.arange(start, stop + step / 2, step), 6)
+    return np.array([float(part) for part in spec.split(',') if part.strip()])
+
+def build_grid(alert_levels: np.ndarray, warning_levels: np.ndarray, proximity_pcts: np.ndarray) -> np.ndarray:
+    """
+    Все сочетания (уровень Oversold, уровень Warning, процент Proximity) с alert < warning.
+    Сетка упорядочена по уровню Oversold, поэтому непрерывные куски сетки повторно используют маски.
+    """
+    alert, warning, proximity = np.meshgrid(alert_levels, warning_levels, proximity_pcts, indexing='ij')
+    grid = np.column_stack([alert.ravel(), warning.ravel(), proximity.ravel()])
+    return grid[grid[:, 0] < grid[:, 1]]
+
+# =============================================================================
+# --- БЛОК 2: ПОДГОТОВКА РЯДОВ ---
+# =============================================================================
+def prepare_series(history_df: pd.DataFrame, horizons: List[int]) -> np.ndarray:
+    """
+    Строит матрицу рядов по всем парам (тикер, таймфрейм) подряд:
+      строка 0 - RSI_14 на каждом баре (NaN, пока у пары меньше MIN_BARS свечей, как в анализаторе);
+      строка 1 - 1.0 на первом баре каждой пары (граница групп для поиска входов в состояние);
+      строки 2.. - доходность Close через h баров для каждого горизонта (NaN за концом пары).
+    """
+    batch_df, offsets = prepare_batch(history_df)
+    close = batch_df['Close'].to_numpy(dtype=np.float64)
+    lengths = np.diff(offsets)
+    group_end = np.repeat(offsets[1:], lengths)
+    position = np.arange(close.shape[0]) - np.repeat(offsets[:-1], lengths)
+
+    series = np.full((2 + len(horizons), close.shape[0]), np.nan)
+    series[0] = indicator_kernels.rsi_series_batch(close, offsets)
+    series[0][position < MIN_BARS - 1] = np.nan
+    series[1] = position == 0
+    for row, horizon in enumerate(horizons, start=2):
+        target = np.arange(close.shape[0]) + horizon
+        inside = target < group_end
+        series[row][inside] = close[target[inside]] / close[inside] - 1.0
+    logging.info(f"☑️ Подготовлено {close.shape[0]} баров по {len(lengths)} парам.")
+    return series
+
+# =============================================================================
+# --- БЛОК 3: ОЦЕНКА СЕТКИ ---
+# =============================================================================
+def _interval_stats(rsi: np.ndarray, first_bar: np.ndarray, forward: np.ndarray,
+                    low: float, high: float) -> List[float]:
+    """
+    Статистика сигналов состояния low <= RSI < high. Сигнал - вход в состояние (бар в состоянии,
+    предыдущий бар пары - нет), как у алерта, который уходит при смене состояния.
+    Возвращает [число сигналов, доля роста и средняя доходность по каждому горизонту].
+    """
+    with np.errstate(invalid='ignore'):
+        in_state = (rsi >= low) & (rsi < high)
+    entries = in_state.copy()
+    entries[1:] &= ~in_state[:-1] | first_bar[1:]
+    stats = [float(entries.sum())]
+    for returns in forward:
+        returns = returns[entries]
+        returns = returns[~np.isnan(returns)]
+        if returns.shape[0]:
+            stats += [float((returns > 0).mean()), float(returns.mean())]
+        else:
+            stats += [np.nan, np.nan]
+    return stats
+
+def evaluate_grid(series: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """
+    Статистика каждого сочетания сетки по каждому состоянию: массив (len(grid), len(STATES), 1 + 2 * горизонты).
+    Интервал Oversold зависит только от уровня Oversold, Proximity - от Warning и процента, поэтому
+    маски одинаковых интервалов считаются один раз.
+    """
+    rsi, first_bar, forward = series[0], series[1].astype(bool), series[2:]
+    cache: Dict[Tuple[float, float], List[float]] = {}
+    result = np.empty((grid.shape[0], len(STATES), 1 + 2 * forward.shape[0]))
+    for i, (alert_pct, warning_pct, proximity_pct) in enumerate(grid):
+        config = {'RSI_ALERT_LEVEL': alert_pct, 'RSI_WARNING_LEVEL': warning_pct, 'PROXIMITY_PERCENTAGE': proximity_pct}
+        alert_level, warning_level, proximity_level = state_thresholds(config)
+        intervals = [(-np.inf, alert_level), (alert_level, warning_level), (warning_level, proximity_level)]
+        for j, interval in enumerate(intervals):
+            if interval not in cache:
+                cache[interval] = _interval_stats(rsi, first_bar, forward, *interval)
+            result[i, j] = cache[interval]
+    return result
+
+def _grid_worker(shm_name: str, shape: Tuple[int, int], grid: np.ndarray) -> np.ndarray:
+    """Рабочий процесс: читает ряды из разделяемой памяти без копирования и pickle."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        series = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        result = evaluate_grid(series, grid)
+        del series
+        return result
+    finally:
+        shm.close()
+
+def evaluate_grid_parallel(series: np.ndarray, grid: np.ndarray, workers: int) -> np.ndarray:
+    """Параллельный вариант evaluate_grid: сетка делится на непрерывные куски по числу процессов."""
+    chunks = [chunk for chunk in np.array_split(grid, workers) if chunk.shape[0]]
+    shm = shared_memory.SharedMemory(create=True, size=max(series.nbytes, 1))
+    try:
+        shared_series = np.ndarray(series.shape, dtype=np.float64, buffer=shm.buf)
+        shared_series[:] = series
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [executor.submit(_grid_worker, shm.name, series.shape, chunk) for chunk in chunks]
+            parts = [future.result() for future in futures]
+        del shared_series
+    finally:
+        shm.close()
+        shm.unlink()
+    return np.concatenate(parts)
+
+def results_frame(grid: np.ndarray, stats: np.ndarray, horizons: List[int]) -> pd.DataFrame:
+    """Таблица результатов: строка на (сочетание параметров, состояние)."""
+    columns = ['Signals']
+    for horizon in horizons:
+        columns += [f'Hit_Rate_{horizon}', f'Mean_Return_{horizon}']
+    frame = pd.DataFrame(stats.reshape(-1, stats.shape[2]), columns=columns)
+    frame.insert(0, 'State', np.tile(STATES, grid.shape[0]))
+    for position, name in enumerate(['RSI_ALERT_LEVEL', 'RSI_WARNING_LEVEL', 'PROXIMITY_PERCENTAGE']):
+        frame.insert(position, name, np.repeat(grid[:, position], len(STATES)))
+    frame['Signals'] = frame['Signals'].astype(int)
+    return frame
+
+# =============================================================================
+# --- БЛОК 4: ЗАПУСК ---
+# =============================================================================
+def main_backtest(timeframes: Optional[List[str]] = None, alert_levels: str = DEFAULT_ALERT_LEVELS,
+                  warning_levels: str = DEFAULT_WARNING_LEVELS, proximity_pcts: str = DEFAULT_PROXIMITY_PCTS,
+                  horizons: Optional[List[int]] = None, workers: int = 1,
+                  output: Optional[str] = RESULTS_FILE) -> Optional[pd.DataFrame]:
+    """
+    Перебирает сетку порогов по истории выбранных таймфреймов.
+
+    Args:
+        timeframes: Таймфреймы истории (None - все). Горизонты считаются в барах, поэтому
+                    смешивать таймфреймы имеет смысл только для грубой оценки.
+        alert_levels, warning_levels, proximity_pcts: Значения параметров Config (см. parse_levels).
+        horizons: Горизонты форвардной доходности, баров.
+        workers: Число процессов для перебора сетки (1 - последовательно).
+        output: CSV-файл для результатов (None - не сохранять).
+
+    Returns:
+        Таблица результатов (см. results_frame) или None, если истории нет.
+    """
+    horizons = horizons or HORIZONS
+    if ohlcv_store.is_empty():
+        history_sheet = get_worksheet('History_OHLCV')
+        if history_sheet is None:
+            return None
+        ohlcv_store.bootstrap_from_sheet(history_sheet)
+    history_df = ohlcv_store.read_history(timeframes=timeframes)
+    if history_df.empty:
+        logging.warning("История OHLCV пуста. Бэктест невозможен.")
+        return None
+
+    start = time.perf_counter()
+    series = prepare_series(history_df, horizons)
+    grid = build_grid(parse_levels(alert_levels), parse_levels(warning_levels), parse_levels(proximity_pcts))
+    logging.info(f"🔄 Перебираю {grid.shape[0]} сочетаний параметров ({workers} процессов)...")
+    if workers > 1 and grid.shape[0] > 1:
+        stats = evaluate_grid_parallel(series, grid, min(workers, grid.shape[0]))
+    else:
+        stats = evaluate_grid(series, grid)
+    results = results_frame(grid, stats, horizons)
+    logging.info(f"✅ Бэктест завершен за {time.perf_counter() - start:.1f} с.")
+
+    if output:
+        results.to_csv(output, index=False)
+        logging.info(f"💾 Результаты сохранены в '{output}'.")
+    key_column = f'Hit_Rate_{horizons[len(horizons) // 2]}'
+    best = results[(results['State'] == 'Oversold') & (results['Signals'] >= 30)]
+    best = best.drop_duplicates('RSI_ALERT_LEVEL').nlargest(5, key_column)
+    for _, row in best.iterrows():
+        logging.info(f"  - Oversold < {row['RSI_ALERT_LEVEL']:g}: сигналов {row['Signals']}, "
+                     f"{key_column} {row[key_column]:.1%}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бэктест порогов RSI листа Config по сохраненной истории.")
+    parser.add_argument('--timeframes', type=str, default='D1', help="Таймфреймы через запятую ('all' - все).")
+    parser.add_argument('--alert-levels', type=str, default=DEFAULT_ALERT_LEVELS, help='Значения RSI_ALERT_LEVEL: начало:конец:шаг или список через запятую.')
+    parser.add_argument('--warning-levels', type=str, default=DEFAULT_WARNING_LEVELS, help='Значения RSI_WARNING_LEVEL.')
+    parser.add_argument('--proximity', type=str, default=DEFAULT_PROXIMITY_PCTS, help='Значения PROXIMITY_PERCENTAGE.')
+    parser.add_argument('--horizons', type=str, default=','.join(map(str, HORIZONS)), help='Горизонты доходности в барах через запятую.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Число процессов для перебора сетки.')
+    parser.add_argument('--output', type=str, default=RESULTS_FILE, help='CSV-файл результатов.')
+    args = parser.parse_args()
+    setup_logging(LOG_FILE)
+    main_backtest(
+        timeframes=None if args.timeframes == 'all' else args.timeframes.split(','),
+        alert_levels=args.alert_levels, warning_levels=args.warning_levels, proximity_pcts=args.proximity,
+        horizons=[int(h) for h in args.horizons.split(',')], workers=args.workers, output=args.output
+    )
@@ -0,0 +1,79 @@
+# bench_startup.py
+# Версия: 1.0 (Замер времени холодного старта точек входа через -X importtime)
+# Назначение: Для каждой точки входа запускает чистый интерпретатор с -X importtime,
+# берет суммарное время импорта модуля и самые тяжелые вложенные импорты, а также
+# время полного запуска CLI 'main_runner.py --help'. С --budget-ms завершается
+# с кодом 1, если CLI стартует медленнее бюджета (для проверки в CI/cron).
+#
+# Пример: python bench_startup.py --repeat 5 --budget-ms 500
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+ENTRY_POINTS = ['main_runner', 'data_harvesters', 'macro_harvester', 'technical_analyzer', 'alerter']
+CLI_COMMAND = ['main_runner.py', '--help']
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def parse_importtime(stderr: str) -> List[Tuple[int, str, int]]:
+    """Разбирает вывод -X importtime в порядке вывода: [(вложенность, модуль, суммарное время, мкс)]."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        # Вложенность показана отступом по два пробела после разделителя
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(cumulative_us)))
+    return entries
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[str, int]]]:
+    """Импортирует module в новом процессе. Возвращает (суммарное время, мс; самые тяжелые прямые импорты)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    entries = parse_importtime(result.stderr)
+    # Модуль печатается после всех своих зависимостей; они идут после предыдущей записи верхнего уровня
+    position = max(i for i, (depth, name, _) in enumerate(entries) if depth == 0 and name == module)
+    start = max((i for i, (depth, _, _) in enumerate(entries[:position]) if depth == 0), default=-1) + 1
+    children = [(name, us) for depth, name, us in entries[start:position] if depth == 1]
+    heaviest = sorted(children, key=lambda item: item[1], reverse=True)[:5]
+    return entries[position][2] / 1000, heaviest
+
+def measure_cli() -> float:
+    """Полное время запуска и завершения 'python main_runner.py --help', мс."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable] + CLI_COMMAND, cwd=REPO_DIR, capture_output=True, check=True)
+    return (time.perf_counter() - started) * 1000
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер времени холодного старта точек входа ASIPM-AI.")
+    parser.add_argument('--repeat', type=int, default=3, help='Число повторов; берется лучший результат.')
+    parser.add_argument('--budget-ms', type=float, default=None, help='Бюджет старта CLI, мс. При превышении код возврата 1.')
+    args = parser.parse_args()
+
+    print(f"{'Точка входа':<22}{'импорт, мс':>12}  Самые тяжелые импорты")
+    for module in ENTRY_POINTS:
+        try:
+            runs = [measure_import(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{module:<22}{'ошибка':>12}  {e}")
+            continue
+        best_ms, heaviest = min(runs, key=lambda run: run[0])
+        details = ', '.join(f"{name} {us / 1000:.0f}" for name, us in heaviest)
+        print(f"{module:<22}{best_ms:>12.1f}  {details}")
+
+    cli_ms = min(measure_cli() for _ in range(args.repeat))
+    print(f"\nЗапуск '{' '.join(CLI_COMMAND)}': {cli_ms:.1f} мс")
+    if args.budget_ms is not None and cli_ms > args.budget_ms:
+        print(f"❌ Бюджет старта превышен: {cli_ms:.1f} мс > {args.budget_ms:.1f} мс")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# candle_buffer.py
+# Версия: 1.2 (Интервал 30 минут опрашивается свечами 10 минут)
+# Назначение: Для внутридневных таймфреймов хранится не вся история, а последние N свечей.
+# Буфер живет в памяти процесса (в режиме демона - между циклами), а на диске совпадает
+# с партицией ohlcv_store, обрезанной до N баров. Поэтому анализатор, индекс последних
+# дат и дашборд читают внутридневные данные так же, как дневные.
+
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import ohlcv_store
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+# Интервалы свечей ISS (минуты) -> таймфрейм хранилища
+CANDLE_TIMEFRAMES = {1: 'm1', 10: 'm10', 60: 'H1'}
+# Интервалы, которых нет у ISS -> интервал опрашиваемых свечей (m30 собирается из m10 локально)
+DERIVED_INTERVALS = {30: 10}
+DEFAULT_CAPACITY = 1000  # Баров в буфере: больше окна самого длинного индикатора (SMA_50) с запасом
+# m1 хранит два полных торговых дня (утренняя + основная + вечерняя сессии - около 1020 минут),
+# чтобы из него можно было собрать текущий дневной бар
+TIMEFRAME_CAPACITY = {'m1': 2000}
+CANDLE_SOURCE = 'MOEX_CANDLES'
+
+# =============================================================================
+# --- БЛОК 2: КОЛЬЦЕВОЙ БУФЕР ---
+# =============================================================================
+class CandleRing:
+    """
+    Кольцевой буфер фиксированной емкости из свечей в формате OHLCV_DTYPE, упорядоченных по времени.
+    Добавление свечи - O(1), старые свечи вытесняются новыми.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._data = np.empty(capacity, dtype=ohlcv_store.OHLCV_DTYPE)
+        self._start = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _last_index(self) -> int:
+        return (self._start + self._count - 1) % self.capacity
+
+    def last_timestamp(self) -> Optional[pd.Timestamp]:
+        if self._count == 0:
+            return None
+        return pd.Timestamp(self._data['Date'][self._last_index()])
+
+    def extend(self, candles: np.ndarray) -> int:
+        """
+        Добавляет свечи, отсортированные по времени. Свеча с временем последней
+        (еще формирующаяся при прошлом опросе) заменяет ее, более старые игнорируются.
+        Возвращает число новых свечей.
+        """
+        added = 0
+        for candle in candles:
+            if self._count:
+                last = self._last_index()
+                last_ts = self._data['Date'][last]
+                if candle['Date'] < last_ts:
+                    continue
+                if candle['Date'] == last_ts:
+                    self._data[last] = candle
+                    continue
+            if self._count < self.capacity:
+                self._data[(self._start + self._count) % self.capacity] = candle
+                self._count += 1
+            else:
+                self._data[self._start] = candle
+                self._start = (self._start + 1) % self.capacity
+            added += 1
+        return added
+
+    def to_array(self) -> np.ndarray:
+        """Свечи буфера по возрастанию времени (копия)."""
+        indices = (self._start + np.arange(self._count)) % self.capacity
+        return self._data[indices]
+
+    @classmethod
+    def from_array(cls, data: np.ndarray, capacity: int = DEFAULT_CAPACITY) -> 'CandleRing':
+        ring = cls(capacity)
+        tail = np.asarray(data[-capacity:])
+        ring._data[:tail.shape[0]] = tail
+        ring._count = tail.shape[0]
+        return ring
+
+# =============================================================================
+# --- БЛОК 3: БУФЕРЫ ПРОЦЕССА ---
+# =============================================================================
+_rings: Dict[Tuple[str, str], CandleRing] = {}
+_rings_lock = threading.Lock()
+
+def capacity_for(timeframe: str) -> int:
+    return TIMEFRAME_CAPACITY.get(timeframe, DEFAULT_CAPACITY)
+
+def get_ring(ticker: str, timeframe: str, capacity: Optional[int] = None,
+             store_dir: str = ohlcv_store.STORE_DIR) -> CandleRing:
+    """Буфер пары: при первом обращении восстанавливается из партиции хранилища."""
+    key = (ticker, timeframe)
+    capacity = capacity or capacity_for(timeframe)
+    with _rings_lock:
+        if key not in _rings:
+            _rings[key] = CandleRing.from_array(ohlcv_store.read_partition(ticker, timeframe, store_dir), capacity)
+        return _rings[key]
+
+def append_candles(ticker: str, timeframe: str, candles: pd.DataFrame,
+                   store_dir: str = ohlcv_store.STORE_DIR) -> int:
+    """
+    Дописывает свечи (столбцы Date, Open, High, Low, Close, Volume) в буфер пары
+    и атомарно сохраняет буфер как партицию хранилища. Возвращает число новых свечей.
+    """
+    if candles.empty:
+        return 0
+    new_data = np.empty(len(candles), dtype=ohlcv_store.OHLCV_DTYPE)
+    new_data['Date'] = pd.to_datetime(candles['Date'], errors='coerce').values.astype('datetime64[s]')
+    for col in ohlcv_store.PRICE_COLUMNS:
+        new_data[col] = pd.to_numeric(candles[col], errors='coerce') if col in candles.columns else np.nan
+    new_data = new_data[~np.isnat(new_data['Date'])]
+    return append_array(ticker, timeframe, new_data[np.argsort(new_data['Date'], kind='stable')], store_dir)
+
+def append_array(ticker: str, timeframe: str, new_data: np.ndarray,
+                 store_dir: str = ohlcv_store.STORE_DIR) -> int:
+    """Как append_candles, но для уже отсортированного массива OHLCV_DTYPE."""
+    if new_data.shape[0] == 0:
+        return 0
+    ring = get_ring(ticker, timeframe, store_dir=store_dir)
+    added = ring.extend(new_data)
+    ohlcv_store.replace_partition(ticker, timeframe, ring.to_array(), CANDLE_SOURCE, store_dir)
+    return added
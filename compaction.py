@@ -0,0 +1,160 @@
+# compaction.py
+# Версия: 1.2 (Уточнено описание порядка строк листа)
+# Назначение: Лист 'History_OHLCV' со временем только растет: макро-сборщик повторно дописывает
+# перекрывающиеся 7-дневные окна, полная загрузка - всю историю, внутридневные бары не стареют.
+# Задание уплотнения держит размер листа и хранилища ограниченным:
+#   - дубли по (Date, Timeframe, Ticker) удаляются, остается последняя дописанная строка;
+#   - бары старше срока хранения своего таймфрейма удаляются;
+#   - строки, отсортированные по дате, пишутся порциями во временный лист и переносятся на
+#     место одним запросом (конец листа - по-прежнему самые свежие строки).
+#
+# Запуск: python main_runner.py --compact (под блокировкой конвейера)
+
+import logging
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+import ohlcv_store
+from log_setup import setup_logging
+from sheets_context import HISTORY_SHEET, SheetsContext, get_default_context
+from sheets_io import get_sheets_io
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+# Срок хранения в днях; таймфреймы без срока (D1 и др.) хранятся полностью.
+# Переопределяется параметрами Config вида RETENTION_DAYS_m1 (0 - хранить все).
+RETENTION_DAYS = {'m1': 30, 'm10': 180, 'H1': 365}
+RETENTION_PARAM_PREFIX = 'RETENTION_DAYS_'
+REWRITE_CHUNK_ROWS = 5000  # Строк в одном запросе записи во временный лист
+REWRITE_SHEET = f'{HISTORY_SHEET}_compaction'  # Временный лист перезаписи
+
+def retention_cutoffs(config: Optional[Dict[str, Any]] = None,
+                      now: Optional[pd.Timestamp] = None) -> Dict[str, pd.Timestamp]:
+    """Граница хранения по таймфреймам: бары раньше нее удаляются."""
+    days = dict(RETENTION_DAYS)
+    for key, value in (config or {}).items():
+        if str(key).startswith(RETENTION_PARAM_PREFIX) and str(value).strip() != '':
+            days[str(key)[len(RETENTION_PARAM_PREFIX):]] = int(float(str(value).replace(',', '.')))
+    now = now or pd.Timestamp.now().floor('D')
+    return {timeframe: now - pd.Timedelta(days=value) for timeframe, value in days.items() if value > 0}
+
+# =============================================================================
+# --- БЛОК 2: УПЛОТНЕНИЕ СТРОК ЛИСТА ---
+# =============================================================================
+def compact_records(records: List[Dict[str, Any]], cutoffs: Dict[str, pd.Timestamp]) -> List[List[Any]]:
+    """
+    Уплотняет строки листа истории: без дублей (Date, Timeframe, Ticker) - побеждает строка ниже,
+    без баров старше срока хранения, по возрастанию даты. Строки с нечитаемой датой отбрасываются.
+    Значения ячеек возвращаются как были прочитаны.
+    """
+    if not records:
+        return []
+    df = pd.DataFrame(records).reindex(columns=ohlcv_store.HISTORY_HEADERS)
+    # Дневные и внутридневные даты записаны в разных форматах
+    df['_ts'] = pd.to_datetime(df['Date'], errors='coerce', format='mixed')
+    unreadable = int(df['_ts'].isna().sum())
+    if unreadable:
+        logging.warning(f"  - ⚠️ {unreadable} строк с нечитаемой датой будут удалены.")
+    df = df.dropna(subset=['_ts'])
+    df['Timeframe'] = df['Timeframe'].astype(str)
+    df['Ticker'] = df['Ticker'].astype(str)
+    df = df.drop_duplicates(subset=['_ts', 'Timeframe', 'Ticker'], keep='last')
+
+    cutoff = pd.to_datetime(df['Timeframe'].map(cutoffs))
+    df = df[cutoff.isna() | (df['_ts'] >= cutoff)]
+    df = df.sort_values(['_ts', 'Timeframe', 'Ticker'], kind='mergesort')
+    values = df[ohlcv_store.HISTORY_HEADERS].astype(object)
+    return values.where(values.notna(), '').values.tolist()
+
+def rewrite_sheet(spreadsheet, history_sheet, rows: List[List[Any]], chunk_rows: int = REWRITE_CHUNK_ROWS) -> None:
+    """
+    Заменяет строки листа под заголовком на rows. Строки пишутся порциями во временный лист,
+    затем один batch_update копирует их на место и обрезает лист до новой длины. batch_update
+    выполняется целиком или не выполняется, поэтому при сбое на любом шаге лист остается прежним.
+    """
+    sheets_io = get_sheets_io()
+    width = len(ohlcv_store.HISTORY_HEADERS)
+    # Пустой результат переносится одной пустой строкой: она затирает вторую строку листа
+    row_total = max(len(rows), 1)
+    stale = [sheet for sheet in sheets_io.read(spreadsheet.worksheets) if sheet.title == REWRITE_SHEET]
+    for sheet in stale:
+        sheets_io.write(spreadsheet.del_worksheet, sheet)
+    temp_sheet = sheets_io.write(spreadsheet.add_worksheet, title=REWRITE_SHEET, rows=row_total, cols=width)
+    try:
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows[start:start + chunk_rows]
+            sheets_io.write(temp_sheet.update, f"A{start + 1}", chunk, value_input_option='USER_ENTERED', row_count=len(chunk))
+        body = {'requests': [
+            {'copyPaste': {
+                'source': {'sheetId': temp_sheet.id, 'startRowIndex': 0, 'endRowIndex': row_total,
+                           'startColumnIndex': 0, 'endColumnIndex': width},
+                'destination': {'sheetId': history_sheet.id, 'startRowIndex': 1, 'endRowIndex': row_total + 1,
+                                'startColumnIndex': 0, 'endColumnIndex': width},
+                'pasteType': 'PASTE_VALUES',
+            }},
+            {'updateSheetProperties': {
+                'properties': {'sheetId': history_sheet.id, 'gridProperties': {'rowCount': row_total + 1}},
+                'fields': 'gridProperties.rowCount',
+            }},
+        ]}
+        sheets_io.write(spreadsheet.batch_update, body, row_count=len(rows))
+    finally:
+        try:
+            sheets_io.write(spreadsheet.del_worksheet, temp_sheet)
+        except Exception as e:
+            logging.warning(f"  - ⚠️ Временный лист '{REWRITE_SHEET}' не удален ({e}), будет удален при следующем запуске.")
+
+# =============================================================================
+# --- БЛОК 3: ЗАДАНИЕ УПЛОТНЕНИЯ ---
+# =============================================================================
+def main_compaction(ctx: Optional[SheetsContext] = None, config: Optional[Dict[str, Any]] = None,
+                    dry_run: bool = False) -> Optional[Dict[str, int]]:
+    """
+    Уплотняет лист 'History_OHLCV' и локальное хранилище.
+
+    Args:
+        ctx: Контекст Google Sheets; если не передан, используется контекст процесса.
+        config: Параметры листа Config; если не переданы, читаются из таблицы.
+        dry_run: Только посчитать, сколько строк будет удалено, ничего не перезаписывая.
+
+    Returns:
+        Статистика {'rows_before', 'rows_after', 'partitions', 'bars_removed'} или None при ошибке доступа.
+    """
+    logging.info("\n" + "="*50)
+    logging.info("--- 🗜️ ASIPM-AI: Уплотнение истории OHLCV 🗜️ ---")
+    logging.info("="*50)
+    ctx = ctx or get_default_context()
+    if ctx is None:
+        logging.critical("Нет доступа к Google Sheets. Уплотнение отменено.")
+        return None
+    sheets_io = get_sheets_io()
+    history_sheet = ctx.worksheet(HISTORY_SHEET)
+    if config is None:
+        config = {item['Parameter']: item['Value'] for item in sheets_io.get_all_records(ctx.worksheet('Config'))}
+    cutoffs = retention_cutoffs(config)
+    logging.info("⚙️ Сроки хранения: " + (", ".join(f"{tf} с {ts:%Y-%m-%d}" for tf, ts in sorted(cutoffs.items())) or "без ограничений"))
+
+    records = sheets_io.get_all_records(history_sheet)
+    rows = compact_records(records, cutoffs)
+    stats = {'rows_before': len(records), 'rows_after': len(rows), 'partitions': 0, 'bars_removed': 0}
+    logging.info(f"🔄 '{HISTORY_SHEET}': {len(records)} строк -> {len(rows)} после уплотнения.")
+    if dry_run:
+        return stats
+
+    if len(rows) < len(records):
+        rewrite_sheet(ctx.spreadsheet, history_sheet, rows)
+        logging.info(f"✅ Лист '{HISTORY_SHEET}' перезаписан ({len(records) - len(rows)} строк удалено).")
+    else:
+        logging.info(f"✅ Лист '{HISTORY_SHEET}' уже уплотнен.")
+
+    store_stats = ohlcv_store.compact(cutoffs)
+    stats['partitions'], stats['bars_removed'] = store_stats['partitions'], store_stats['removed']
+    logging.info(f"✅ Хранилище: перезаписано партиций {store_stats['partitions']}, удалено баров {store_stats['removed']}.")
+    logging.info(f"📊 Google Sheets API: {sheets_io.report()}")
+    return stats
+
+if __name__ == "__main__":
+    setup_logging("compaction.log")
+    main_compaction()
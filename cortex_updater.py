@@ -7,8 +7,7 @@ from google.oauth2.service_account import Credentials
 import logging
 from datetime import datetime
 
-# --- НАСТРОЙКА ЛОГИРОВАНИЯ ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from log_setup import setup_logging
 
 # --- КОНФИГУРАЦИЯ ---
 GSHEETS_CREDS = 'credentials.json'
@@ -53,4 +52,5 @@ def main():
     logging.info("--- ✅ Работа логгера завершена ---")
 
 if __name__ == "__main__":
+    setup_logging()
     main()
\ No newline at end of file
@@ -1,13 +1,15 @@
 # dashboard.py
-# Версия: 2.1 (Стабильная, с исправлением KeyError и унификацией)
+# Версия: 2.4 (Листы читаются через общий контекст sheets_context и планировщик квот sheets_io)
 
 import streamlit as st
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import datetime
 from typing import Tuple, Optional
 
+import ohlcv_store
+from sheets_context import HISTORY_SHEET, get_default_context
+from sheets_io import get_sheets_io
+
 # --- НАСТРОЙКИ СТРАНИЦЫ ---
 st.set_page_config(
     page_title="ASIPM-AI: Центр Управления Полетами",
@@ -19,13 +21,22 @@ st.set_page_config(
 @st.cache_data(ttl=300)
 def load_data_from_gsheets() -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame], Optional[pd.DataFrame]]:
     try:
-        creds = Credentials.from_service_account_file('credentials.json', scopes=['https://www.googleapis.com/auth/spreadsheets'])
-        client = gspread.authorize(creds)
-        spreadsheet = client.open_by_url("https://docs.google.com/spreadsheets/d/1qBYS_DhGNsTo-Dnph3g_H27aHQOoY0EOcmCIKarb7Zc/")
-        
-        analysis_df = pd.DataFrame(spreadsheet.worksheet('Analysis').get_all_records())
-        holdings_df = pd.DataFrame(spreadsheet.worksheet('Holdings').get_all_records())
-        history_df = pd.DataFrame(spreadsheet.worksheet('History_OHLCV').get_all_records())
+        ctx = get_default_context()
+        if ctx is None:
+            st.error("Нет доступа к Google Sheets: проверьте credentials.json.")
+            return None, None, None
+        # Analysis и Holdings - одним запросом batch_get
+        records = ctx.batch_get_records(['Analysis', 'Holdings'])
+        analysis_df = pd.DataFrame(records['Analysis'])
+        holdings_df = pd.DataFrame(records['Holdings'])
+        # Локальное хранилище - основной путь; лист читается, только если дашборд запущен без него.
+        # Тренды строятся по дневным барам: внутридневные не читаются
+        if not ohlcv_store.is_empty():
+            history_df = ohlcv_store.read_history(timeframes=['D1'])
+        else:
+            history_df = pd.DataFrame(get_sheets_io().get_all_records(ctx.worksheet(HISTORY_SHEET)))
+            if 'Timeframe' in history_df.columns:
+                history_df = history_df[history_df['Timeframe'] == 'D1']
         
         return analysis_df, holdings_df, history_df
     except Exception as e:
@@ -1,50 +1,45 @@
 # data_harvesters.py
-# Версия: 2.4 (исправлена инициализация логирования)
+# Версия: 3.14 (Убраны неиспользуемые реэкспорты авторизации из sheets_context)
 
-import gspread
-from google.oauth2.service_account import Credentials
 import pandas as pd
 import requests
 from datetime import datetime, timedelta
+import json
 import logging
+import os
 import numpy as np
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
-# ИЗМЕНЕНО: Инициализация логирования перенесена на уровень модуля
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("harvester.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import backfill_planner
+import candle_buffer
+import ohlcv_store
+import resampler
+from http_client import get_shared_session
+from log_setup import setup_logging
+from sheets_io import get_sheets_io
+from sheets_context import SheetsContext, get_default_context
 
 # ... (остальной код модуля без изменений) ...
 # =============================================================================
 # --- БЛОК 1: КОНФИГУРАЦИЯ И ПОДКЛЮЧЕНИЕ ---
 # =============================================================================
-CREDS_FILE = 'credentials.json'
-SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1qBYS_DhGNsTo-Dnph3g_H27aHQOoY0EOcmCIKarb7Zc/"
-SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file']
-
-def get_gsheets_client(creds_file=CREDS_FILE, scope=SCOPE) -> gspread.Client | None:
-    try:
-        creds = Credentials.from_service_account_file(creds_file, scopes=scope)
-        client = gspread.authorize(creds)
-        logging.info("✅ Авторизация в Google Sheets прошла успешно.")
-        return client
-    except FileNotFoundError:
-        logging.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Файл credentials.json не найден.")
-        return None
-    except Exception as e:
-        logging.error(f"❌ Ошибка авторизации Google: {e}")
-        return None
+HARVEST_WORKERS = 8  # Параллельных запросов к источникам (доп. лимит на хост - в http_client)
+MOEX_PAGE_WORKERS = 4  # Параллельных запросов страниц истории одного тикера
+# Режим сбора по датам: доска -> (engine, market) в ISS и тип актива -> доска
+BOARD_MARKETS = {'TQBR': ('stock', 'shares'), 'TQOB': ('stock', 'bonds'), 'CETS': ('currency', 'selt')}
+ASSET_TYPE_BOARDS = {'Stock_MOEX': 'TQBR', 'Bond_MOEX': 'TQOB', 'Currency_MOEX': 'CETS'}
+DATE_MODE_MAX_DAYS = 14  # Тикеры с более глубоким пропуском догружаются по одному
+CANDLES_PAGE_SIZE = 500  # ISS отдает свечи страницами по 500 строк
+TRADING_MINUTES_PER_DAY = 14 * 60  # Основная и вечерняя сессии MOEX, для глубины первичной загрузки свечей
+FULL_HISTORY_DAYS = 365 * 2  # Глубина полной загрузки и первичной загрузки нового тикера
+# Внутридневные строки, не записанные в лист из-за сбоя; лежит в корне STORE_DIR
+PENDING_SHEET_ROWS_FILE = 'pending_sheet_rows.json'
 
 # =============================================================================
 # --- БЛОК 2: ФУНКЦИИ-СБОРЩИКИ ---
 # =============================================================================
-def get_cbr_history(ticker: str, start_date: str) -> pd.DataFrame:
+def get_cbr_history(ticker: str, start_date: str, session: requests.Session | None = None) -> pd.DataFrame:
     logging.info(f"  - Запрос истории для {ticker} (ЦБ РФ) с даты {start_date}...")
     currency_codes = {'USD/RUB': 'R01235', 'EUR/RUB': 'R01239', 'CNY/RUB': 'R01375'}
     currency_id = currency_codes.get(ticker)
@@ -55,7 +50,7 @@ def get_cbr_history(ticker: str, start_date: str) -> pd.DataFrame:
     end_dt = datetime.now()
     url = f"http://www.cbr.ru/scripts/XML_dynamic.asp?date_req1={start_dt.strftime('%d/%m/%Y')}&date_req2={end_dt.strftime('%d/%m/%Y')}&VAL_NM_RQ={currency_id}"
     try:
-        response = requests.get(url, timeout=15)
+        response = (session or requests).get(url, timeout=15)
         response.raise_for_status()
         root = ET.fromstring(response.content)
         records = []
@@ -74,20 +69,58 @@ def get_cbr_history(ticker: str, start_date: str) -> pd.DataFrame:
         logging.error(f"    - ❌ Ошибка при получении истории от ЦБ РФ для {ticker}: {e}")
         return pd.DataFrame()
 
-def get_moex_history(ticker: str, start_date: str, market: str, board: str, interval: int) -> pd.DataFrame:
-    logging.info(f"  - Запрос истории для {ticker} (рынок: {market}, доска: {board}) с даты {start_date}, интервал: {interval}...")
-    url = f"https://iss.moex.com/iss/history/engines/{market}/markets/shares/boards/{board}/securities/{ticker}.json?from={start_date}&interval={interval}&iss.meta=off"
+def _get_moex_page(url: str, start: int, session: requests.Session | None) -> dict:
+    """Запрашивает одну страницу истории ISS вместе с блоком курсора."""
+    params = {'start': start, 'iss.meta': 'off', 'iss.only': 'history,history.cursor'}
+    response = (session or requests).get(url, params=params, timeout=15)
+    response.raise_for_status()
+    return response.json()
+
+def _get_moex_all_pages(url: str, session: requests.Session | None, label: str) -> tuple[list, list]:
+    """
+    Читает все страницы блока history. Первая страница запрашивается вместе с history.cursor,
+    остальные - параллельно; строки возвращаются в исходном порядке страниц.
+    """
+    first_page = _get_moex_page(url, 0, session)
+    data = first_page.get('history', {})
+    if not data.get('data'):
+        return data.get('columns', []), []
+    pages = [data['data']]
+
+    cursor = first_page.get('history.cursor', {})
+    if cursor.get('data'):
+        cursor_row = dict(zip(cursor['columns'], cursor['data'][0]))
+        total, page_size = int(cursor_row['TOTAL']), int(cursor_row['PAGESIZE'])
+        starts = list(range(page_size, total, page_size))
+        if starts:
+            logging.info(f"    - 📄 {label}: {total} строк, догружаю еще {len(starts)} стр.")
+            with ThreadPoolExecutor(max_workers=MOEX_PAGE_WORKERS) as executor:
+                for page in executor.map(lambda start: _get_moex_page(url, start, session), starts):
+                    pages.append(page.get('history', {}).get('data', []))
+    return data['columns'], [row for page in pages for row in page]
+
+def get_moex_history(ticker: str, start_date: str, market: str, board: str, interval: int,
+                     session: requests.Session | None = None, end_date: str | None = None) -> pd.DataFrame:
+    """
+    Загружает историю тикера с MOEX ISS целиком, со всех страниц (ISS отдает по 100 строк).
+    end_date ограничивает период (включительно), иначе - до последних данных.
+    Если источник ответил без строк, возвращается пустой DataFrame со столбцом Date,
+    при ошибке - пустой DataFrame без столбцов.
+    """
+    period = f"с даты {start_date}" + (f" по {end_date}" if end_date else "")
+    logging.info(f"  - Запрос истории для {ticker} (рынок: {market}, доска: {board}) {period}, интервал: {interval}...")
+    url = f"https://iss.moex.com/iss/history/engines/{market}/markets/shares/boards/{board}/securities/{ticker}.json?from={start_date}&interval={interval}"
     if market == 'currency':
-        url = f"https://iss.moex.com/iss/history/engines/{market}/markets/selt/boards/{board}/securities/{ticker}.json?from={start_date}&interval={interval}&iss.meta=off"
+        url = f"https://iss.moex.com/iss/history/engines/{market}/markets/selt/boards/{board}/securities/{ticker}.json?from={start_date}&interval={interval}"
+    if end_date:
+        url += f"&till={end_date}"
     try:
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        data = response.json().get('history', {})
-        if not data.get('data'):
+        cols, rows = _get_moex_all_pages(url, session, ticker)
+        if not rows:
             logging.warning(f"    - ⚠️ Для {ticker} не вернулась история (интервал: {interval}).")
-            return pd.DataFrame()
-        cols = data['columns']
-        df = pd.DataFrame(data['data'], columns=cols)
+            return pd.DataFrame(columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+
+        df = pd.DataFrame(rows, columns=cols)
         rename_map = {'TRADEDATE': 'Date', 'OPEN': 'Open', 'HIGH': 'High', 'LOW': 'Low', 'CLOSE': 'Close', 'VOLUME': 'Volume', 'VOLRUR': 'Volume'}
         df.rename(columns=rename_map, inplace=True)
         required_cols = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
@@ -101,76 +134,356 @@ def get_moex_history(ticker: str, start_date: str, market: str, board: str, inte
         logging.error(f"    - ❌ Неизвестная ошибка при получении истории для {ticker}: {e}")
         return pd.DataFrame()
 
+def get_moex_board_day(board: str, date: str, session: requests.Session | None = None) -> pd.DataFrame:
+    """Загружает дневные итоги сразу по всем бумагам доски за одну дату (со всех страниц)."""
+    engine, market = BOARD_MARKETS[board]
+    url = f"https://iss.moex.com/iss/history/engines/{engine}/markets/{market}/boards/{board}/securities.json?date={date}"
+    try:
+        cols, rows = _get_moex_all_pages(url, session, f"{board} {date}")
+    except Exception as e:
+        logging.error(f"    - ❌ Ошибка при получении итогов доски {board} за {date}: {e}")
+        return pd.DataFrame()
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows, columns=cols)
+    rename_map = {'TRADEDATE': 'Date', 'OPEN': 'Open', 'HIGH': 'High', 'LOW': 'Low', 'CLOSE': 'Close', 'VOLUME': 'Volume'}
+    # У валютной доски объем в столбце VOLRUR
+    if 'VOLUME' not in df.columns:
+        rename_map['VOLRUR'] = 'Volume'
+    df = df.rename(columns=rename_map)
+    return df[[col for col in ['SECID', 'Date', 'Open', 'High', 'Low', 'Close', 'Volume'] if col in df.columns]]
+
+def harvest_by_date(jobs: list[tuple[str, str, str]], session: requests.Session | None,
+                    max_workers: int = HARVEST_WORKERS,
+                    missing_dates: dict[str, list[str]] | None = None) -> dict[str, pd.DataFrame]:
+    """
+    Сбор дневной дельты "по датам": каждая недостающая дата каждой доски запрашивается
+    один раз, строки затем раздаются всем отслеживаемым тикерам доски.
+    Обрабатывает только MOEX-тикеры с неглубоким пропуском; остальные возвращаются вызывающему.
+    missing_dates - точные недостающие даты тикеров по календарю торгов; для тикеров без них
+    запрашиваются все будние дни с даты начала.
+    """
+    today = datetime.now().date()
+    oldest_allowed = today - timedelta(days=DATE_MODE_MAX_DAYS)
+    missing_dates = missing_dates or {}
+    board_dates: dict[str, dict[str, set[str]]] = {}
+    for ticker, asset_type, start_date in jobs:
+        board = ASSET_TYPE_BOARDS.get(asset_type)
+        if board and datetime.strptime(start_date, '%Y-%m-%d').date() >= oldest_allowed:
+            # Без календаря выходные пропускаем сразу; праздники просто вернут пустой ответ
+            dates = missing_dates.get(ticker) or [day.strftime('%Y-%m-%d') for day in pd.bdate_range(start_date, today)]
+            board_dates.setdefault(board, {})[ticker] = set(dates)
+
+    requests_plan = []
+    for board, ticker_dates in board_dates.items():
+        for day in sorted(set().union(*ticker_dates.values())):
+            requests_plan.append((board, day))
+    logging.info(f"📅 Сбор по датам: {len(requests_plan)} запросов (доска, дата) на {sum(len(t) for t in board_dates.values())} тикеров.")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        day_frames = list(executor.map(lambda plan: get_moex_board_day(*plan, session=session), requests_plan))
+
+    rows_by_ticker: dict[str, list[pd.DataFrame]] = {t: [] for dates in board_dates.values() for t in dates}
+    for (board, date), day_df in zip(requests_plan, day_frames):
+        if day_df.empty or 'SECID' not in day_df.columns:
+            continue
+        watched = [t for t, dates in board_dates[board].items() if date in dates]
+        for ticker, ticker_rows in day_df[day_df['SECID'].isin(watched)].groupby('SECID', sort=False):
+            rows_by_ticker[ticker].append(ticker_rows.drop(columns='SECID'))
+
+    return {
+        ticker: pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        for ticker, frames in rows_by_ticker.items()
+    }
+
+def get_moex_candles(ticker: str, board: str, interval: int, since: str,
+                     session: requests.Session | None = None) -> pd.DataFrame:
+    """
+    Загружает свечи интервала interval (1, 10, 60 минут) из ISS /candles начиная с момента since
+    ('YYYY-MM-DD HH:MM:SS', включительно) со всех страниц. Date - время начала свечи.
+    """
+    engine, market = BOARD_MARKETS[board]
+    url = f"https://iss.moex.com/iss/engines/{engine}/markets/{market}/boards/{board}/securities/{ticker}/candles.json"
+    pages = []
+    columns: list = []
+    start = 0
+    try:
+        while True:
+            params = {'from': since, 'interval': interval, 'start': start, 'iss.meta': 'off', 'iss.only': 'candles'}
+            response = (session or requests).get(url, params=params, timeout=15)
+            response.raise_for_status()
+            block = response.json().get('candles', {})
+            columns, rows = block.get('columns', []), block.get('data', [])
+            if rows:
+                pages.append(rows)
+            if len(rows) < CANDLES_PAGE_SIZE:
+                break
+            start += len(rows)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"    - ❌ Сетевая ошибка при получении свечей для {ticker}: {e}")
+        return pd.DataFrame()
+    if not pages:
+        return pd.DataFrame()
+    df = pd.DataFrame([row for page in pages for row in page], columns=columns)
+    df = df.rename(columns={'begin': 'Date', 'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'})
+    return df[['Date', 'Open', 'High', 'Low', 'Close', 'Volume']]
+
+def harvest_intraday(jobs: list[tuple[str, str, str]], interval: int, session: requests.Session | None,
+                     max_workers: int = HARVEST_WORKERS) -> list[list]:
+    """
+    Внутридневной опрос: для каждого MOEX-тикера запрашиваются только свечи начиная
+    с последней свечи его кольцевого буфера (она могла еще формироваться), и буфер дописывается.
+    Старшие таймфреймы (до D1) затем собираются из буфера локально, без запросов к ISS.
+    Возвращает строки формата листа History_OHLCV с новыми и обновленными барами всех таймфреймов.
+    """
+    timeframe = candle_buffer.CANDLE_TIMEFRAMES[interval]
+    # Пустой буфер заполняем на всю емкость: торговые дни плюс запас на выходные
+    backfill_days = -(-candle_buffer.capacity_for(timeframe) * interval // TRADING_MINUTES_PER_DAY) + 3
+    initial_since = (datetime.now() - timedelta(days=backfill_days)).strftime('%Y-%m-%d 00:00:00')
+
+    plan = []
+    for ticker, asset_type, _ in jobs:
+        board = ASSET_TYPE_BOARDS.get(asset_type)
+        if board is None:
+            logging.info(f"  - ℹ️ Для {ticker} ({asset_type}) внутридневные свечи недоступны. Пропускаю.")
+            continue
+        last_ts = candle_buffer.get_ring(ticker, timeframe).last_timestamp()
+        plan.append((ticker, board, last_ts.strftime('%Y-%m-%d %H:%M:%S') if last_ts is not None else initial_since))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(lambda job: get_moex_candles(job[0], job[1], interval, job[2], session=session), plan))
+
+    new_rows = []
+    for (ticker, _, since), candles in zip(plan, frames):
+        if candles.empty:
+            continue
+        added = candle_buffer.append_candles(ticker, timeframe, candles)
+        logging.info(f"  - 🕯️ {ticker} {timeframe}: получено свечей с {since}: {len(candles)}, из них новых {added}.")
+        for record in candles.to_dict('records'):
+            new_rows.append([record['Date'], timeframe, ticker, record['Open'], record['High'], record['Low'], record['Close'], record['Volume']])
+        new_rows.extend(resampler.resample_chain(ticker, timeframe))
+    return new_rows
+
+def asset_source(asset_type: str) -> str:
+    """Источник данных для индекса последних дат."""
+    return 'CBR' if asset_type == 'Currency_CBR' else 'MOEX'
+
+def fetch_ticker_history(ticker: str, asset_type: str, start_date: str, interval: int,
+                         session: requests.Session | None = None, end_date: str | None = None) -> pd.DataFrame:
+    """Выбирает источник по типу актива и загружает историю одного тикера (end_date - только для MOEX)."""
+    if asset_type == 'Currency_CBR':
+        return get_cbr_history(ticker, start_date, session=session)
+
+    market, board = None, None
+    if asset_type == 'Stock_MOEX': market, board = 'stock', 'TQBR'
+    elif asset_type == 'Bond_MOEX': market, board = 'stock', 'TQOB'
+    elif asset_type == 'Currency_MOEX': market, board = 'currency', 'CETS'
+
+    if all([market, board]):
+        return get_moex_history(ticker, start_date, market, board, interval, session=session, end_date=end_date)
+    if asset_type != 'Macro_YF': # Игнорируем типы для другого сборщика
+        logging.warning(f"Неизвестный MOEX тип актива '{asset_type}' для тикера {ticker}. Пропускаю.")
+    return pd.DataFrame()
+
+def _record_holes(fetch_tasks: list[tuple[str, str, str, str | None]], task_frames: list[pd.DataFrame],
+                  missing_by_ticker: dict[str, np.ndarray], calendar: np.ndarray, timeframe: str) -> None:
+    """
+    Запоминает торговые дни, которые источник не вернул в ответ на запрос диапазона (бумага не торговалась).
+    Ответы с ошибкой (DataFrame без столбца Date) не учитываются. Последние сессии не запоминаются
+    (backfill_planner.settled_until): их итоги могут быть еще не опубликованы.
+    """
+    last_trading_day = backfill_planner.settled_until(calendar)
+    if last_trading_day is None:
+        return
+    updates: dict[tuple[str, str, str], list[str]] = {}
+    for (ticker, asset_type, range_start, range_end), frame in zip(fetch_tasks, task_frames):
+        if ticker not in missing_by_ticker or 'Date' not in frame.columns:
+            continue
+        missing = missing_by_ticker[ticker]
+        end = min(np.datetime64(range_end, 'D'), last_trading_day) if range_end else last_trading_day
+        requested = missing[(missing >= np.datetime64(range_start, 'D')) & (missing <= end)]
+        returned = pd.to_datetime(frame['Date'], errors='coerce').values.astype('datetime64[D]')
+        absent = requested[~np.isin(requested, returned)]
+        if absent.shape[0]:
+            updates.setdefault((ticker, timeframe, asset_source(asset_type)), []).extend(str(day) for day in absent)
+    if updates:
+        logging.info(f"  - ℹ️ Дни без торгов запомнены для {len(updates)} тикеров и не запрашиваются "
+                     f"{backfill_planner.HOLE_RECHECK_DAYS} дней.")
+        backfill_planner.record_holes(updates)
+
+def mirror_to_sheet(history_sheet, rows: list[list], store_dir: str = ohlcv_store.STORE_DIR) -> bool:
+    """
+    Дописывает в лист строки, уже сохраненные в хранилище, вместе со строками, которые прошлые
+    запуски записать не смогли. При сбое все они остаются в очереди до следующего запуска.
+    Формирующийся бар приходит при каждом опросе: в листе побеждает нижняя строка (см. compaction).
+    """
+    path = os.path.join(store_dir, PENDING_SHEET_ROWS_FILE)
+    pending = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            pending = json.load(f)
+    rows = pending + rows
+    if not rows:
+        return True
+    try:
+        get_sheets_io().append_rows(history_sheet, rows)
+    except Exception as e:
+        logging.error(f"❌ Строки не записаны в 'History_OHLCV' ({e}): {len(rows)} строк оставлены в очереди.")
+        os.makedirs(store_dir, exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, default=float)
+        os.replace(path + '.tmp', path)
+        return False
+    if pending:
+        logging.info(f"  - 📤 Записаны {len(pending)} строк из очереди прошлых запусков.")
+        os.remove(path)
+    return True
+
 # =============================================================================
 # --- БЛОК 3: ГЛАВНАЯ ЛОГИКА ---
 # =============================================================================
-def main_history_updater(interval: int = 24, tickers_to_process: list[str] | None = None, full_fetch: bool = False):
+def main_history_updater(interval: int = 24, tickers_to_process: list[str] | None = None, full_fetch: bool = False,
+                         max_workers: int = HARVEST_WORKERS, harvest_mode: str = 'ticker',
+                         ctx: SheetsContext | None = None,
+                         holdings_df: pd.DataFrame | None = None) -> pd.DataFrame | None:
+    """
+    Дописывает новые бары в хранилище и лист History_OHLCV.
+
+    Args:
+        harvest_mode: 'ticker' - запрос на каждый тикер; 'date' - для дневной дельты
+                      один запрос на доску за каждую недостающую дату.
+        ctx: Контекст Google Sheets конвейера; если не передан, используется контекст процесса.
+        holdings_df: Лист Holdings, уже прочитанный конвейером; если не передан, читается из таблицы.
+
+    Returns:
+        Новые бары в формате листа History_OHLCV или None, если таблица недоступна.
+    """
     timeframe_map = {24: 'D1', 60: 'H1', 30: 'm30', 10: 'm10', 1: 'm1'}
     timeframe_label = timeframe_map.get(interval, f'm{interval}')
     
     mode_str = "ПОЛНАЯ ИСТОРИЧЕСКАЯ ЗАГРУЗКА" if full_fetch else f"Обновление (Интервал: {timeframe_label})"
     logging.info("\n" + "="*50)
-    logging.info(f"--- ✨ АСУП ИИ: {mode_str} Истории v2.4 ✨ ---")
+    logging.info(f"--- ✨ АСУП ИИ: {mode_str} Истории v3.14 ✨ ---")
     logging.info("="*50)
     
-    client = get_gsheets_client()
-    if not client: return
+    ctx = ctx or get_default_context()
+    if not ctx: return None
+
+    # Внутридневные интервалы: свечи ISS в кольцевые буферы, затем новые и обновленные бары - в лист.
+    # Для интервалов без свечей ISS опрашиваются младшие свечи, бары собирает resampler
+    candle_interval = candle_buffer.DERIVED_INTERVALS.get(interval, interval)
+    if candle_interval in candle_buffer.CANDLE_TIMEFRAMES and not full_fetch:
+        if holdings_df is None:
+            holdings_df = pd.DataFrame(get_sheets_io().get_all_records(ctx.worksheet('Holdings')))
+        tickers = holdings_df['Ticker'].tolist() if tickers_to_process is None else tickers_to_process
+        asset_types = dict(zip(holdings_df['Ticker'], holdings_df['Type']))
+        jobs = [(ticker, asset_types[ticker], '') for ticker in tickers if ticker in asset_types]
+        new_rows = harvest_intraday(jobs, candle_interval, get_shared_session(), max_workers=max_workers)
+        logging.info(f"✅ Внутридневных свечей получено: {len(new_rows)}.")
+        mirror_to_sheet(ctx.worksheet('History_OHLCV'), new_rows)
+        logging.info("--- 🏁 РАБОТА ОБНОВИТЕЛЯ ИСТОРИИ ЗАВЕРШЕНА 🏁 ---")
+        return pd.DataFrame(new_rows, columns=ohlcv_store.HISTORY_HEADERS)
     try:
-        spreadsheet = client.open_by_url(SPREADSHEET_URL)
-        holdings_sheet = spreadsheet.worksheet('Holdings')
-        history_sheet = spreadsheet.worksheet('History_OHLCV')
+        holdings_sheet = ctx.worksheet('Holdings')
+        history_sheet = ctx.worksheet('History_OHLCV')
     except Exception as e:
         logging.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Не могу открыть таблицу или листы. {e}")
-        return
-        
-    holdings_df = pd.DataFrame(holdings_sheet.get_all_records())
+        return None
+
+    if holdings_df is None:
+        holdings_df = pd.DataFrame(get_sheets_io().get_all_records(holdings_sheet))
     
-    history_df_filtered = pd.DataFrame()
+    # Последние даты берем из локального хранилища; лист читается только при первом запуске
     if not full_fetch:
-        history_records = history_sheet.get_all_records()
-        history_df = pd.DataFrame(history_records[1:], columns=history_records[0]) if len(history_records) > 1 else pd.DataFrame()
-        if not history_df.empty:
-            history_df_filtered = history_df[history_df['Timeframe'] == timeframe_label]
+        ohlcv_store.bootstrap_from_sheet(history_sheet)
     
     if tickers_to_process is None:
         tickers_to_iterate = holdings_df['Ticker'].tolist()
     else:
         tickers_to_iterate = tickers_to_process
         
-    new_history_rows = []
+    # Сначала планируем запросы по индексу последних дат (без сети и чтения истории),
+    # затем выполняем их параллельно
+    watermarks = ohlcv_store.load_watermarks()
+    session = get_shared_session()
+    default_start = (datetime.now() - timedelta(days=FULL_HISTORY_DAYS)).strftime('%Y-%m-%d')
+    # Дневная дельта MOEX планируется по календарю торгов: догружаются только недостающие дни,
+    # в том числе дыры внутри ряда. Без календаря - как раньше, от последней даты
+    calendar = None
+    if not full_fetch and interval == 24:
+        calendar = backfill_planner.load_calendar(default_start, session)
+        if calendar is None:
+            logging.warning("⚠️ Календарь торгов MOEX недоступен: дельта считается от последней даты.")
+    holes = backfill_planner.load_holes()
+    jobs = []
+    ranges_by_ticker: dict[str, list[tuple[str, str | None]]] = {}
+    missing_by_ticker: dict[str, np.ndarray] = {}
+    stored_by_ticker: dict[str, np.ndarray] = {}
     for ticker in tickers_to_iterate:
         asset_info = holdings_df[holdings_df['Ticker'] == ticker]
         if asset_info.empty:
             logging.warning(f"Тикер '{ticker}' не найден в Holdings. Пропускаю.")
             continue
         
-        start_date = (datetime.now() - timedelta(days=365*2)).strftime('%Y-%m-%d') # 2 года истории
-        if not full_fetch:
-            last_date_str = None
-            if not history_df_filtered.empty and 'Ticker' in history_df_filtered.columns:
-                ticker_dates = history_df_filtered[history_df_filtered['Ticker'] == ticker]['Date']
-                if not ticker_dates.empty:
-                    last_date_str = ticker_dates.max()
-            if pd.notna(last_date_str):
-                 start_date = (datetime.strptime(last_date_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
-
-        ticker_history_df = pd.DataFrame()
         asset_type = asset_info['Type'].iloc[0]
-        if asset_type == 'Currency_CBR':
-            ticker_history_df = get_cbr_history(ticker, start_date)
+        start_date = default_start
+        if not full_fetch:
+            source = asset_source(asset_type)
+            last_date = ohlcv_store.get_watermark(watermarks, ticker, timeframe_label, source)
+            if source == 'MOEX' and timeframe_label == 'D1':
+                # Собранные из свечей дневные бары итогов биржи не заменяют и пропуск не закрывают
+                last_exchange = resampler.exchange_daily_watermark(ticker)
+                last_date = pd.Timestamp(last_exchange) if last_exchange is not None else None
+            if calendar is not None and source == 'MOEX':
+                stored = ohlcv_store.read_partition(ticker, timeframe_label)['Date']
+                stored = stored[stored <= np.datetime64(last_date, 's')] if last_date is not None else stored[:0]
+                ranges, missing = backfill_planner.plan_ranges(
+                    stored, backfill_planner.expected_days(calendar),
+                    backfill_planner.get_holes(holes, ticker, timeframe_label, source), default_start)
+                if not ranges:
+                    continue
+                ranges_by_ticker[ticker], missing_by_ticker[ticker] = ranges, missing
+                stored_by_ticker[ticker] = stored.astype('datetime64[D]')
+                start_date = ranges[0][0]
+            elif last_date is not None:
+                start_date = (last_date + timedelta(days=1)).strftime('%Y-%m-%d')
+        jobs.append((ticker, asset_type, start_date))
+    if calendar is not None:
+        gap_count = sum(len(ranges) > 1 or ranges[0][1] is not None for ranges in ranges_by_ticker.values())
+        logging.info(f"📅 План по календарю торгов: {len(jobs)} тикеров с недостающими днями "
+                     f"({sum(len(m) for m in missing_by_ticker.values())} дней, {sum(len(r) for r in ranges_by_ticker.values())} диапазонов), "
+                     f"из них с дырами внутри ряда: {gap_count}.")
+
+    by_date: dict[str, pd.DataFrame] = {}
+    if harvest_mode == 'date':
+        if full_fetch or interval != 24:
+            logging.info("ℹ️ Сбор по датам применяется только к дневной дельте. Использую сбор по тикерам.")
         else:
-            market, board = None, None
-            if asset_type == 'Stock_MOEX': market, board = 'stock', 'TQBR'
-            elif asset_type == 'Bond_MOEX': market, board = 'stock', 'TQOB'
-            elif asset_type == 'Currency_MOEX': market, board = 'currency', 'CETS'
-            
-            if all([market, board]):
-                ticker_history_df = get_moex_history(ticker, start_date, market, board, interval)
-            else:
-                if asset_type != 'Macro_YF': # Игнорируем типы для другого сборщика
-                    logging.warning(f"Неизвестный MOEX тип актива '{asset_type}' для тикера {ticker}. Пропускаю.")
-                continue
-                
+            by_date = harvest_by_date(jobs, session, max_workers=max_workers,
+                                      missing_dates={t: [str(d) for d in m] for t, m in missing_by_ticker.items()})
+
+    # Запрос на каждый диапазон каждого тикера; без плана - один открытый диапазон от даты начала
+    fetch_tasks = [(ticker, asset_type, range_start, range_end)
+                   for ticker, asset_type, start_date in jobs if ticker not in by_date
+                   for range_start, range_end in ranges_by_ticker.get(ticker, [(start_date, None)])]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map сохраняет порядок заданий, поэтому порядок строк детерминирован
+        task_frames = list(executor.map(
+            lambda task: fetch_ticker_history(task[0], task[1], task[2], interval=interval, session=session, end_date=task[3]),
+            fetch_tasks))
+    by_ticker: dict[str, list[pd.DataFrame]] = {}
+    for task, frame in zip(fetch_tasks, task_frames):
+        by_ticker.setdefault(task[0], []).append(frame)
+    fetched = [by_date[job[0]] if job[0] in by_date else pd.concat(by_ticker[job[0]], ignore_index=True) for job in jobs]
+    if calendar is not None:
+        _record_holes(fetch_tasks, task_frames, missing_by_ticker, calendar, timeframe_label)
+
+    new_history_rows = []
+    for (ticker, _, _), ticker_history_df in zip(jobs, fetched):
+        if ticker in stored_by_ticker and not ticker_history_df.empty:
+            # Объединенные диапазоны захватывают уже сохраненные бары между пропусками
+            dates = pd.to_datetime(ticker_history_df['Date'], errors='coerce').to_numpy().astype('datetime64[D]')
+            ticker_history_df = ticker_history_df[~np.isin(dates, stored_by_ticker[ticker])].copy()
         if not ticker_history_df.empty:
             ticker_history_df.replace([np.inf, -np.inf], np.nan, inplace=True)
             ticker_history_df.fillna('', inplace=True)
@@ -178,14 +491,18 @@ def main_history_updater(interval: int = 24, tickers_to_process: list[str] | Non
                 new_history_rows.append([row['Date'], timeframe_label, ticker, row.get('Open', ''), row.get('High', ''), row.get('Low', ''), row.get('Close', ''), row.get('Volume', '')])
                 
     if new_history_rows:
-        logging.info(f"\n🔄 Найдено {len(new_history_rows)} новых записей. Добавляю в 'History_OHLCV'...")
-        history_sheet.append_rows(new_history_rows, value_input_option='USER_ENTERED')
+        logging.info(f"\n🔄 Найдено {len(new_history_rows)} новых записей. Добавляю в 'History_OHLCV' и хранилище...")
+        # Сначала лист: если запись не удалась, последние даты не сдвигаются и строки будут получены снова
+        get_sheets_io().append_rows(history_sheet, new_history_rows)
+        ohlcv_store.append_rows(new_history_rows, source={ticker: asset_source(asset_type) for ticker, asset_type, _ in jobs})
         logging.info(f"✅ История успешно дополнена.")
     else:
         logging.info(f"✅ Новых исторических данных не найдено.")
         
     logging.info("--- 🏁 РАБОТА ОБНОВИТЕЛЯ ИСТОРИИ ЗАВЕРШЕНА 🏁 ---")
+    return pd.DataFrame(new_history_rows, columns=ohlcv_store.HISTORY_HEADERS)
 
 if __name__ == "__main__":
+    setup_logging("harvester.log")
     # Этот блок остается для возможности ручного запуска с дефолтными параметрами
     main_history_updater(interval=24)
\ No newline at end of file
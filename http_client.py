@@ -0,0 +1,83 @@
+# http_client.py
+# Версия: 1.1 (Общая сессия процесса для долгоживущего режима демона)
+# Назначение: Одна сессия requests на весь запуск сборщиков, чтобы каждый тикер
+# не платил за новое TCP+TLS соединение, а параллельные запросы не перегружали источники.
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
+# Максимум одновременных запросов к одному хосту
+DEFAULT_HOST_LIMITS = {'iss.moex.com': 8, 'www.cbr.ru': 2}
+DEFAULT_HOST_LIMIT = 4
+
+# =============================================================================
+# --- БЛОК 2: СЕССИЯ С ЛИМИТОМ ПО ХОСТАМ ---
+# =============================================================================
+class HostLimitedSession(requests.Session):
+    """
+    Сессия requests, ограничивающая число одновременных запросов к каждому хосту.
+    Безопасна для использования из нескольких потоков сборщика.
+    """
+
+    def __init__(self, host_limits: Optional[Dict[str, int]] = None, default_limit: int = DEFAULT_HOST_LIMIT):
+        super().__init__()
+        self._host_limits = dict(DEFAULT_HOST_LIMITS if host_limits is None else host_limits)
+        self._default_limit = default_limit
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def host_slot(self, url: str) -> Iterator[None]:
+        host = urlparse(url).hostname or ''
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self._host_limits.get(host, self._default_limit))
+                self._semaphores[host] = semaphore
+        with semaphore:
+            yield
+
+    def request(self, method, url, *args, **kwargs):
+        with self.host_slot(url):
+            return super().request(method, url, *args, **kwargs)
+
+def get_requests_session(pool_maxsize: int = 16, host_limits: Optional[Dict[str, int]] = None) -> HostLimitedSession:
+    """
+    Создает и настраивает сессию requests с User-Agent, механизмом retry
+    и пулом keep-alive соединений на pool_maxsize соединений на хост.
+    """
+    session = HostLimitedSession(host_limits=host_limits)
+    # Маскируемся под обычный браузер
+    session.headers['User-Agent'] = USER_AGENT
+
+    # Настраиваем механизм повторных попыток для всех HTTP-запросов
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+_shared_session: Optional[HostLimitedSession] = None
+_shared_lock = threading.Lock()
+
+def get_shared_session() -> HostLimitedSession:
+    """
+    Сессия процесса: создается один раз, ее пул соединений переживает отдельные запуски
+    конвейера (важно для режима демона).
+    """
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = get_requests_session()
+        return _shared_session
@@ -0,0 +1,130 @@
+# indicator_kernels.py
+# Версия: 1.2 (Пакетный расчет по матрице хвостовых окон без цикла по группам)
+# Назначение: Вместо четырех вызовов pandas_ta, каждый из которых строит столбец на всю
+# историю ради одного последнего значения, индикаторы считаются за один проход по
+# непрерывному массиву float64. В режиме хвостового окна обрабатываются только последние
+# TAIL_WINDOW баров, поэтому стоимость расчета пары не зависит от глубины истории.
+# Формулы совпадают с pandas_ta: RSI - rma (ewm alpha=1/14, adjust=True), SMA - простое
+# среднее, BBands - SMA_20 +/- 2 * std(ddof=0).
+#
+# Сверка с эталонным расчетом pandas: python -m pytest tests/test_indicator_kernels.py
+
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from indicator_state import BB_LENGTH, BB_STD, RSI_DECAY, RSI_LENGTH, SMA_FAST, SMA_SLOW
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+# Вес бара старше окна в RSI не превышает RSI_DECAY ** TAIL_WINDOW ~ 5e-20: меньше точности float64
+TAIL_WINDOW = 600
+INDICATOR_KEYS = ['RSI_14', 'SMA_20', 'SMA_50', 'BBU_20_2.0', 'BBL_20_2.0']
+# Веса EWM от старого бара к новому: RSI_DECAY ** (m-1), ..., RSI_DECAY ** 0
+_TAIL_DECAY_POWERS = RSI_DECAY ** np.arange(TAIL_WINDOW - 1, -1, -1, dtype=np.float64)
+
+def _decay_powers(count: int) -> np.ndarray:
+    if count <= TAIL_WINDOW:
+        return _TAIL_DECAY_POWERS[TAIL_WINDOW - count:]
+    return RSI_DECAY ** np.arange(count - 1, -1, -1, dtype=np.float64)
+
+# =============================================================================
+# --- БЛОК 2: ЯДРА ---
+# =============================================================================
+def latest_indicators(close: np.ndarray, tail: Optional[int] = TAIL_WINDOW) -> Dict[str, float]:
+    """
+    Последние значения индикаторов по ценам закрытия (без NaN, по возрастанию времени).
+    tail=None - расчет по всей истории; иначе только по последним tail барам.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    if tail is not None:
+        close = close[-tail:]
+    nan = float('nan')
+    values = dict.fromkeys(INDICATOR_KEYS, nan)
+
+    change = np.diff(close)
+    if change.shape[0] >= RSI_LENGTH:
+        weights = _decay_powers(change.shape[0])
+        weight_sum = weights.sum()
+        positive_avg = np.dot(weights, np.maximum(change, 0.0)) / weight_sum
+        negative_avg = abs(np.dot(weights, np.minimum(change, 0.0)) / weight_sum)
+        if positive_avg + negative_avg != 0:
+            values['RSI_14'] = 100.0 * positive_avg / (positive_avg + negative_avg)
+
+    if close.shape[0] >= SMA_FAST:
+        window = close[-SMA_FAST:]
+        mean = window.sum() / SMA_FAST
+        values['SMA_20'] = mean
+    if close.shape[0] >= BB_LENGTH:
+        window = close[-BB_LENGTH:]
+        mean = window.sum() / BB_LENGTH
+        std = math.sqrt(np.dot(window - mean, window - mean) / BB_LENGTH)
+        values['BBU_20_2.0'] = mean + BB_STD * std
+        values['BBL_20_2.0'] = mean - BB_STD * std
+    if close.shape[0] >= SMA_SLOW:
+        values['SMA_50'] = close[-SMA_SLOW:].sum() / SMA_SLOW
+    return values
+
+def tail_matrix(close: np.ndarray, offsets: np.ndarray, tail: Optional[int] = TAIL_WINDOW) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Хвостовые окна групп close[offsets[i]:offsets[i+1]] одной матрицей (группа, бар):
+    окна выровнены по правому краю, слева дополнены NaN. Возвращает (матрица, длины окон).
+    """
+    lengths = np.diff(offsets)
+    if tail is not None:
+        lengths = np.minimum(lengths, tail)
+    width = int(lengths.max()) if lengths.shape[0] else 0
+    source = offsets[1:, None] - width + np.arange(width)[None, :]
+    valid = source >= (offsets[1:] - lengths)[:, None]
+    return np.where(valid, close[np.where(valid, source, 0)], np.nan), lengths
+
+def latest_indicators_batch(close: np.ndarray, offsets: np.ndarray,
+                            tail: Optional[int] = TAIL_WINDOW) -> Dict[str, np.ndarray]:
+    """
+    Последние значения для групп close[offsets[i]:offsets[i+1]]: {ключ: массив по группам}.
+    Все группы считаются одними матричными операциями над хвостовыми окнами (см. tail_matrix);
+    tail=None - по всей истории, ширина матрицы тогда равна длине самой длинной группы.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    window, lengths = tail_matrix(close, offsets, tail)
+    result = {key: np.full(lengths.shape[0], np.nan) for key in INDICATOR_KEYS}
+
+    change = np.diff(window, axis=1)
+    valid = ~np.isnan(change)
+    if change.shape[1] >= RSI_LENGTH:
+        weights = _decay_powers(change.shape[1])
+        weight_sum = valid @ weights
+        positive_avg = np.where(valid, np.maximum(change, 0.0), 0.0) @ weights / np.where(weight_sum > 0, weight_sum, 1.0)
+        negative_avg = np.abs(np.where(valid, np.minimum(change, 0.0), 0.0) @ weights) / np.where(weight_sum > 0, weight_sum, 1.0)
+        total = positive_avg + negative_avg
+        ready = (lengths - 1 >= RSI_LENGTH) & (total != 0)
+        result['RSI_14'][ready] = 100.0 * positive_avg[ready] / total[ready]
+
+    if window.shape[1] >= BB_LENGTH:
+        ready = lengths >= BB_LENGTH
+        last = window[ready, -BB_LENGTH:]
+        mean = last.sum(axis=1) / BB_LENGTH
+        std = np.sqrt(((last - mean[:, None]) ** 2).sum(axis=1) / BB_LENGTH)
+        result['BBU_20_2.0'][ready] = mean + BB_STD * std
+        result['BBL_20_2.0'][ready] = mean - BB_STD * std
+    for key, length in (('SMA_20', SMA_FAST), ('SMA_50', SMA_SLOW)):
+        if window.shape[1] >= length:
+            ready = lengths >= length
+            result[key][ready] = window[ready, -length:].sum(axis=1) / length
+    return result
+
+def rsi_series_batch(close: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    RSI_14 на каждом баре для групп close[offsets[i]:offsets[i+1]] (формула pandas_ta).
+    Все группы считаются одним groupby-ewm pandas, группы не влияют друг на друга.
+    """
+    group_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    change = pd.Series(close).groupby(group_ids).diff()
+    positive_avg = change.clip(lower=0).groupby(group_ids).ewm(alpha=1 / RSI_LENGTH, min_periods=RSI_LENGTH).mean().to_numpy()
+    negative_avg = change.clip(upper=0).abs().groupby(group_ids).ewm(alpha=1 / RSI_LENGTH, min_periods=RSI_LENGTH).mean().to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 100.0 * positive_avg / (positive_avg + negative_avg)
@@ -0,0 +1,177 @@
+# indicator_state.py
+# Версия: 1.2 (Пороги состояний RSI из Config - state_thresholds)
+# Назначение: Хранит для каждой пары (тикер, таймфрейм) скользящее состояние индикаторов
+# и обновляет его только по новым барам, без пересчета всей истории.
+
+import json
+import logging
+import math
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+STATE_FILE = 'indicator_state.json'
+RSI_LENGTH = 14
+SMA_FAST, SMA_SLOW = 20, 50
+BB_LENGTH, BB_STD = 20, 2.0
+# Альфа Уайлдера, как в pandas_ta.rma: ewm(alpha=1/length, adjust=True)
+RSI_DECAY = 1.0 - 1.0 / RSI_LENGTH
+
+def state_key(ticker: str, timeframe: str) -> str:
+    return f"{ticker}|{timeframe}"
+
+def load_states(path: str = STATE_FILE) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Не удалось прочитать состояние индикаторов ({e}). Будет выполнен полный пересчет.")
+        return {}
+
+def save_states(states: Dict[str, Dict[str, Any]], path: str = STATE_FILE) -> None:
+    """Атомарно сохраняет состояние всех пар."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(states, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# =============================================================================
+# --- БЛОК 2: ОБНОВЛЕНИЕ СОСТОЯНИЯ ---
+# =============================================================================
+def new_state() -> Dict[str, Any]:
+    return {
+        'last_ts': None,     # Дата последнего учтенного бара (ISO)
+        'rows': 0,           # Число строк партиции до last_ts включительно (для контроля дозаписи в прошлое)
+        'first_ts': None,    # Дата первой строки партиции (для распознавания обрезки спереди)
+        'n': 0,              # Число учтенных баров с полным OHLC
+        'prev_close': None,  # Последний учтенный Close (для RSI)
+        'last_close': None,  # Close последней строки партиции (для контроля исправлений)
+        # Взвешенные суммы и веса EWM для роста/падения: avg = num / w
+        'rsi_pos_num': 0.0, 'rsi_pos_w': 0.0,
+        'rsi_neg_num': 0.0, 'rsi_neg_w': 0.0,
+        'rsi_count': 0,
+        'window': [],        # Последние SMA_SLOW цен закрытия
+        'sum_20': 0.0, 'sumsq_20': 0.0, 'sum_50': 0.0,
+    }
+
+def _push_close(state: Dict[str, Any], close: float) -> None:
+    """Учитывает одну цену закрытия за O(1)."""
+    prev_close = state['prev_close']
+    if prev_close is not None:
+        change = close - prev_close
+        state['rsi_pos_num'] = max(change, 0.0) + RSI_DECAY * state['rsi_pos_num']
+        state['rsi_neg_num'] = min(change, 0.0) + RSI_DECAY * state['rsi_neg_num']
+        state['rsi_pos_w'] = 1.0 + RSI_DECAY * state['rsi_pos_w']
+        state['rsi_neg_w'] = 1.0 + RSI_DECAY * state['rsi_neg_w']
+        state['rsi_count'] += 1
+    state['prev_close'] = close
+
+    window = state['window']
+    if len(window) >= SMA_FAST:
+        outgoing = window[-SMA_FAST]
+        state['sum_20'] -= outgoing
+        state['sumsq_20'] -= outgoing * outgoing
+    if len(window) >= SMA_SLOW:
+        state['sum_50'] -= window.pop(0)
+    window.append(close)
+    state['sum_20'] += close
+    state['sumsq_20'] += close * close
+    state['sum_50'] += close
+    state['n'] += 1
+
+def _same_close(close: float, stored: Optional[float]) -> bool:
+    if np.isnan(close):
+        return stored is None
+    return stored is not None and float(close) == stored
+
+def advance(state: Optional[Dict[str, Any]], data: np.ndarray) -> Dict[str, Any]:
+    """
+    Продвигает состояние по партиции хранилища (структурированный массив, отсортированный по Date).
+    Обрабатываются только бары новее last_ts. Если история изменилась задним числом
+    (дозапись в прошлое или исправленный последний бар), состояние строится заново.
+    Обрезка партиции спереди (кольцевой буфер, срок хранения) изменением истории не считается:
+    вытесненные бары уже учтены в состоянии.
+    """
+    dates = data['Date']
+    if state is not None and state['last_ts'] is not None:
+        last_ts = np.datetime64(state['last_ts'], 's')
+        start = int(np.searchsorted(dates, last_ts, side='right'))
+        first_ts = state.get('first_ts')
+        trimmed = first_ts is not None and dates.shape[0] > 0 and dates[0] > np.datetime64(first_ts, 's')
+        rows_expected = start <= state['rows'] if trimmed else start == state['rows']
+        consistent = (rows_expected and start > 0 and dates[start - 1] == last_ts
+                      and _same_close(data['Close'][start - 1], state['last_close']))
+        if not consistent:
+            logging.info("    - ♻️ История изменилась задним числом, состояние индикаторов строится заново.")
+            state, start = new_state(), 0
+    else:
+        state, start = new_state(), 0
+
+    if dates.shape[0]:
+        state['rows'] = int(dates.shape[0])
+        state['first_ts'] = str(dates[0])
+    tail = data[start:]
+    if tail.shape[0] == 0:
+        return state
+    valid = ~(np.isnan(tail['Open']) | np.isnan(tail['High']) | np.isnan(tail['Low']) | np.isnan(tail['Close']))
+    for close in tail['Close'][valid].tolist():
+        _push_close(state, close)
+    state['last_ts'] = str(dates[-1])
+    last_close = float(data['Close'][-1])
+    state['last_close'] = None if math.isnan(last_close) else last_close
+    return state
+
+# =============================================================================
+# --- БЛОК 3: ЗНАЧЕНИЯ ИНДИКАТОРОВ ---
+# =============================================================================
+def latest_values(state: Dict[str, Any]) -> Dict[str, float]:
+    """Возвращает последние значения индикаторов с ключами, как у столбцов pandas_ta."""
+    nan = float('nan')
+    values = {'RSI_14': nan, 'SMA_20': nan, 'SMA_50': nan, 'BBU_20_2.0': nan, 'BBL_20_2.0': nan}
+
+    if state['rsi_count'] >= RSI_LENGTH:
+        pos_avg = state['rsi_pos_num'] / state['rsi_pos_w']
+        neg_avg = abs(state['rsi_neg_num'] / state['rsi_neg_w'])
+        if pos_avg + neg_avg != 0:
+            values['RSI_14'] = 100.0 * pos_avg / (pos_avg + neg_avg)
+
+    window = state['window']
+    if len(window) >= SMA_FAST:
+        mean = state['sum_20'] / SMA_FAST
+        # Стандартное отклонение с ddof=0, как в pandas_ta.bbands
+        std = math.sqrt(max(state['sumsq_20'] / SMA_FAST - mean * mean, 0.0))
+        values['SMA_20'] = mean
+        values['BBU_20_2.0'] = mean + BB_STD * std
+        values['BBL_20_2.0'] = mean - BB_STD * std
+    if len(window) >= SMA_SLOW:
+        values['SMA_50'] = state['sum_50'] / SMA_SLOW
+    return values
+
+def verify_against_full(values: Dict[str, float], full_latest: pd.Series, rel_tol: float = 1e-6) -> Dict[str, tuple]:
+    """Сравнивает инкрементальные значения с полным пересчетом pandas_ta. Возвращает расхождения."""
+    mismatches = {}
+    for key, value in values.items():
+        expected = full_latest.get(key)
+        expected = float(expected) if pd.notna(expected) else float('nan')
+        if math.isnan(value) and math.isnan(expected):
+            continue
+        if math.isnan(value) or math.isnan(expected) or not math.isclose(value, expected, rel_tol=rel_tol, abs_tol=1e-9):
+            mismatches[key] = (value, expected)
+    return mismatches
+
+# =============================================================================
+# --- БЛОК 4: ПОРОГИ СОСТОЯНИЙ ---
+# =============================================================================
+def state_thresholds(config: Dict[str, Any]) -> Tuple[float, float, float]:
+    """Пороги RSI из Config: (уровень Oversold, уровень Warning, верхняя граница Proximity)."""
+    warning_level = float(str(config.get('RSI_WARNING_LEVEL', 35)).replace(',', '.'))
+    alert_level = float(str(config.get('RSI_ALERT_LEVEL', 30)).replace(',', '.'))
+    proximity_pct = float(str(config.get('PROXIMITY_PERCENTAGE', 15)).replace(',', '.'))
+    return alert_level, warning_level, warning_level * (1 + proximity_pct / 100)
@@ -0,0 +1,15 @@
+# log_setup.py
+# Версия: 1.0 (Настройка логирования только из точек входа)
+# Назначение: Модули конвейера при импорте не настраивают логирование и не открывают
+# файлы журналов; это делает точка входа (блок __main__) одним вызовом setup_logging.
+
+import logging
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+def setup_logging(log_file: str | None = None, level: int = logging.INFO) -> None:
+    """Настраивает корневой логгер: консоль и, если задан, файл log_file (UTF-8)."""
+    handlers: list[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file, encoding='utf-8'))
+    logging.basicConfig(level=level, format=LOG_FORMAT, handlers=handlers)
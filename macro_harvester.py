@@ -1,140 +1,149 @@
 # macro_harvester.py
-# Версия: 1.4 (повышена надежность за счет requests.Session и таймаутов)
+# Версия: 1.15 (Строки сначала пишутся в лист, затем в хранилище)
 
 import logging
-import time
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
 import pandas as pd
-import yfinance as yf
 import numpy as np
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
-# НОВОЕ: Создаем сессию requests для большей надежности
-def get_requests_session() -> requests.Session:
-    """
-    Создает и настраивает сессию requests с User-Agent и механизмом retry.
-    """
-    session = requests.Session()
-    # Маскируемся под обычный браузер
-    session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
-    
-    # Настраиваем механизм повторных попыток для всех HTTP-запросов
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount('https://', adapter)
-    session.mount('http://', adapter)
-    
-    return session
-
-def get_yf_history(ticker: str, session: requests.Session, full_fetch: bool = False) -> Optional[pd.DataFrame]:
-    """
-    Получает дневную историю для одного тикера с Yahoo Finance.
-    Использует переданную сессию requests для повышения надежности.
+import ohlcv_store
+from http_client import get_shared_session
+from sheets_io import get_sheets_io
 
-    Args:
-        ticker: Тикер актива в формате Yahoo Finance.
-        session: Настроенная сессия requests.
-        full_fetch: Если True, загружает историю за 2 года.
-                    Иначе, за последние 7 дней (с запасом).
+MACRO_BATCH_SIZE = 20   # Тикеров в одном вызове yf.download
+MACRO_WORKERS = 4       # Параллельных потоков загрузки внутри yf.download
+FULL_HISTORY_DAYS = 365 * 2
 
-    Returns:
-        DataFrame с историей или None в случае критической ошибки.
-    """
-    logging.info(f"  - Запрос истории для {ticker} (Yahoo Finance)...")
+def _normalize_yf_frame(hist: pd.DataFrame) -> pd.DataFrame:
+    """Приводит выгрузку yfinance (индекс - дата) к столбцам Date, Open, High, Low, Close, Volume."""
+    hist = hist.reset_index()
+    # Приводим названия столбцов к единому регистру для надежности
+    hist.columns = [str(col).capitalize() for col in hist.columns]
+    hist['Date'] = pd.to_datetime(hist['Date']).dt.strftime('%Y-%m-%d')
 
-    end_date = datetime.now() + timedelta(days=1)
-    if full_fetch:
-        start_date = end_date - timedelta(days=365 * 2)
-        period_str = "2 года"
-    else:
-        start_date = end_date - timedelta(days=7)
-        period_str = "7 дней"
+    for col in ['Open', 'High', 'Low', 'Close']:
+        if col in hist.columns:
+            hist[col] = hist[col].apply(lambda x: float(x) if pd.notna(x) else None)
+    if 'Volume' in hist.columns:
+        hist['Volume'] = hist['Volume'].apply(lambda x: int(x) if pd.notna(x) else None)
 
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
+    required_cols = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+    return hist[[col for col in required_cols if col in hist.columns]]
 
+def get_yf_history_batch(tickers: List[str], session: requests.Session, start_date: str) -> Dict[str, pd.DataFrame]:
+    """
+    Загружает дневную историю сразу для группы тикеров одним вызовом yf.download
+    с ограниченным числом потоков. Возвращает {тикер: DataFrame} только для тикеров с данными.
+    """
+    end_date_str = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    logging.info(f"  - Пакетный запрос истории для {len(tickers)} тикеров (Yahoo Finance) с {start_date}...")
     try:
-        asset = yf.Ticker(ticker, session=session)
-        # Увеличиваем таймаут до 60 секунд
-        hist = asset.history(
-            start=start_date_str,
-            end=end_date_str,
-            interval="1d",
-            timeout=60
+        import yfinance as yf
+        # auto_adjust=True - как у Ticker.history, которым пользовались раньше
+        data = yf.download(
+            tickers, start=start_date, end=end_date_str, interval="1d", group_by='ticker',
+            auto_adjust=True, threads=min(MACRO_WORKERS, len(tickers)), session=session,
+            progress=False, timeout=60
         )
-
-        if hist.empty:
-            logging.warning(f"    - ⚠️ Для {ticker} не вернулась история с yfinance (период: {period_str}).")
-            return None
-
-        hist.reset_index(inplace=True)
-        # Приводим названия столбцов к единому регистру для надежности
-        hist.columns = [col.capitalize() for col in hist.columns]
-        
-        rename_map = {
-            'Date': 'Date', 'Open': 'Open', 'High': 'High',
-            'Low': 'Low', 'Close': 'Close', 'Volume': 'Volume'
-        }
-        hist.rename(columns=rename_map, inplace=True)
-
-        hist['Date'] = pd.to_datetime(hist['Date']).dt.strftime('%Y-%m-%d')
-
-        for col in ['Open', 'High', 'Low', 'Close']:
-            if col in hist.columns:
-                hist[col] = hist[col].apply(lambda x: float(x) if pd.notna(x) else None)
-        if 'Volume' in hist.columns:
-            hist['Volume'] = hist['Volume'].apply(lambda x: int(x) if pd.notna(x) else None)
-
-        required_cols = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-        return hist[[col for col in required_cols if col in hist.columns]]
-
     except Exception as e:
-        logging.error(f"    - ❌ КРИТИЧЕСКАЯ ОШИБКА при получении истории для {ticker}: {e}", exc_info=True)
-        return None
-
-
-def main_macro_updater(tickers_to_process: List[str], history_sheet, full_fetch: bool = False) -> None:
+        logging.error(f"    - ❌ КРИТИЧЕСКАЯ ОШИБКА пакетной загрузки yfinance: {e}", exc_info=True)
+        return {}
+
+    result = {}
+    for ticker in tickers:
+        if isinstance(data.columns, pd.MultiIndex):
+            if ticker not in data.columns.get_level_values(0):
+                continue
+            hist = data[ticker]
+        else:
+            hist = data
+        # В общей выгрузке у разных рынков разные выходные: пустые строки отбрасываем
+        hist = hist.dropna(subset=['Close'])
+        if hist.empty:
+            logging.warning(f"    - ⚠️ Для {ticker} не вернулась история с yfinance.")
+            continue
+        result[ticker] = _normalize_yf_frame(hist)
+    return result
+
+def _bar_changed(ticker: str, record: Dict[str, Any]) -> bool:
+    """True, если бар отличается от сохраненного за ту же дату (или такого бара нет)."""
+    stored = ohlcv_store.read_partition(ticker, 'D1')
+    stored = stored[stored['Date'] == np.datetime64(record['Date'], 's')]
+    if stored.shape[0] == 0:
+        return True
+    fresh = np.array([np.nan if record.get(col) is None else float(record[col]) for col in ohlcv_store.PRICE_COLUMNS])
+    old = np.array([stored[col][-1] for col in ohlcv_store.PRICE_COLUMNS])
+    return not np.array_equal(fresh, old, equal_nan=True)
+
+def main_macro_updater(tickers_to_process: List[str], history_sheet, full_fetch: bool = False) -> pd.DataFrame:
     """
     Основная функция для обновления макро-данных.
+    В режиме обновления для каждого тикера берется последняя сохраненная дата (водяной знак)
+    и дописываются более новые бары. Бар за саму эту дату запрашивается повторно: ежедневный
+    запуск застает американские и фьючерсные рынки открытыми, и сохраненный бар может быть
+    неполным. Он дописывается, только если изменился (в хранилище новый бар заменяет старый).
+    Возвращает новые и исправленные бары в формате листа History_OHLCV.
     """
     mode_str = "ПОЛНАЯ ИСТОРИЧЕСКАЯ ЗАГРУЗКА" if full_fetch else "Обновление"
     logging.info("\n" + "="*50)
-    logging.info(f"--- 🌍 ASIPM-AI: {mode_str} Макро-данных v1.4 (Сверхнадежный) 🌍 ---")
+    logging.info(f"--- 🌍 ASIPM-AI: {mode_str} Макро-данных v1.15 (Пакетный) 🌍 ---")
     logging.info("="*50)
 
-    # НОВОЕ: Создаем одну сессию на весь запуск
-    session = get_requests_session()
+    session = get_shared_session()
+
+    full_start = (datetime.now() - timedelta(days=FULL_HISTORY_DAYS)).strftime('%Y-%m-%d')
+    watermark_index = ohlcv_store.load_watermarks()
+    watermarks: Dict[str, Optional[str]] = {}
+    for ticker in tickers_to_process:
+        last_date = None if full_fetch else ohlcv_store.get_watermark(watermark_index, ticker, 'D1', 'YF')
+        watermarks[ticker] = last_date.strftime('%Y-%m-%d') if last_date is not None else None
+
+    # Тикеры без истории грузим за 2 года, остальные - с самой ранней из их последних дат
+    batches: Dict[str, List[str]] = {}
+    known = [t for t in tickers_to_process if watermarks[t] is not None]
+    if known:
+        batches[min(watermarks[t] for t in known)] = known
+    unknown = [t for t in tickers_to_process if watermarks[t] is None]
+    if unknown:
+        batches.setdefault(full_start, []).extend(unknown)
+
+    histories: Dict[str, pd.DataFrame] = {}
+    for start_date, batch_tickers in batches.items():
+        for i in range(0, len(batch_tickers), MACRO_BATCH_SIZE):
+            histories.update(get_yf_history_batch(batch_tickers[i:i + MACRO_BATCH_SIZE], session, start_date))
 
     new_history_rows: List[List[Any]] = []
     for ticker in tickers_to_process:
-        df = get_yf_history(ticker, session, full_fetch=full_fetch)
-        
+        df = histories.get(ticker)
         # Пропускаем тикер, если данные не получены
         if df is None or df.empty:
             continue
 
-        df.sort_values(by='Date', inplace=True)
-        records_to_add = df.to_dict('records')
-        
-        for record in records_to_add:
+        if watermarks[ticker] is not None:
+            df = df[df['Date'] >= watermarks[ticker]]
+        df = df.sort_values(by='Date')
+
+        for record in df.to_dict('records'):
+            if record['Date'] == watermarks[ticker] and not _bar_changed(ticker, record):
+                continue
             new_history_rows.append([
                 record.get('Date', ''), 'D1', ticker,
                 record.get('Open', ''), record.get('High', ''),
                 record.get('Low', ''), record.get('Close', ''),
                 record.get('Volume', '')
             ])
-        # Добавляем небольшую паузу между запросами, чтобы не перегружать сервер
-        time.sleep(1)
 
     if new_history_rows:
-        logging.info(f"\n🔄 Найдено {len(new_history_rows)} новых макро-записей. Добавляю в 'History_OHLCV'...")
-        history_sheet.append_rows(new_history_rows, value_input_option='USER_ENTERED')
+        logging.info(f"\n🔄 Найдено {len(new_history_rows)} новых макро-записей. Добавляю в 'History_OHLCV' и хранилище...")
+        # Сначала лист: если запись не удалась, последние даты не сдвигаются и строки будут получены снова
+        get_sheets_io().append_rows(history_sheet, new_history_rows)
+        ohlcv_store.append_rows(new_history_rows, source='YF')
         logging.info("✅ Макро-история успешно дополнена.")
     else:
         logging.info("✅ Новых макро-данных для добавления не найдено.")
 
-    logging.info("--- 🏁 РАБОТА МАКРО-СБОРЩИКА ЗАВЕРШЕНА 🏁 ---")
\ No newline at end of file
+    logging.info("--- 🏁 РАБОТА МАКРО-СБОРЩИКА ЗАВЕРШЕНА 🏁 ---")
+    return pd.DataFrame(new_history_rows, columns=ohlcv_store.HISTORY_HEADERS)
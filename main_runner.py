@@ -1,37 +1,46 @@
 # main_runner.py
-# Версия: 2.4 (Добавлена фильтрация по столбцу 'Watch' в Holdings)
+# Версия: 3.7 (Статистика Google Sheets I/O сбрасывается в начале каждого запуска конвейера)
 
+import importlib
 import logging
+import os
 import sys
 import argparse
-import pandas as pd
-from typing import List
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
 
-# --- Блок импорта ---
 try:
-    # ИЗМЕНЕНО: data_harvesters теперь импортируется без main_history_updater,
-    # так как вся логика управления будет здесь.
-    from data_harvesters import main_history_updater, get_gsheets_client, SPREADSHEET_URL
-    from macro_harvester import main_macro_updater
-    from technical_analyzer import main_analyzer
-    from alerter import main_alerter
-except ImportError as e:
-    print(f"Критическая ошибка: не удалось импортировать модули. Ошибка: {e}")
-    sys.exit(1)
+    import fcntl  # Межпроцессная блокировка доступна только на Unix
+except ImportError:
+    fcntl = None
+
+from log_setup import setup_logging
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 # --- Блок логирования ---
+# Логирование настраивается в блоке __main__: импорт модуля не открывает файлов
 LOG_FILE = 'asipm_main_log.txt'
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-
-def get_hot_watchlist(holdings_df: pd.DataFrame, analysis_df: pd.DataFrame, config: dict) -> list[str]:
-    # ... (функция без изменений) ...
+
+# --- Блок импорта ---
+# Этапы (pandas_ta, yfinance, gspread) загружаются лениво, при первом обращении:
+# разбор аргументов и короткие запуски не платят за импорт ненужных модулей.
+def load_stage(module_name: str, attr_name: str) -> Callable[..., Any]:
+    """Импортирует модуль этапа при первом вызове и возвращает его функцию attr_name."""
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        logging.error(f"Критическая ошибка: не удалось импортировать модуль '{module_name}'. Ошибка: {e}")
+        sys.exit(1)
+    return getattr(module, attr_name)
+
+def get_hot_watchlist(holdings_df: 'pd.DataFrame', analysis_df: 'pd.DataFrame', config: dict) -> list[str]:
+    rule_engine = importlib.import_module('rule_engine')
+
     logging.info("--- Формирование 'горячего списка' для внутридневного мониторинга ---")
     
     priority_tickers = set(holdings_df[holdings_df['Priority'].isin(['Strategic', 'Promising'])]['Ticker'])
@@ -39,49 +48,46 @@ def get_hot_watchlist(holdings_df: pd.DataFrame, analysis_df: pd.DataFrame, conf
 
     proximity_tickers = set()
     if not analysis_df.empty and 'RSI_14' in analysis_df.columns:
-        analysis_df['RSI_14_NUM'] = pd.to_numeric(analysis_df['RSI_14'].astype(str).str.replace(',', '.'), errors='coerce')
-        
-        warning_level = float(str(config.get('RSI_WARNING_LEVEL', 35)).replace(',', '.'))
-        proximity_pct = float(str(config.get('PROXIMITY_PERCENTAGE', 15)).replace(',', '.'))
-        proximity_start_level = warning_level * (1 + proximity_pct / 100)
-        
-        proximity_tickers = set(analysis_df[
-            (analysis_df['RSI_14_NUM'] < proximity_start_level) &
-            (analysis_df['RSI_14_NUM'] >= warning_level)
-        ]['Ticker'])
-        logging.info(f"Тикеры в 'зоне внимания' (RSI < {proximity_start_level:.2f}): {proximity_tickers}")
+        # Правила HOTLIST_RULE_* из Config (по умолчанию - зона Proximity по RSI)
+        rules = rule_engine.load_rules(config, rule_engine.HOTLIST_RULE_PREFIX, rule_engine.DEFAULT_HOTLIST_RULES)
+        matches = rule_engine.evaluate_rules(analysis_df, rules, config)
+        proximity_tickers = set(matches['Ticker'])
+        logging.info(f"Тикеры в 'зоне внимания' (правила {[rule.name for rule in rules]}): {proximity_tickers}")
 
     hot_list = list(priority_tickers.union(proximity_tickers))
     logging.info(f"Итоговый 'горячий список': {hot_list}")
     return hot_list
 
 
-def run_pipeline(mode: str, interval: int, fetch_mode: str):
+def run_pipeline(mode: str, interval: int, fetch_mode: str, full_recompute: bool = False, verify_indicators: bool = False,
+                 workers: int = 1, harvest_by: str = 'ticker'):
     """Основной конвейер для запуска всех этапов обработки данных."""
+    import pandas as pd
+
     logging.info("="*20 + f" ЗАПУСК КОНВЕЙЕРА ASIPM-AI (Режим: {mode}, Интервал: {interval}, Загрузка: {fetch_mode}) " + "="*20)
     
     is_full_fetch = (fetch_mode == 'full')
 
     # --- ЭТАП 0: ПОДГОТОВКА ---
-    client = get_gsheets_client()
-    if not client: sys.exit(1)
+    # Контекст Google Sheets создается один раз и передается во все этапы
+    get_default_context = load_stage('sheets_context', 'get_default_context')
+    get_sheets_io = load_stage('sheets_io', 'get_sheets_io')
+    # Планировщик общий для всех циклов демона, а сводка в конце - за этот запуск
+    get_sheets_io().reset_stats()
+    ctx = get_default_context()
+    if not ctx: sys.exit(1)
     try:
-        spreadsheet = client.open_by_url(SPREADSHEET_URL)
-        holdings_sheet = spreadsheet.worksheet('Holdings')
-        analysis_sheet = spreadsheet.worksheet('Analysis')
-        config_sheet = spreadsheet.worksheet('Config')
-        history_sheet = spreadsheet.worksheet('History_OHLCV')
-        
-        holdings_records = holdings_sheet.get_all_records()
-        holdings_df = pd.DataFrame(holdings_records)
+        history_sheet = ctx.worksheet('History_OHLCV')
+
+        # Holdings, Analysis и Config читаются одним запросом batch_get
+        records = ctx.batch_get_records(['Holdings', 'Analysis', 'Config'])
+        holdings_df = pd.DataFrame(records['Holdings'])
         # ИЗМЕНЕНО: Приводим столбец Watch к строковому типу для надежного сравнения
         if 'Watch' in holdings_df.columns:
             holdings_df['Watch'] = holdings_df['Watch'].astype(str).str.upper()
 
-        analysis_records = analysis_sheet.get_all_records()
-        configs_raw = config_sheet.get_all_records()
-        config = {item['Parameter']: item['Value'] for item in configs_raw}
-        analysis_df = pd.DataFrame(analysis_records[1:], columns=analysis_records[0]) if len(analysis_records) > 1 else pd.DataFrame()
+        config = {item['Parameter']: item['Value'] for item in records['Config']}
+        analysis_df = pd.DataFrame(records['Analysis'])
 
     except Exception as e:
         logging.error(f"Критическая ошибка на этапе подготовки: {e}", exc_info=True)
@@ -111,13 +117,24 @@ def run_pipeline(mode: str, interval: int, fetch_mode: str):
         harvester_tickers_to_process = get_hot_watchlist(holdings_df, analysis_df, config)
 
 
+    # Пары (тикер, таймфрейм), получившие новые бары; None - сборщик не сообщил результат
+    dirty_pairs: set | None = set()
+
+    def mark_dirty(new_bars_df: 'pd.DataFrame | None') -> None:
+        nonlocal dirty_pairs
+        if new_bars_df is None or dirty_pairs is None:
+            dirty_pairs = None
+        else:
+            dirty_pairs.update(zip(new_bars_df['Ticker'], new_bars_df['Timeframe']))
+
     # --- ЗАПУСК МАКРО-СБОРЩИКА ---
     if macro_tickers_to_process:
-        main_macro_updater(
+        main_macro_updater = load_stage('macro_harvester', 'main_macro_updater')
+        mark_dirty(main_macro_updater(
             tickers_to_process=macro_tickers_to_process, 
             history_sheet=history_sheet, 
             full_fetch=is_full_fetch
-        )
+        ))
     else:
         logging.info("Макро-тикеры для обработки не найдены (проверьте Holdings: Type='Macro_YF' и Watch='TRUE').")
 
@@ -125,11 +142,15 @@ def run_pipeline(mode: str, interval: int, fetch_mode: str):
     # --- ЭТАП 1: ОСНОВНОЙ СБОРЩИК ДАННЫХ ---
     if harvester_tickers_to_process:
         try:
-            main_history_updater(
+            main_history_updater = load_stage('data_harvesters', 'main_history_updater')
+            mark_dirty(main_history_updater(
                 interval=interval, 
                 tickers_to_process=harvester_tickers_to_process, 
-                full_fetch=is_full_fetch
-            )
+                full_fetch=is_full_fetch,
+                harvest_mode=harvest_by,
+                ctx=ctx,
+                holdings_df=holdings_df
+            ))
         except Exception as e:
             logging.error(f"!!! КРИТИЧЕСКАЯ ОШИБКА на этапе Сбора Данных: {e}", exc_info=True)
             sys.exit(1)
@@ -140,7 +161,15 @@ def run_pipeline(mode: str, interval: int, fetch_mode: str):
     # --- ЭТАП 2 и 3 (АНАЛИЗ И АЛЕРТЫ) ---
     try:
         logging.info("--- Этап 2: Запуск Технического Анализатора ---")
-        main_analyzer()
+        main_analyzer = load_stage('technical_analyzer', 'main_analyzer')
+        # Внутри дня анализируются только пары с новыми барами; ежедневный запуск
+        # обновляет все пары, чтобы изменения Config дошли до каждой строки
+        analyze_pairs = dirty_pairs if mode == 'intraday' else None
+        if analyze_pairs is not None:
+            logging.info(f"Пары с новыми барами: {len(analyze_pairs)}.")
+        # Config передается из конвейера; строки анализа сразу уходят алертеру
+        fresh_analysis_df = main_analyzer(incremental=not full_recompute, verify=verify_indicators, workers=workers,
+                                          ctx=ctx, config=config, pairs=analyze_pairs)
         logging.info("--- Этап 2: Технический Анализатор УСПЕШНО завершил работу. ---")
     except Exception as e:
         logging.error(f"!!! КРИТИЧЕСКАЯ ОШИБКА на этапе Анализа Данных: {e}", exc_info=True)
@@ -148,24 +177,155 @@ def run_pipeline(mode: str, interval: int, fetch_mode: str):
 
     try:
         logging.info("--- Этап 3: Запуск Алертера ---")
-        main_alerter(interval=interval)
+        main_alerter = load_stage('alerter', 'main_alerter')
+        main_alerter(interval=interval, ctx=ctx, config=config, analysis_df=fresh_analysis_df)
         logging.info("--- Этап 3: Алертер УСПЕШНО завершил работу. ---")
     except Exception as e:
         logging.error(f"!!! КРИТИЧЕСКАЯ ОШИБКА на этапе Отправки Алертов: {e}", exc_info=True)
         sys.exit(1)
 
+    logging.info(f"📊 Google Sheets I/O: {get_sheets_io().report()}")
     logging.info("="*20 + " КОНВЕЙЕР ASIPM-AI УСПЕШНО ЗАВЕРШЕН " + "="*20)
 
 
+# =============================================================================
+# --- РЕЖИМ ДЕМОНА ---
+# =============================================================================
+MSK = timezone(timedelta(hours=3))
+MOEX_SESSION_OPEN = dt_time(10, 0)
+MOEX_SESSION_CLOSE = dt_time(23, 50)  # С учетом вечерней сессии
+DAILY_RUN_AT = dt_time(19, 0)         # После закрытия основной сессии (18:50)
+COMPACTION_WEEKDAY = 4  # Пятница: уплотнение истории после ежедневного цикла
+LOCK_FILE = 'asipm_pipeline.lock'
+_pipeline_thread_lock = threading.Lock()
+
+@contextmanager
+def pipeline_lock() -> Iterator[bool]:
+    """
+    Не дает двум запускам конвейера идти одновременно: ни в одном процессе (демон),
+    ни между процессами (демон и cron). Возвращает False, если конвейер уже занят.
+    """
+    if not _pipeline_thread_lock.acquire(blocking=False):
+        yield False
+        return
+    lock_fd = None
+    try:
+        if fcntl is not None:
+            lock_fd = os.open(LOCK_FILE, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+    finally:
+        if lock_fd is not None:
+            os.close(lock_fd)
+        _pipeline_thread_lock.release()
+
+def _is_trading_day(day: datetime) -> bool:
+    return day.weekday() < 5
+
+def next_intraday_run(now: datetime, poll_minutes: int) -> datetime:
+    """Ближайший слот внутридневного цикла: кратен poll_minutes от открытия торгов, только в торговые часы."""
+    day = now
+    for _ in range(8):
+        session_open = datetime.combine(day.date(), MOEX_SESSION_OPEN, tzinfo=MSK)
+        session_close = datetime.combine(day.date(), MOEX_SESSION_CLOSE, tzinfo=MSK)
+        if _is_trading_day(day) and now < session_close:
+            if now < session_open:
+                return session_open
+            elapsed_slots = int((now - session_open).total_seconds() // (poll_minutes * 60)) + 1
+            candidate = session_open + timedelta(minutes=poll_minutes * elapsed_slots)
+            if candidate <= session_close:
+                return candidate
+        day = datetime.combine(day.date() + timedelta(days=1), dt_time(0, 0), tzinfo=MSK)
+    raise RuntimeError("Не удалось найти следующий торговый слот.")
+
+def next_daily_run(now: datetime) -> datetime:
+    """Ближайший ежедневный цикл после закрытия основной сессии в торговый день."""
+    day = now.date()
+    while True:
+        candidate = datetime.combine(day, DAILY_RUN_AT, tzinfo=MSK)
+        if candidate > now and _is_trading_day(candidate):
+            return candidate
+        day += timedelta(days=1)
+
+def _run_guarded(job: Optional[Callable[..., Any]] = None, **pipeline_kwargs) -> None:
+    """Запускает job (по умолчанию - конвейер) под блокировкой конвейера, не давая ошибке остановить демона."""
+    with pipeline_lock() as acquired:
+        if not acquired:
+            logging.warning("⏭️ Предыдущий цикл конвейера еще выполняется. Пропускаю этот запуск.")
+            return
+        try:
+            (job or run_pipeline)(**pipeline_kwargs)
+        except SystemExit:
+            # run_pipeline завершает процесс при критических ошибках; демон продолжает работу
+            logging.error("!!! Цикл конвейера завершился с ошибкой. Демон продолжает работу.")
+        except Exception as e:
+            logging.error(f"!!! Непредвиденная ошибка цикла конвейера: {e}", exc_info=True)
+
+def run_daemon(interval: int, poll_minutes: int, **pipeline_kwargs) -> None:
+    """
+    Держит процесс, сессии HTTP и Google Sheets живыми и запускает конвейер по расписанию:
+    внутридневной цикл горячего списка каждые poll_minutes минут в часы торгов MOEX
+    и ежедневный цикл по всем активам после закрытия основной сессии.
+    Следующий слот считается после завершения цикла, поэтому циклы не накладываются,
+    а пропущенные из-за долгого цикла слоты объединяются в один.
+    """
+    intraday_interval = interval if interval != 24 else 60
+    logging.info(f"🛰️ Режим демона: внутридневной цикл каждые {poll_minutes} мин (свечи {intraday_interval}), "
+                 f"ежедневный цикл в {DAILY_RUN_AT.strftime('%H:%M')} МСК.")
+    now = datetime.now(MSK)
+    next_intraday, next_daily = next_intraday_run(now, poll_minutes), next_daily_run(now)
+    while True:
+        target = min(next_intraday, next_daily)
+        logging.info(f"⏰ Следующий цикл: {target.strftime('%Y-%m-%d %H:%M')} МСК.")
+        while (remaining := (target - datetime.now(MSK)).total_seconds()) > 0:
+            time.sleep(min(remaining, 60))
+
+        if target == next_daily:
+            _run_guarded(mode='daily', interval=24, fetch_mode='delta', **pipeline_kwargs)
+            if target.weekday() == COMPACTION_WEEKDAY:
+                _run_guarded(job=load_stage('compaction', 'main_compaction'))
+            next_daily = next_daily_run(datetime.now(MSK))
+        else:
+            _run_guarded(mode='intraday', interval=intraday_interval, fetch_mode='delta', **pipeline_kwargs)
+        # Внутридневной слот пересчитываем всегда: пропущенные за время цикла слоты не догоняем
+        next_intraday = next_intraday_run(datetime.now(MSK), poll_minutes)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Запускает конвейер ASIPM-AI.")
     parser.add_argument('--mode', type=str, choices=['daily', 'intraday'], default='daily', help='Режим запуска: daily (все активы) или intraday (горячий список).')
     parser.add_argument('--interval', type=int, default=24, help='Интервал свечей в минутах (24 для дня).')
     parser.add_argument('--fetch-mode', type=str, choices=['delta', 'full'], default='delta', help="Режим загрузки: 'delta' для новых данных, 'full' для полной истории.")
+    parser.add_argument('--full-recompute', action='store_true', help='Полностью пересчитать индикаторы по всей истории вместо инкрементального обновления.')
+    parser.add_argument('--verify-indicators', action='store_true', help='Сверить инкрементальные индикаторы с полным пересчетом pandas_ta.')
+    parser.add_argument('--workers', type=int, default=1, help='Число процессов для полного пересчета анализатора (--full-recompute), по умолчанию 1 - последовательно.')
+    parser.add_argument('--harvest-by', type=str, choices=['ticker', 'date'], default='ticker', help="Сбор дневной дельты: 'ticker' - запрос на тикер, 'date' - один запрос на доску за дату.")
+    parser.add_argument('--daemon', action='store_true', help='Работать постоянно и запускать конвейер по расписанию торгов MOEX.')
+    parser.add_argument('--poll-minutes', type=int, default=60, help='Период внутридневного цикла в режиме демона, минут.')
+    parser.add_argument('--compact', action='store_true', help="Только уплотнить лист 'History_OHLCV' и локальное хранилище (дубли и сроки хранения).")
     args = parser.parse_args()
+    setup_logging(LOG_FILE)
     
     if args.fetch_mode == 'full' and args.mode != 'daily':
         print("Ошибка: Полная историческая загрузка (--fetch-mode full) возможна только в ежедневном режиме (--mode daily).")
         sys.exit(1)
-        
-    run_pipeline(mode=args.mode, interval=args.interval, fetch_mode=args.fetch_mode)
\ No newline at end of file
+
+    if args.daemon:
+        run_daemon(interval=args.interval, poll_minutes=args.poll_minutes, full_recompute=args.full_recompute,
+                   verify_indicators=args.verify_indicators, workers=args.workers, harvest_by=args.harvest_by)
+        sys.exit(0)
+
+    with pipeline_lock() as acquired:
+        if not acquired:
+            logging.warning("⏭️ Конвейер уже запущен другим процессом. Завершение.")
+            sys.exit(0)
+        if args.compact:
+            load_stage('compaction', 'main_compaction')()
+            sys.exit(0)
+        run_pipeline(mode=args.mode, interval=args.interval, fetch_mode=args.fetch_mode,
+                     full_recompute=args.full_recompute, verify_indicators=args.verify_indicators, workers=args.workers,
+                     harvest_by=args.harvest_by)
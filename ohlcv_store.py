@@ -0,0 +1,267 @@
+# ohlcv_store.py
+# Версия: 1.6 (Клиент Google Sheets импортируется только для первичной загрузки из листа)
+# Назначение: Основной путь чтения истории. Данные разбиты на партиции
+# {STORE_DIR}/{Timeframe}/{Ticker}.npy, каждая партиция - структурированный
+# массив NumPy, отсортированный по дате. Лист 'History_OHLCV' остается зеркалом,
+# в которое дописываются новые строки (периодически уплотняется, см. compaction.py).
+
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+STORE_DIR = 'ohlcv_store'
+WATERMARK_FILE = 'watermarks.json'  # Лежит в корне STORE_DIR
+HISTORY_HEADERS = ['Date', 'Timeframe', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Volume']
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+OHLCV_DTYPE = np.dtype([('Date', 'datetime64[s]')] + [(col, 'f8') for col in PRICE_COLUMNS])
+
+# =============================================================================
+# --- БЛОК 2: ПАРТИЦИИ ---
+# =============================================================================
+def _partition_path(ticker: str, timeframe: str, store_dir: str = STORE_DIR) -> str:
+    # Тикеры вида 'USD/RUB' или '^GSPC' кодируются, чтобы быть безопасными именами файлов
+    return os.path.join(store_dir, timeframe, quote(ticker, safe='') + '.npy')
+
+def _to_float(value: Any) -> float:
+    """Приводит значение из листа ('1 234,5', '', None) к float."""
+    if value is None:
+        return np.nan
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    clean = str(value).replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        return float(clean) if clean else np.nan
+    except ValueError:
+        return np.nan
+
+def read_partition(ticker: str, timeframe: str, store_dir: str = STORE_DIR) -> np.ndarray:
+    """Возвращает партицию (ticker, timeframe) как memory-mapped массив только для чтения."""
+    path = _partition_path(ticker, timeframe, store_dir)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.empty(0, dtype=OHLCV_DTYPE)
+    return np.load(path, mmap_mode='r')
+
+def _write_partition(ticker: str, timeframe: str, data: np.ndarray, store_dir: str = STORE_DIR) -> None:
+    """Атомарно записывает партицию: сначала во временный файл, затем os.replace."""
+    path = _partition_path(ticker, timeframe, store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp_path, path)
+
+def list_partitions(store_dir: str = STORE_DIR) -> List[Tuple[str, str]]:
+    """Возвращает отсортированный список всех пар (ticker, timeframe) в хранилище."""
+    if not os.path.isdir(store_dir):
+        return []
+    pairs = []
+    for timeframe in os.listdir(store_dir):
+        tf_dir = os.path.join(store_dir, timeframe)
+        if not os.path.isdir(tf_dir):
+            continue
+        for file_name in os.listdir(tf_dir):
+            if file_name.endswith('.npy'):
+                pairs.append((unquote(file_name[:-len('.npy')]), timeframe))
+    return sorted(pairs)
+
+def is_empty(store_dir: str = STORE_DIR) -> bool:
+    return not list_partitions(store_dir)
+
+def last_timestamp(ticker: str, timeframe: str, store_dir: str = STORE_DIR) -> Optional[pd.Timestamp]:
+    """Дата последнего бара партиции. Читается только последняя запись memory-mapped файла."""
+    data = read_partition(ticker, timeframe, store_dir)
+    if data.shape[0] == 0:
+        return None
+    return pd.Timestamp(data['Date'][-1])
+
+# =============================================================================
+# --- БЛОК 3: ЗАПИСЬ ---
+# =============================================================================
+def _rows_to_partitions(rows: Iterable[List[Any]]) -> Dict[Tuple[str, str], np.ndarray]:
+    """Группирует строки формата листа History_OHLCV по партициям."""
+    grouped: Dict[Tuple[str, str], List[List[Any]]] = {}
+    for row in rows:
+        grouped.setdefault((str(row[2]), str(row[1])), []).append(row)
+
+    partitions = {}
+    for key, pair_rows in grouped.items():
+        dates = pd.to_datetime([r[0] for r in pair_rows], errors='coerce')
+        data = np.empty(len(pair_rows), dtype=OHLCV_DTYPE)
+        data['Date'] = dates.values.astype('datetime64[s]')
+        for offset, col in enumerate(PRICE_COLUMNS, start=3):
+            data[col] = [_to_float(r[offset]) if len(r) > offset else np.nan for r in pair_rows]
+        partitions[key] = data[~np.isnat(data['Date'])]
+    return partitions
+
+def _merge(existing: np.ndarray, new: np.ndarray) -> np.ndarray:
+    """Объединяет партицию с новыми барами: сортировка по дате, при дублях побеждает новый бар."""
+    combined = np.concatenate([existing, new])
+    combined = combined[np.argsort(combined['Date'], kind='stable')]
+    dates = combined['Date']
+    keep_last = np.append(dates[1:] != dates[:-1], True)
+    return combined[keep_last]
+
+def append_rows(rows: List[List[Any]], source: str | Dict[str, str] = 'UNKNOWN',
+                store_dir: str = STORE_DIR) -> Dict[Tuple[str, str], int]:
+    """
+    Дописывает строки формата листа History_OHLCV в локальное хранилище
+    и обновляет индекс последних дат.
+
+    Args:
+        rows: Строки [Date, Timeframe, Ticker, Open, High, Low, Close, Volume].
+        source: Источник данных ('MOEX', 'CBR', 'YF') или словарь {тикер: источник}.
+
+    Returns:
+        Словарь {(ticker, timeframe): число ранее отсутствовавших баров}.
+    """
+    added = {}
+    watermarks = {}
+    for (ticker, timeframe), new_data in _rows_to_partitions(rows).items():
+        if new_data.shape[0] == 0:
+            continue
+        path = _partition_path(ticker, timeframe, store_dir)
+        # Читаем без mmap, чтобы файл был закрыт к моменту os.replace
+        existing = np.load(path) if os.path.exists(path) else np.empty(0, dtype=OHLCV_DTYPE)
+        added[(ticker, timeframe)] = int(np.isin(np.unique(new_data['Date']), existing['Date'], invert=True).sum())
+        merged = _merge(existing, new_data)
+        _write_partition(ticker, timeframe, merged, store_dir)
+        ticker_source = source.get(ticker, 'UNKNOWN') if isinstance(source, dict) else source
+        # Последняя дата источника - по его барам, а не по партиции: в ней могут быть бары других источников
+        watermarks[(ticker, timeframe, ticker_source)] = pd.Timestamp(new_data['Date'].max())
+    if watermarks:
+        update_watermarks(watermarks, store_dir)
+    return added
+
+def replace_partition(ticker: str, timeframe: str, data: np.ndarray, source: str,
+                      store_dir: str = STORE_DIR) -> None:
+    """Атомарно заменяет партицию целиком (отсортированный массив OHLCV_DTYPE) и обновляет индекс."""
+    _write_partition(ticker, timeframe, data, store_dir)
+    if data.shape[0]:
+        update_watermarks({(ticker, timeframe, source): pd.Timestamp(data['Date'][-1])}, store_dir)
+
+def compact(cutoffs: Dict[str, pd.Timestamp], store_dir: str = STORE_DIR) -> Dict[str, int]:
+    """
+    Уплотняет хранилище: бары таймфрейма старше cutoffs[таймфрейм] удаляются, партиции
+    сортируются по дате без дублей (побеждает последний бар). Перезаписываются только
+    изменившиеся партиции; пустая партиция удаляется. Индекс последних дат не меняется,
+    чтобы сборщики не загружали удаленную историю заново.
+
+    Returns:
+        {'partitions': перезаписано партиций, 'removed': удалено баров}.
+    """
+    stats = {'partitions': 0, 'removed': 0}
+    for ticker, timeframe in list_partitions(store_dir):
+        path = _partition_path(ticker, timeframe, store_dir)
+        data = np.load(path)
+        compacted = _merge(np.empty(0, dtype=OHLCV_DTYPE), data)
+        if timeframe in cutoffs:
+            compacted = compacted[compacted['Date'] >= np.datetime64(cutoffs[timeframe], 's')]
+        if compacted.shape[0] == data.shape[0] and np.array_equal(compacted['Date'], data['Date']):
+            continue
+        stats['partitions'] += 1
+        stats['removed'] += data.shape[0] - compacted.shape[0]
+        if compacted.shape[0]:
+            _write_partition(ticker, timeframe, compacted, store_dir)
+        else:
+            os.remove(path)
+    return stats
+
+# =============================================================================
+# --- БЛОК 4: ЧТЕНИЕ В DATAFRAME И ЗАГРУЗКА ИЗ ЛИСТА ---
+# =============================================================================
+def read_history(pairs: Optional[Iterable[Tuple[str, str]]] = None,
+                 timeframes: Optional[Iterable[str]] = None,
+                 store_dir: str = STORE_DIR) -> pd.DataFrame:
+    """
+    Собирает DataFrame в формате листа History_OHLCV из выбранных партиций.
+    Читаются только затронутые партиции; Date возвращается как datetime64.
+    """
+    if pairs is None:
+        pairs = list_partitions(store_dir)
+    if timeframes is not None:
+        allowed = set(timeframes)
+        pairs = [p for p in pairs if p[1] in allowed]
+
+    frames = []
+    for ticker, timeframe in pairs:
+        data = read_partition(ticker, timeframe, store_dir)
+        if data.shape[0] == 0:
+            continue
+        frame = pd.DataFrame({col: np.asarray(data[col]) for col in OHLCV_DTYPE.names})
+        frame.insert(1, 'Timeframe', timeframe)
+        frame.insert(2, 'Ticker', ticker)
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=HISTORY_HEADERS)
+    history_df = pd.concat(frames, ignore_index=True)
+    history_df['Date'] = history_df['Date'].astype('datetime64[ns]')
+    return history_df[HISTORY_HEADERS]
+
+def bootstrap_from_sheet(history_sheet, store_dir: str = STORE_DIR) -> int:
+    """Однократно заполняет пустое хранилище из листа History_OHLCV. Возвращает число строк."""
+    if not is_empty(store_dir):
+        return 0
+    logging.info("📦 Локальное хранилище OHLCV пусто. Первичная загрузка из листа 'History_OHLCV'...")
+    # Импорт здесь: чтение хранилища (алертер, горячий список, бэктест) не тянет за собой gspread
+    from sheets_io import get_sheets_io
+    records = get_sheets_io().get_all_records(history_sheet)
+    rows = [[rec.get(col, '') for col in HISTORY_HEADERS] for rec in records]
+    append_rows(rows, source='SHEET', store_dir=store_dir)
+    logging.info(f"✅ В локальное хранилище загружено {len(rows)} строк.")
+    return len(rows)
+
+# =============================================================================
+# --- БЛОК 5: ИНДЕКС ПОСЛЕДНИХ ДАТ (WATERMARKS) ---
+# =============================================================================
+def _watermark_key(ticker: str, timeframe: str, source: str) -> str:
+    return f"{ticker}|{timeframe}|{source}"
+
+def load_watermarks(store_dir: str = STORE_DIR) -> Dict[str, str]:
+    """Читает индекс {'тикер|таймфрейм|источник': ISO-дата последнего бара}."""
+    path = os.path.join(store_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Индекс последних дат поврежден ({e}), будут использованы партиции хранилища.")
+        return {}
+
+def update_watermarks(updates: Dict[Tuple[str, str, str], pd.Timestamp], store_dir: str = STORE_DIR) -> None:
+    """
+    Атомарно обновляет индекс: временный файл + os.replace.
+    Последняя дата не уменьшается: дозапись старых баров (догрузка пропусков) ее не сдвигает назад.
+    """
+    index = load_watermarks(store_dir)
+    for (ticker, timeframe, source), ts in updates.items():
+        key = _watermark_key(ticker, timeframe, source)
+        if key in index and pd.Timestamp(index[key]) >= ts:
+            continue
+        index[key] = ts.isoformat()
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, WATERMARK_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def get_watermark(index: Dict[str, str], ticker: str, timeframe: str, source: str,
+                  store_dir: str = STORE_DIR, fallback: bool = True) -> Optional[pd.Timestamp]:
+    """
+    Последняя дата по (тикер, таймфрейм, источник) из индекса за O(1).
+    Если записи нет (данные загружены до появления индекса), при fallback читается последняя строка партиции.
+    """
+    value = index.get(_watermark_key(ticker, timeframe, source))
+    if value is not None:
+        return pd.Timestamp(value)
+    return last_timestamp(ticker, timeframe, store_dir) if fallback else None
@@ -0,0 +1,42 @@
+# rate_limit.py
+# Версия: 1.0 (Token bucket и экспоненциальная задержка с джиттером)
+# Назначение: Общие примитивы ограничения частоты запросов к внешним API.
+
+import random
+import threading
+import time
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: не более rate запросов за period секунд,
+    с допустимым всплеском до capacity запросов.
+    """
+
+    def __init__(self, rate: float, period: float = 60.0, capacity: float | None = None):
+        self.rate_per_second = rate / period
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Блокирует до появления токенов. Возвращает время ожидания в секундах."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate_per_second
+            time.sleep(delay)
+            waited += delay
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 64.0) -> float:
+    """Задержка перед повтором номер attempt (с 0): экспонента с полным джиттером."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
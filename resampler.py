@@ -0,0 +1,157 @@
+# resampler.py
+# Версия: 1.2 (Ветвь m30 собирается из m10 вне основной цепочки)
+# Назначение: Свечи запрашиваются у источника один раз на самом мелком интервале,
+# старшие таймфреймы собираются из них векторно (NumPy, без цикла по барам).
+# Бары не пересекают границы торговых сессий MOEX: бар, в который попадает открытие
+# сессии, начинается с открытия. Дневные бары сверяются с дневными итогами биржи.
+
+import logging
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import candle_buffer
+import ohlcv_store
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+TIMEFRAME_CHAIN = ['m1', 'm10', 'H1', 'D1']
+# Таймфреймы вне цепочки: собираются из указанного звена, старшие из них не строятся
+TIMEFRAME_BRANCHES = {'m10': ['m30']}
+BUCKET_SECONDS = {'m10': 10 * 60, 'm30': 30 * 60, 'H1': 60 * 60, 'D1': 24 * 60 * 60}
+# Открытия сессий MOEX (МСК, секунды от начала суток): утренняя 06:50, основная 10:00, вечерняя 19:05
+SESSION_OPENS = np.array([6 * 3600 + 50 * 60, 10 * 3600, 19 * 3600 + 5 * 60], dtype=np.int64)
+D1_SOURCE = 'RESAMPLED'
+EXCHANGE_D1_SOURCES = ['MOEX', 'SHEET']  # Источники дневных итогов биржи в индексе последних дат
+D1_CLOSE_TOLERANCE = 0.005  # Допустимое относительное расхождение OHLC с дневными итогами биржи
+
+# =============================================================================
+# --- БЛОК 2: АГРЕГАЦИЯ ---
+# =============================================================================
+def bucket_labels(dates: np.ndarray, timeframe: str) -> np.ndarray:
+    """
+    Время начала бара таймфрейма timeframe для каждого бара dates (datetime64[s], МСК).
+    Внутридневной бар, в котором открывается сессия, начинается с открытия сессии.
+    """
+    seconds = dates.astype('datetime64[s]').astype(np.int64)
+    day_start = seconds - seconds % 86400
+    if timeframe == 'D1':
+        return day_start.astype('datetime64[s]')
+    size = BUCKET_SECONDS[timeframe]
+    time_of_day = seconds - day_start
+    session_index = np.searchsorted(SESSION_OPENS, time_of_day, side='right') - 1
+    session_open = np.where(session_index >= 0, SESSION_OPENS[np.clip(session_index, 0, None)], 0)
+    labels = np.maximum(seconds - seconds % size, day_start + session_open)
+    return labels.astype('datetime64[s]')
+
+def resample(data: np.ndarray, timeframe: str, drop_first: bool = False) -> np.ndarray:
+    """
+    Собирает бары таймфрейма timeframe из отсортированного по времени массива OHLCV_DTYPE.
+    drop_first отбрасывает первый бар (источник обрезан спереди, бар может быть неполным).
+    """
+    if data.shape[0] == 0:
+        return np.empty(0, dtype=ohlcv_store.OHLCV_DTYPE)
+    labels = bucket_labels(data['Date'], timeframe)
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], data.shape[0]] - 1
+
+    result = np.empty(starts.shape[0], dtype=ohlcv_store.OHLCV_DTYPE)
+    result['Date'] = labels[starts]
+    result['Open'] = data['Open'][starts]
+    result['Close'] = data['Close'][ends]
+    # fmax/fmin пропускают NaN, объем без данных считается нулевым
+    result['High'] = np.fmax.reduceat(data['High'], starts)
+    result['Low'] = np.fmin.reduceat(data['Low'], starts)
+    result['Volume'] = np.add.reduceat(np.nan_to_num(data['Volume']), starts)
+    return result[1:] if drop_first else result
+
+def exchange_daily_watermark(ticker: str, store_dir: str = ohlcv_store.STORE_DIR) -> np.datetime64 | None:
+    """
+    Дата последнего дневного бара биржи (собранные бары партиции D1 не учитываются).
+    Берется из индекса последних дат по источникам биржи; последняя дата партиции используется,
+    только если в индексе нет ни биржевых, ни собранных баров тикера.
+    """
+    index = ohlcv_store.load_watermarks(store_dir)
+    stamps = [ohlcv_store.get_watermark(index, ticker, 'D1', source, store_dir, fallback=False)
+              for source in EXCHANGE_D1_SOURCES]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    if not stamps and ohlcv_store.get_watermark(index, ticker, 'D1', D1_SOURCE, store_dir, fallback=False) is None:
+        stamps = [ohlcv_store.last_timestamp(ticker, 'D1', store_dir)]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return np.datetime64(max(stamps), 's') if stamps else None
+
+def check_daily(ticker: str, derived: np.ndarray, store_dir: str = ohlcv_store.STORE_DIR,
+                tolerance: float = D1_CLOSE_TOLERANCE) -> Dict[str, Tuple[float, float]]:
+    """
+    Сверяет собранные дневные бары с дневными итогами биржи за те же даты.
+    Возвращает расхождения {'дата поле': (собранное, биржевое)}.
+    """
+    exchange = ohlcv_store.read_partition(ticker, 'D1', store_dir)
+    last_exchange = exchange_daily_watermark(ticker, store_dir)
+    if exchange.shape[0] == 0 or derived.shape[0] == 0 or last_exchange is None:
+        return {}
+    exchange = exchange[exchange['Date'] <= last_exchange]
+    common, derived_idx, exchange_idx = np.intersect1d(derived['Date'], exchange['Date'], return_indices=True)
+    mismatches = {}
+    for field in ['Open', 'High', 'Low', 'Close']:
+        ours, theirs = derived[field][derived_idx], exchange[field][exchange_idx]
+        bad = np.abs(ours - theirs) > tolerance * np.abs(theirs)
+        for day, our_value, their_value in zip(common[bad], ours[bad], theirs[bad]):
+            mismatches[f"{str(day)[:10]} {field}"] = (float(our_value), float(their_value))
+    return mismatches
+
+# =============================================================================
+# --- БЛОК 3: ЦЕПОЧКА ТАЙМФРЕЙМОВ ---
+# =============================================================================
+def _to_rows(ticker: str, timeframe: str, bars: np.ndarray) -> List[List[Any]]:
+    dates = pd.to_datetime(bars['Date']).strftime('%Y-%m-%d %H:%M:%S')
+    return [[date, timeframe, ticker] + [float(bar[col]) for col in ohlcv_store.PRICE_COLUMNS]
+            for date, bar in zip(dates, bars)]
+
+def _resample_ring(ring: candle_buffer.CandleRing, timeframe: str) -> np.ndarray:
+    # Заполненный буфер обрезан спереди: его первый старший бар может быть неполным
+    return resample(ring.to_array(), timeframe, drop_first=len(ring) == ring.capacity)
+
+def _extend_ring(ticker: str, timeframe: str, bars: np.ndarray, store_dir: str) -> List[List[Any]]:
+    """Дописывает в буфер timeframe бары начиная с его последнего (он мог еще формироваться)."""
+    last_ts = candle_buffer.get_ring(ticker, timeframe, store_dir=store_dir).last_timestamp()
+    changed = bars if last_ts is None else bars[bars['Date'] >= np.datetime64(last_ts, 's')]
+    candle_buffer.append_array(ticker, timeframe, changed, store_dir)
+    return _to_rows(ticker, timeframe, changed)
+
+def resample_chain(ticker: str, base_timeframe: str, store_dir: str = ohlcv_store.STORE_DIR) -> List[List[Any]]:
+    """
+    Строит все старшие таймфреймы цепочки из буфера base_timeframe: каждый следующий - из предыдущего,
+    ветви TIMEFRAME_BRANCHES - из своего звена.
+    Внутридневные бары дописываются в кольцевые буферы; дневной бар пишется только за даты,
+    которых еще нет в дневных итогах биржи (биржевой бар позже заменит собранный).
+    Возвращает строки формата листа History_OHLCV с новыми и обновленными барами.
+    """
+    rows: List[List[Any]] = []
+    chain = TIMEFRAME_CHAIN[TIMEFRAME_CHAIN.index(base_timeframe):]
+    source_ring = candle_buffer.get_ring(ticker, base_timeframe, store_dir=store_dir)
+    for source_tf, target_tf in zip(chain, chain[1:]):
+        for branch_tf in TIMEFRAME_BRANCHES.get(source_tf, []):
+            rows.extend(_extend_ring(ticker, branch_tf, _resample_ring(source_ring, branch_tf), store_dir))
+        bars = _resample_ring(source_ring, target_tf)
+        if bars.shape[0] == 0:
+            break
+
+        if target_tf == 'D1':
+            mismatches = check_daily(ticker, bars, store_dir)
+            if mismatches:
+                logging.warning(f"    - ⚠️ {ticker}: собранные дневные бары расходятся с итогами биржи: {mismatches}")
+            last_exchange = exchange_daily_watermark(ticker, store_dir)
+            if last_exchange is not None:
+                bars = bars[bars['Date'] > last_exchange]
+            if bars.shape[0]:
+                day_rows = _to_rows(ticker, 'D1', bars)
+                ohlcv_store.append_rows(day_rows, source=D1_SOURCE, store_dir=store_dir)
+                rows.extend(day_rows)
+            break
+
+        rows.extend(_extend_ring(ticker, target_tf, bars, store_dir))
+        source_ring = candle_buffer.get_ring(ticker, target_tf, store_dir=store_dir)
+    return rows
@@ -0,0 +1,199 @@
+# rule_engine.py
+# Версия: 1.2 (Числа листа с неразрывными пробелами-разделителями разрядов читаются, а не становятся NaN)
+# Назначение: Условия алертов и горячего списка задаются строками в листе Config, например
+#   ALERT_RULE_OVERSOLD_D1 = RSI_14 < 30 and Close < BB_Lower and timeframe == D1
+# Выражение один раз разбирается (модуль ast, только разрешенные конструкции) в дерево
+# функций над столбцами NumPy. За цикл каждое правило - одна маска по всем строкам 'Analysis',
+# без цикла Python по строкам.
+#
+# Имена в выражениях (регистр не важен): столбцы 'Analysis' (RSI_14, MA_20, MA_50, BB_Upper,
+# BB_Lower, State, Ticker, Timeframe), последний бар пары из хранилища (Open, High, Low, Close,
+# Volume), числовые параметры Config (RSI_ALERT_LEVEL, ...) и PROXIMITY_LEVEL - верхняя граница
+# зоны Proximity. Неизвестное имя - строка: 'timeframe == D1' равно 'timeframe == "D1"'.
+
+import ast
+import functools
+import logging
+import operator
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+import ohlcv_store
+from indicator_state import state_thresholds
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+ALERT_RULE_PREFIX = 'ALERT_RULE_'
+HOTLIST_RULE_PREFIX = 'HOTLIST_RULE_'
+# Правила по умолчанию повторяют прежнюю логику, пока в Config нет ни одного правила с префиксом
+DEFAULT_ALERT_RULES = {'Oversold': 'State == Oversold'}
+DEFAULT_HOTLIST_RULES = {'Proximity': 'RSI_14 >= RSI_WARNING_LEVEL and RSI_14 < PROXIMITY_LEVEL'}
+DEFAULT_TITLES = {'Oversold': 'ПЕРЕПРОДАННОСТЬ'}
+NUMERIC_COLUMNS = ['RSI_14', 'MA_20', 'MA_50', 'BB_Upper', 'BB_Lower']
+BAR_COLUMNS = ohlcv_store.PRICE_COLUMNS  # Подгружаются из хранилища, только если есть в правилах
+
+_COMPARISONS = {
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+_ARITHMETIC = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+class RuleError(ValueError):
+    """Выражение правила не разбирается или использует запрещенную конструкцию."""
+
+# =============================================================================
+# --- БЛОК 2: КОМПИЛЯЦИЯ ---
+# =============================================================================
+Evaluator = Callable[[Dict[str, Any]], Any]
+
+def _compile_node(node: ast.AST, names: Set[str]) -> Evaluator:
+    """Превращает узел ast в функцию от окружения {имя в нижнем регистре: массив или число}."""
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile_node(value, names) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return lambda env: functools.reduce(combine, [part(env) for part in parts])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+        operand = _compile_node(node.operand, names)
+        if isinstance(node.op, ast.Not):
+            return lambda env: np.logical_not(operand(env))
+        return lambda env: -operand(env)
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+        left, right, op = _compile_node(node.left, names), _compile_node(node.right, names), _ARITHMETIC[type(node.op)]
+        return lambda env: op(left(env), right(env))
+    if isinstance(node, ast.Compare):
+        # Цепочка a < b < c - это (a < b) and (b < c)
+        operands = [_compile_node(node.left, names)] + [_compile_node(c, names) for c in node.comparators]
+        checks = []
+        for i, op in enumerate(node.ops):
+            left, right = operands[i], operands[i + 1]
+            if isinstance(op, (ast.In, ast.NotIn)):
+                negate = isinstance(op, ast.NotIn)
+                checks.append(lambda env, l=left, r=right, n=negate: np.isin(l(env), r(env)) != n)
+            elif type(op) in _COMPARISONS:
+                checks.append(lambda env, l=left, r=right, f=_COMPARISONS[type(op)]: f(l(env), r(env)))
+            else:
+                raise RuleError(f"оператор {type(op).__name__} не поддерживается")
+        return lambda env: functools.reduce(np.logical_and, [check(env) for check in checks])
+    if isinstance(node, (ast.Tuple, ast.List)):
+        elements = [_compile_node(element, names) for element in node.elts]
+        return lambda env: [element(env) for element in elements]
+    if isinstance(node, ast.Name):
+        key = node.id.lower()
+        names.add(key)
+        return lambda env: env.get(key, node.id)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str, bool)):
+        value = node.value
+        return lambda env: value
+    raise RuleError(f"конструкция {type(node).__name__} не поддерживается")
+
+class Rule:
+    """Скомпилированное правило: имя (сигнал в журнале алертов), выражение и используемые имена."""
+
+    def __init__(self, name: str, expression: str, title: Optional[str] = None):
+        self.name = name
+        self.expression = expression
+        self.title = title or DEFAULT_TITLES.get(name, name)
+        self.names: Set[str] = set()
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise RuleError(f"синтаксическая ошибка: {e.msg}") from e
+        self._evaluate = _compile_node(tree.body, self.names)
+
+    def mask(self, env: Dict[str, Any], size: int) -> np.ndarray:
+        """Булева маска строк, для которых правило выполнено."""
+        return np.broadcast_to(np.asarray(self._evaluate(env), dtype=bool), (size,))
+
+_compiled: Dict[tuple, Rule] = {}
+
+def compile_rule(name: str, expression: str) -> Rule:
+    """Компилирует правило один раз на процесс (в режиме демона - для всех циклов)."""
+    key = (name, expression)
+    if key not in _compiled:
+        _compiled[key] = Rule(name, expression)
+    return _compiled[key]
+
+def load_rules(config: Dict[str, Any], prefix: str, defaults: Dict[str, str]) -> List[Rule]:
+    """
+    Правила из параметров Config с префиксом prefix (имя правила - остаток имени параметра).
+    Если таких параметров нет, используются defaults. Ошибочные правила пропускаются с записью в лог;
+    если ошибочны все, используются defaults.
+    """
+    expressions = {str(key)[len(prefix):]: str(value) for key, value in config.items()
+                   if str(key).startswith(prefix) and str(value).strip()}
+    rules = []
+    for name, expression in expressions.items():
+        try:
+            rules.append(compile_rule(name, expression))
+        except RuleError as e:
+            logging.error(f"❌ Правило '{prefix}{name}' = '{expression}' пропущено: {e}")
+    if not rules:
+        if expressions:
+            logging.warning(f"⚠️ Ни одно правило '{prefix}*' не разобрано: действуют правила по умолчанию.")
+        rules = [compile_rule(name, expression) for name, expression in defaults.items()]
+    return rules
+
+# =============================================================================
+# --- БЛОК 3: ВЫЧИСЛЕНИЕ ---
+# =============================================================================
+def numeric_column(values: pd.Series) -> np.ndarray:
+    """
+    Числа из столбца листа в формате '1 234,56' ('N/A' и пустые значения - NaN).
+    Очистка как в ohlcv_store._to_float: разделитель разрядов в локали листа - неразрывный пробел.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float64)
+    text = (values.astype(str).str.replace('\xa0', '', regex=False).str.replace(' ', '', regex=False)
+            .str.replace(',', '.', regex=False))
+    return pd.to_numeric(text, errors='coerce').to_numpy(dtype=np.float64)
+
+def _last_bars(frame: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Последний бар хранилища для каждой пары (Ticker, Timeframe) строк frame."""
+    bars = {col.lower(): np.full(len(frame), np.nan) for col in BAR_COLUMNS}
+    pairs = pd.Series(list(zip(frame['Ticker'].astype(str), frame['Timeframe'].astype(str))))
+    for pair, rows in pairs.groupby(pairs).groups.items():
+        data = ohlcv_store.read_partition(*pair)
+        if data.shape[0]:
+            for col in BAR_COLUMNS:
+                bars[col.lower()][rows] = data[col][-1]
+    return bars
+
+def build_env(frame: pd.DataFrame, config: Dict[str, Any], names: Set[str]) -> Dict[str, Any]:
+    """Окружение вычисления: параметры Config, столбцы frame и, если нужны правилам, поля последнего бара."""
+    env: Dict[str, Any] = {}
+    for key, value in config.items():
+        try:
+            env[str(key).lower()] = float(str(value).replace(',', '.'))
+        except ValueError:
+            continue
+    env['proximity_level'] = state_thresholds(config)[2]
+    if names & {col.lower() for col in BAR_COLUMNS}:
+        env.update(_last_bars(frame))
+    numeric = {col.lower() for col in NUMERIC_COLUMNS}
+    for col in frame.columns:
+        key = str(col).lower()
+        env[key] = numeric_column(frame[col]) if key in numeric else frame[col].astype(str).to_numpy()
+    return env
+
+def evaluate_rules(frame: pd.DataFrame, rules: List[Rule], config: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Вычисляет все правила по всем строкам frame. Возвращает совпадения: строки frame
+    (по одной на каждое выполненное правило) с добавленным столбцом 'Rule'.
+    """
+    if frame.empty or not rules:
+        return frame.iloc[0:0].assign(Rule=pd.Series(dtype=object))
+    frame = frame.reset_index(drop=True)
+    env = build_env(frame, config, set().union(*(rule.names for rule in rules)))
+    masks = np.zeros((len(rules), len(frame)), dtype=bool)
+    for i, rule in enumerate(rules):
+        try:
+            masks[i] = rule.mask(env, len(frame))
+        except (TypeError, ValueError) as e:
+            logging.error(f"❌ Правило '{rule.name}' ({rule.expression}) не вычислено: {e}")
+    rule_index, row_index = np.nonzero(masks)
+    matches = frame.iloc[row_index].reset_index(drop=True)
+    matches['Rule'] = np.array([rule.name for rule in rules], dtype=object)[rule_index]
+    return matches
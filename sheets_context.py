@@ -0,0 +1,91 @@
+# sheets_context.py
+# Версия: 1.2 (Удалено чтение хвоста History_OHLCV по размеру сетки: история читается из хранилища)
+# Назначение: Авторизация, открытие таблицы и метаданные листов выполняются один раз,
+# после чего контекст передается во все этапы. Поддерживает чтение нескольких
+# листов одним вызовом batch_get.
+
+import logging
+from typing import Any, Dict, List, Optional
+
+import gspread
+from google.oauth2.service_account import Credentials
+from gspread.utils import numericise_all
+
+from sheets_io import get_sheets_io
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ И ПОДКЛЮЧЕНИЕ ---
+# =============================================================================
+CREDS_FILE = 'credentials.json'
+SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/1qBYS_DhGNsTo-Dnph3g_H27aHQOoY0EOcmCIKarb7Zc/"
+SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file']
+HISTORY_SHEET = 'History_OHLCV'
+
+def get_gsheets_client(creds_file=CREDS_FILE, scope=SCOPE) -> gspread.Client | None:
+    try:
+        creds = Credentials.from_service_account_file(creds_file, scopes=scope)
+        client = gspread.authorize(creds)
+        logging.info("✅ Авторизация в Google Sheets прошла успешно.")
+        return client
+    except FileNotFoundError:
+        logging.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Файл credentials.json не найден.")
+        return None
+    except Exception as e:
+        logging.error(f"❌ Ошибка авторизации Google: {e}")
+        return None
+
+def values_to_records(values: List[List[Any]]) -> List[Dict[str, Any]]:
+    """Превращает значения диапазона (первая строка - заголовки) в записи, как get_all_records()."""
+    if not values:
+        return []
+    headers = values[0]
+    records = []
+    for row in values[1:]:
+        row = numericise_all(list(row) + [''] * (len(headers) - len(row)), default_blank='')
+        records.append(dict(zip(headers, row)))
+    return records
+
+# =============================================================================
+# --- БЛОК 2: КОНТЕКСТ ЗАПУСКА ---
+# =============================================================================
+class SheetsContext:
+    """Авторизованный клиент, открытая таблица и кэш объектов листов."""
+
+    def __init__(self, client: gspread.Client, spreadsheet_url: str = SPREADSHEET_URL):
+        self.client = client
+        self.spreadsheet_url = spreadsheet_url
+        self._spreadsheet: Optional[gspread.Spreadsheet] = None
+        self._worksheets: Dict[str, gspread.Worksheet] = {}
+
+    @classmethod
+    def create(cls, creds_file: str = CREDS_FILE, spreadsheet_url: str = SPREADSHEET_URL) -> Optional['SheetsContext']:
+        client = get_gsheets_client(creds_file)
+        return cls(client, spreadsheet_url) if client else None
+
+    @property
+    def spreadsheet(self) -> gspread.Spreadsheet:
+        if self._spreadsheet is None:
+            self._spreadsheet = get_sheets_io().read(self.client.open_by_url, self.spreadsheet_url)
+        return self._spreadsheet
+
+    def worksheet(self, sheet_name: str) -> gspread.Worksheet:
+        """Возвращает лист; метаданные запрашиваются только при первом обращении."""
+        if sheet_name not in self._worksheets:
+            self._worksheets[sheet_name] = get_sheets_io().read(self.spreadsheet.worksheet, sheet_name)
+        return self._worksheets[sheet_name]
+
+    def batch_get_records(self, sheet_names: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Читает несколько листов одним вызовом values_batch_get."""
+        ranges = [f"'{name}'" for name in sheet_names]
+        response = get_sheets_io().read(self.spreadsheet.values_batch_get, ranges)
+        value_ranges = [vr.get('values', []) for vr in response.get('valueRanges', [])]
+        return {name: values_to_records(values) for name, values in zip(sheet_names, value_ranges)}
+
+_default_context: Optional[SheetsContext] = None
+
+def get_default_context() -> Optional[SheetsContext]:
+    """Контекст процесса: создается при первом вызове и переиспользуется всеми этапами."""
+    global _default_context
+    if _default_context is None:
+        _default_context = SheetsContext.create()
+    return _default_context
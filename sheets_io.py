@@ -0,0 +1,124 @@
+# sheets_io.py
+# Версия: 1.1 (Число строк для статистики передается как row_count: rows остается аргументом gspread)
+# Назначение: Все обращения к Google Sheets проходят через этот модуль:
+#   - token bucket отдельно для квот чтения и записи;
+#   - большие append_rows режутся на порции фиксированного размера;
+#   - повтор при 429/5xx с экспоненциальной задержкой и джиттером;
+#   - статистика пропускной способности за запуск.
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+import gspread
+import requests
+
+from rate_limit import TokenBucket, backoff_delay
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+# Квоты Sheets API по умолчанию: 60 запросов чтения и 60 записи в минуту на пользователя
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+APPEND_CHUNK_ROWS = 2000
+MAX_RETRIES = 6
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, gspread.exceptions.APIError):
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None) in RETRY_STATUSES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+# =============================================================================
+# --- БЛОК 2: ПЛАНИРОВЩИК ЗАПРОСОВ ---
+# =============================================================================
+class SheetsIO:
+    """Планировщик запросов к Google Sheets с раздельными квотами 'read' и 'write'."""
+
+    def __init__(self, reads_per_minute: int = READS_PER_MINUTE, writes_per_minute: int = WRITES_PER_MINUTE,
+                 append_chunk_rows: int = APPEND_CHUNK_ROWS, max_retries: int = MAX_RETRIES):
+        self.buckets = {'read': TokenBucket(reads_per_minute), 'write': TokenBucket(writes_per_minute)}
+        self.append_chunk_rows = append_chunk_rows
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {
+                quota: {'calls': 0, 'retries': 0, 'rows': 0, 'throttled_s': 0.0, 'busy_s': 0.0}
+                for quota in self.buckets
+            }
+
+    def call(self, quota: str, func: Callable, *args, row_count: int = 0, **kwargs) -> Any:
+        """
+        Выполняет запрос с учетом квоты quota и повторами при 429/5xx.
+        row_count - число строк запроса для статистики; остальные аргументы передаются func.
+        """
+        for attempt in range(self.max_retries + 1):
+            waited = self.buckets[quota].acquire()
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self.stats[quota]['throttled_s'] += waited
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt)
+                logging.warning(f"⏳ Google Sheets: {e}. Повтор {attempt + 1}/{self.max_retries} через {delay:.1f} с.")
+                with self._lock:
+                    self.stats[quota]['retries'] += 1
+                    self.stats[quota]['throttled_s'] += delay
+                time.sleep(delay)
+                continue
+            with self._lock:
+                entry = self.stats[quota]
+                entry['calls'] += 1
+                entry['rows'] += row_count
+                entry['throttled_s'] += waited
+                entry['busy_s'] += time.monotonic() - started
+            return result
+
+    def read(self, func: Callable, *args, **kwargs) -> Any:
+        return self.call('read', func, *args, **kwargs)
+
+    def write(self, func: Callable, *args, **kwargs) -> Any:
+        return self.call('write', func, *args, **kwargs)
+
+    # --- Обертки над частыми операциями ---
+    def get_all_records(self, worksheet: gspread.Worksheet) -> List[Dict[str, Any]]:
+        return self.read(worksheet.get_all_records)
+
+    def append_rows(self, worksheet: gspread.Worksheet, rows: List[List[Any]],
+                    value_input_option: str = 'USER_ENTERED') -> None:
+        """Дописывает строки порциями по append_chunk_rows, каждая порция - отдельный запрос с повторами."""
+        total_chunks = (len(rows) + self.append_chunk_rows - 1) // self.append_chunk_rows
+        for number, start in enumerate(range(0, len(rows), self.append_chunk_rows), start=1):
+            chunk = rows[start:start + self.append_chunk_rows]
+            self.write(worksheet.append_rows, chunk, value_input_option=value_input_option, row_count=len(chunk))
+            if total_chunks > 1:
+                logging.info(f"    - 📤 '{worksheet.title}': порция {number}/{total_chunks} ({len(chunk)} строк) записана.")
+
+    def report(self) -> str:
+        """Сводка пропускной способности: запросы, повторы, строки и строки в секунду."""
+        parts = []
+        with self._lock:
+            for quota, entry in self.stats.items():
+                busy = entry['busy_s']
+                rate = entry['rows'] / busy if busy > 0 and entry['rows'] else 0.0
+                parts.append(f"{quota}: запросов {entry['calls']}, повторов {entry['retries']}, строк {entry['rows']} "
+                             f"({rate:.0f} строк/с), ожидание квоты {entry['throttled_s']:.1f} с")
+        return "; ".join(parts)
+
+_default_io: SheetsIO | None = None
+
+def get_sheets_io() -> SheetsIO:
+    """Планировщик процесса: общий для всех модулей, чтобы квоты учитывались совместно."""
+    global _default_io
+    if _default_io is None:
+        _default_io = SheetsIO()
+    return _default_io
@@ -1,59 +1,57 @@
 # technical_analyzer.py
-# Версия: 2.7 (Финальная: Исправлена критическая ошибка создания DataFrame)
+# Версия: 3.12 (state_thresholds перенесен в indicator_state)
 
 import gspread
-from google.oauth2.service_account import Credentials
+import numpy as np
 import pandas as pd
-import pandas_ta as ta
 from datetime import datetime
 import logging
-from typing import Dict, List, Any, Optional
-
-# Инициализация логирования на уровне модуля для надежности
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("analyzer.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Any, Optional, Tuple
+
+import analysis_writer
+import indicator_kernels
+import indicator_state
+import ohlcv_store
+from log_setup import setup_logging
+from sheets_context import SheetsContext, get_default_context
+from sheets_io import get_sheets_io
 
-def get_worksheet(sheet_name: str) -> Optional[gspread.Worksheet]:
-    """Подключается к Google Sheets и возвращает объект листа."""
+def get_worksheet(sheet_name: str, ctx: Optional[SheetsContext] = None) -> Optional[gspread.Worksheet]:
+    """Возвращает объект листа из контекста запуска (авторизация выполняется один раз)."""
     try:
-        creds = Credentials.from_service_account_file('credentials.json', scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file'])
-        client = gspread.authorize(creds)
-        spreadsheet = client.open_by_url("https://docs.google.com/spreadsheets/d/1qBYS_DhGNsTo-Dnph3g_H27aHQOoY0EOcmCIKarb7Zc/")
-        return spreadsheet.worksheet(sheet_name)
+        ctx = ctx or get_default_context()
+        if ctx is None:
+            return None
+        return ctx.worksheet(sheet_name)
     except Exception as e:
         logging.error(f"❌ Ошибка доступа к листу '{sheet_name}': {e}")
         return None
 
-def calculate_indicators_and_state(df_for_calc: pd.DataFrame, config: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Рассчитывает индикаторы на ЧИСТОМ DataFrame (только OHLC).
-    """
-    if df_for_calc.shape[0] < 50:
-        return {}
-
+def compute_indicators(df_for_calc: pd.DataFrame) -> pd.DataFrame:
+    """Добавляет в DataFrame полные столбцы индикаторов pandas_ta (эталонный расчет)."""
+    # pandas_ta импортируется медленно и нужен только для эталонного расчета;
+    # импорт регистрирует аксессор DataFrame.ta
+    import pandas_ta  # noqa: F401
     df_for_calc.ta.rsi(length=14, append=True)
     df_for_calc.ta.sma(length=20, append=True)
     df_for_calc.ta.sma(length=50, append=True)
     df_for_calc.ta.bbands(length=20, append=True)
-    latest = df_for_calc.iloc[-1]
+    return df_for_calc
 
+def build_analysis_result(latest: Any, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Определяет состояние по последним значениям индикаторов (ключи как у столбцов pandas_ta).
+    """
     rsi = latest.get('RSI_14')
     state = "Neutral"
     recommendation = "-"
     if pd.notna(rsi):
-        warning_level = float(str(config.get('RSI_WARNING_LEVEL', 35)).replace(',', '.'))
-        alert_level = float(str(config.get('RSI_ALERT_LEVEL', 30)).replace(',', '.'))
-        proximity_pct = float(str(config.get('PROXIMITY_PERCENTAGE', 15)).replace(',', '.'))
-        proximity_start_level = warning_level * (1 + proximity_pct / 100)
+        alert_level, warning_level, proximity_start_level = indicator_state.state_thresholds(config)
         if rsi < alert_level:
             state = "Oversold"
-            recommendation = "Alert Sent"
+            recommendation = "Look for entry"
         elif rsi < warning_level:
             state = "Warning"
             recommendation = "Monitor for reversal"
@@ -75,81 +73,224 @@ def calculate_indicators_and_state(df_for_calc: pd.DataFrame, config: Dict[str,
         'BB_Lower': format_number(latest.get('BBL_20_2.0')),
     }
 
-def main_analyzer() -> None:
-    """Основная функция анализатора: читает всю историю и полностью пересчитывает аналитику."""
-    logging.info("\n" + "="*50)
-    logging.info(f"--- 🧠 ASIPM-AI: Технический Анализатор v2.7 (Корректный) 🧠 ---")
-    logging.info("="*50)
-    sheets = {name: get_worksheet(name) for name in ['History_OHLCV', 'Analysis', 'Config']}
-    if not all(sheets.values()):
-        logging.critical("Не удалось получить доступ к одному или нескольким листам Google. Завершение работы.")
-        return
+def make_analysis_row(ticker: str, timeframe: str, analysis_result: Dict[str, Any]) -> List[Any]:
+    """Формирует строку листа 'Analysis' из результата анализа."""
+    return [
+        ticker, timeframe, analysis_result.get('State'),
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'), analysis_result.get('RSI_14'),
+        analysis_result.get('MA_20'), analysis_result.get('MA_50'),
+        analysis_result.get('BB_Upper'), analysis_result.get('BB_Lower'),
+        "N/A", analysis_result.get('Recommendation')
+    ]
 
-    logging.info("🔄 Читаю конфиги и ВСЮ историю для полного пересчета...")
-    history_records = sheets['History_OHLCV'].get_all_records()
-    configs_raw = sheets['Config'].get_all_records()
-    config = {item['Parameter']: item['Value'] for item in configs_raw}
+def analyze_incremental(config: Dict[str, Any], verify: bool = False,
+                        pairs: Optional[Iterable[Tuple[str, str]]] = None) -> List[List[Any]]:
+    """
+    Инкрементальный анализ: состояние индикаторов каждой пары продвигается только по новым барам.
+    В режиме verify результат каждой пары сверяется с полным пересчетом pandas_ta.
+    Если заданы pairs, обрабатываются только эти пары (тикер, таймфрейм), иначе - все партиции хранилища.
+    """
+    states = indicator_state.load_states()
+    all_analysis_results: List[List[Any]] = []
+    mismatched_pairs = 0
+    partitions = ohlcv_store.list_partitions()
+    if pairs is not None:
+        selected = set(pairs)
+        partitions = [pair for pair in partitions if pair in selected]
+    for ticker, timeframe in partitions:
+        data = ohlcv_store.read_partition(ticker, timeframe)
+        key = indicator_state.state_key(ticker, timeframe)
+        state = indicator_state.advance(states.get(key), data)
+        states[key] = state
+        if state['n'] < 50:
+            logging.warning(f"    - ⚠️ Недостаточно данных для анализа {ticker} на {timeframe} (< 50 свечей).")
+            continue
 
-    if not history_records:
-        logging.warning("Лист 'History_OHLCV' пуст. Анализ невозможен.")
-        return
+        values = indicator_state.latest_values(state)
+        if verify:
+            calculation_df = pd.DataFrame({col: np.asarray(data[col]) for col in ['Open', 'High', 'Low', 'Close']}).dropna()
+            full_latest = compute_indicators(calculation_df).iloc[-1]
+            mismatches = indicator_state.verify_against_full(values, full_latest)
+            if mismatches:
+                mismatched_pairs += 1
+                logging.error(f"    - ❌ Расхождение с полным пересчетом для {ticker} на {timeframe}: {mismatches}")
 
-    # --- КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: Правильный способ создания DataFrame из get_all_records() ---
-    history_df = pd.DataFrame(history_records)
-    # ------------------------------------------------------------------------------------
+        analysis_result = build_analysis_result(values, config)
+        all_analysis_results.append(make_analysis_row(ticker, timeframe, analysis_result))
+        logging.info(f"  - ✅ {ticker} на {timeframe}: {analysis_result.get('State')}, RSI: {analysis_result.get('RSI_14')}")
 
-    cols_to_process = ['Open', 'High', 'Low', 'Close', 'Volume']
-    for col in cols_to_process:
-        if col in history_df.columns:
-            history_df[col] = pd.to_numeric(history_df[col], errors='coerce')
+    indicator_state.save_states(states)
+    if verify:
+        logging.info(f"🔎 Сверка с pandas_ta завершена. Пар с расхождениями: {mismatched_pairs}.")
+    return all_analysis_results
 
-    assets_to_analyze = history_df[['Ticker', 'Timeframe']].drop_duplicates().to_dict('records')
-    logging.info(f"☑️ Найдено {len(assets_to_analyze)} уникальных пар (тикер/таймфрейм) для анализа.")
+def prepare_batch(history_df: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Один раз сортирует историю по (Ticker, Timeframe, Date) и отбрасывает строки без полного OHLC.
+    Возвращает отсортированный DataFrame и смещения групп: группа i - строки offsets[i]:offsets[i+1].
+    """
+    columns_for_calc = ['Open', 'High', 'Low', 'Close']
+    batch_df = history_df[['Ticker', 'Timeframe', 'Date'] + columns_for_calc].copy()
+    for col in columns_for_calc:
+        batch_df[col] = pd.to_numeric(batch_df[col], errors='coerce')
+    batch_df['Date'] = pd.to_datetime(batch_df['Date'])
+    batch_df = batch_df.dropna(subset=columns_for_calc)
+    batch_df = batch_df.sort_values(['Ticker', 'Timeframe', 'Date'], kind='mergesort', ignore_index=True)
 
-    all_analysis_results: List[List[Any]] = []
-    for asset_key in assets_to_analyze:
-        ticker, timeframe = asset_key['Ticker'], asset_key['Timeframe']
-        logging.info(f"  - Анализирую {ticker} на {timeframe}...")
+    tickers = batch_df['Ticker'].to_numpy()
+    timeframes = batch_df['Timeframe'].to_numpy()
+    boundaries = np.flatnonzero((tickers[1:] != tickers[:-1]) | (timeframes[1:] != timeframes[:-1])) + 1
+    offsets = np.concatenate([[0], boundaries, [len(batch_df)]]).astype(np.int64)
+    return batch_df, offsets
 
-        ticker_history = history_df[(history_df['Ticker'] == ticker) & (history_df['Timeframe'] == timeframe)].copy()
-        if ticker_history.empty: continue
+def compute_latest_batch(close: np.ndarray, offsets: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Возвращает последние значения индикаторов каждой группы. Для группы обрабатывается
+    только хвостовое окно indicator_kernels.TAIL_WINDOW, поэтому стоимость не зависит
+    от глубины истории. Каждая группа считается независимо от соседних.
+    """
+    return indicator_kernels.latest_indicators_batch(close, offsets)
 
-        ticker_history['Date'] = pd.to_datetime(ticker_history['Date'])
-        ticker_history.sort_values(by='Date', inplace=True)
+def _batch_worker(shm_name: str, total_rows: int, row_start: int, local_offsets: np.ndarray) -> Dict[str, np.ndarray]:
+    """Рабочий процесс: читает свой участок Close из разделяемой памяти без копирования и pickle."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        close = np.ndarray((total_rows,), dtype=np.float64, buffer=shm.buf)[row_start:row_start + local_offsets[-1]]
+        latest = compute_latest_batch(close, local_offsets)
+        del close
+        return latest
+    finally:
+        shm.close()
 
-        columns_for_calc = ['Open', 'High', 'Low', 'Close']
-        if not all(col in ticker_history.columns for col in columns_for_calc):
-            logging.warning(f"    - ⚠️ Пропускаю {ticker}, т.к. отсутствуют необходимые столбцы OHLC.")
-            continue
-        
-        calculation_df = ticker_history[columns_for_calc].copy().dropna()
-        
-        analysis_result = calculate_indicators_and_state(calculation_df, config)
-        if not analysis_result:
+def _split_groups(offsets: np.ndarray, workers: int) -> List[tuple[int, int]]:
+    """Делит группы на непрерывные блоки примерно равного числа строк. Возвращает (первая, последняя+1) группа."""
+    group_count = len(offsets) - 1
+    targets = np.linspace(0, offsets[-1], workers + 1)[1:-1]
+    cuts = np.unique(np.concatenate([[0], np.searchsorted(offsets, targets), [group_count]]))
+    return [(int(a), int(b)) for a, b in zip(cuts[:-1], cuts[1:]) if b > a]
+
+def compute_latest_parallel(close: np.ndarray, offsets: np.ndarray, workers: int) -> Dict[str, np.ndarray]:
+    """
+    Параллельный вариант compute_latest_batch. Цены закрытия один раз кладутся в разделяемую
+    память, каждый процесс получает только имя буфера и границы своих групп. Результаты
+    склеиваются в исходном порядке групп, поэтому совпадают с последовательным расчетом.
+    """
+    chunks = _split_groups(offsets, workers)
+    shm = shared_memory.SharedMemory(create=True, size=max(close.nbytes, 1))
+    try:
+        shared_close = np.ndarray(close.shape, dtype=np.float64, buffer=shm.buf)
+        shared_close[:] = close
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [
+                executor.submit(_batch_worker, shm.name, close.shape[0], int(offsets[a]), offsets[a:b + 1] - offsets[a])
+                for a, b in chunks
+            ]
+            parts = [future.result() for future in futures]
+        del shared_close
+    finally:
+        shm.close()
+        shm.unlink()
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+def analyze_batch(history_df: pd.DataFrame, config: Dict[str, Any], workers: int = 1) -> List[List[Any]]:
+    """
+    Полный пересчет всех пар (тикер, таймфрейм) без поочередной фильтрации истории.
+    При workers > 1 группы распределяются по пулу процессов.
+    """
+    batch_df, offsets = prepare_batch(history_df)
+    group_count = len(offsets) - 1
+    logging.info(f"☑️ Найдено {group_count} уникальных пар (тикер/таймфрейм) для анализа.")
+    if group_count <= 0:
+        return []
+
+    close = batch_df['Close'].to_numpy(dtype=np.float64)
+    if workers > 1 and group_count > 1:
+        logging.info(f"⚙️ Параллельный расчет: {min(workers, group_count)} процессов.")
+        latest = compute_latest_parallel(close, offsets, min(workers, group_count))
+    else:
+        latest = compute_latest_batch(close, offsets)
+    return _rows_from_latest(batch_df, offsets, latest, config)
+
+def _rows_from_latest(batch_df: pd.DataFrame, offsets: np.ndarray, latest: Dict[str, np.ndarray],
+                      config: Dict[str, Any]) -> List[List[Any]]:
+    all_analysis_results: List[List[Any]] = []
+    lengths = np.diff(offsets)
+    for i, first_row in enumerate(offsets[:-1]):
+        ticker, timeframe = batch_df.at[first_row, 'Ticker'], batch_df.at[first_row, 'Timeframe']
+        if lengths[i] < 50:
             logging.warning(f"    - ⚠️ Недостаточно данных для анализа {ticker} на {timeframe} (< 50 свечей).")
             continue
+        analysis_result = build_analysis_result({key: values[i] for key, values in latest.items()}, config)
+        all_analysis_results.append(make_analysis_row(ticker, timeframe, analysis_result))
+        logging.info(f"  - ✅ {ticker} на {timeframe}: {analysis_result.get('State')}, RSI: {analysis_result.get('RSI_14')}")
+    return all_analysis_results
 
-        new_row = [
-            ticker, timeframe, analysis_result.get('State'),
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'), analysis_result.get('RSI_14'),
-            analysis_result.get('MA_20'), analysis_result.get('MA_50'),
-            analysis_result.get('BB_Upper'), analysis_result.get('BB_Lower'),
-            "N/A", analysis_result.get('Recommendation')
-        ]
-        all_analysis_results.append(new_row)
-        logging.info(f"    - ✅ Анализ завершен. Состояние: {analysis_result.get('State')}, RSI: {analysis_result.get('RSI_14')}")
-
-    if all_analysis_results:
-        logging.info(f"\n🔄 Перезаписываю лист 'Analysis' {len(all_analysis_results)} строками...")
-        try:
-            headers = ['Ticker', 'Timeframe', 'State', 'Last_Update', 'RSI_14', 'MA_20', 'MA_50', 'BB_Upper', 'BB_Lower', 'Pattern_Found', 'Recommendation']
-            sheets['Analysis'].clear()
-            sheets['Analysis'].update(range_name='A1', values=[headers] + all_analysis_results)
-            logging.info("✅✅✅ УСПЕХ! Лист 'Analysis' полностью пересобран и обновлен.")
-        except Exception as e:
-            logging.error(f"❌ ОШИБКА при записи в 'Analysis': {e}", exc_info=True)
+def main_analyzer(incremental: bool = True, verify: bool = False, workers: int = 1,
+                  ctx: Optional[SheetsContext] = None, config: Optional[Dict[str, Any]] = None,
+                  pairs: Optional[Iterable[Tuple[str, str]]] = None) -> Optional[pd.DataFrame]:
+    """
+    Основная функция анализатора.
+
+    Args:
+        incremental: Если True, индикаторы обновляются по сохраненному состоянию только на новых барах.
+                     Иначе вся история полностью пересчитывается пакетно по всем парам.
+        verify: Сверять инкрементальные значения с полным пересчетом pandas_ta.
+        workers: Число процессов для полного пересчета (1 - последовательно).
+        ctx: Контекст Google Sheets конвейера; если не передан, используется контекст процесса.
+        config: Параметры листа Config, уже прочитанные конвейером; если не переданы, читаются из таблицы.
+        pairs: Пары (тикер, таймфрейм), получившие новые бары. В инкрементальном режиме анализируются
+               только они, а их строки сливаются с остальными строками листа 'Analysis'.
 
+    Returns:
+        Строки листа 'Analysis' (столбцы ANALYSIS_HEADERS) или None, если анализ не выполнялся.
+    """
+    logging.info("\n" + "="*50)
+    logging.info(f"--- 🧠 ASIPM-AI: Технический Анализатор v3.12 (Инкрементальный) 🧠 ---")
+    logging.info("="*50)
+    sheets = {name: get_worksheet(name, ctx) for name in ['History_OHLCV', 'Analysis', 'Config']}
+    if not all(sheets.values()):
+        logging.critical("Не удалось получить доступ к одному или нескольким листам Google. Завершение работы.")
+        return None
+
+    ohlcv_store.bootstrap_from_sheet(sheets['History_OHLCV'])
+    if config is None:
+        configs_raw = get_sheets_io().get_all_records(sheets['Config'])
+        config = {item['Parameter']: item['Value'] for item in configs_raw}
+
+    prune_missing = True
+    if incremental and pairs is not None:
+        pairs = set(pairs)
+        logging.info(f"🔄 Обновляю индикаторы только для {len(pairs)} пар с новыми барами...")
+        all_analysis_results = analyze_incremental(config, verify=verify, pairs=pairs)
+        # Строки остальных пар остаются в листе без изменений
+        prune_missing = False
+    elif incremental:
+        logging.info("🔄 Обновляю индикаторы инкрементально по новым барам...")
+        all_analysis_results = analyze_incremental(config, verify=verify)
+    else:
+        logging.info("🔄 Читаю ВСЮ историю из локального хранилища для полного пересчета...")
+        history_df = ohlcv_store.read_history()
+        if history_df.empty:
+            logging.warning("История OHLCV пуста. Анализ невозможен.")
+            return None
+        all_analysis_results = analyze_batch(history_df, config, workers=workers)
+
+    _write_analysis_sheet(sheets['Analysis'], all_analysis_results, prune_missing=prune_missing)
     logging.info("--- 🏁 РАБОТА АНАЛИЗАТОРА ЗАВЕРШЕНА 🏁 ---")
+    return pd.DataFrame(all_analysis_results, columns=analysis_writer.ANALYSIS_HEADERS)
+
+def _write_analysis_sheet(analysis_sheet: gspread.Worksheet, all_analysis_results: List[List[Any]],
+                          prune_missing: bool = True) -> None:
+    if not all_analysis_results:
+        return
+    logging.info(f"\n🔄 Сверяю лист 'Analysis' с {len(all_analysis_results)} строками анализа...")
+    try:
+        stats = analysis_writer.write_analysis_diff(analysis_sheet, all_analysis_results, prune_missing=prune_missing)
+        logging.info(f"✅✅✅ УСПЕХ! Лист 'Analysis' обновлен: ячеек {stats['cells']}, "
+                     f"добавлено строк {stats['appended']}, удалено {stats['deleted']}.")
+    except Exception as e:
+        logging.error(f"❌ ОШИБКА при записи в 'Analysis': {e}", exc_info=True)
 
 if __name__ == "__main__":
+    setup_logging("analyzer.log")
     main_analyzer()
\ No newline at end of file
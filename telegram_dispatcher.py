@@ -0,0 +1,160 @@
+# telegram_dispatcher.py
+# Версия: 1.0 (Пакетная параллельная отправка алертов в Telegram)
+# Назначение: Отправка алертов не должна определять длительность цикла при массовых сигналах:
+#   - общая сессия HTTP с пулом keep-alive соединений;
+#   - параллельная отправка в пределах лимитов Telegram (общий и на чат, token bucket);
+#   - при числе сигналов выше порога они объединяются в сводные сообщения (digest);
+#   - неудачные отправки повторяются из очереди с задержкой (retry_after от Telegram или экспонента).
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from http_client import get_shared_session
+from rate_limit import TokenBucket, backoff_delay
+
+# =============================================================================
+# --- БЛОК 1: КОНФИГУРАЦИЯ ---
+# =============================================================================
+TELEGRAM_API_URL = "https://api.telegram.org/bot{token}/sendMessage"
+# Лимиты Bot API: ~30 сообщений в секунду на бота и ~20 в минуту в один групповой чат
+GLOBAL_MESSAGES_PER_SECOND = 30
+CHAT_MESSAGES_PER_MINUTE = 20
+DISPATCH_WORKERS = 4
+DIGEST_THRESHOLD = 5        # Больше сигналов за цикл - отправляем сводкой
+MAX_MESSAGE_LENGTH = 4096   # Ограничение Telegram на длину текста
+MAX_ATTEMPTS = 4
+REQUEST_TIMEOUT = 10
+
+def split_digest(title: str, lines: List[str], max_length: int = MAX_MESSAGE_LENGTH) -> List[Tuple[str, int]]:
+    """
+    Собирает сводку из заголовка и строк, разбивая ее на сообщения не длиннее max_length.
+    Возвращает [(текст сообщения, число вошедших в него строк)].
+    """
+    messages = []
+    current, count = title, 0
+    for line in lines:
+        if count and len(current) + 1 + len(line) > max_length:
+            messages.append((current, count))
+            current, count = title, 0
+        current += "\n" + line
+        count += 1
+    messages.append((current, count))
+    return messages
+
+# =============================================================================
+# --- БЛОК 2: ДИСПЕТЧЕР ---
+# =============================================================================
+class TelegramDispatcher:
+    """
+    Отправляет пакет алертов параллельно с соблюдением лимитов Telegram.
+    Лимиты хранятся в объекте, поэтому в режиме демона учитываются между циклами.
+    """
+
+    def __init__(self, bot_token: str, session: Optional[requests.Session] = None,
+                 workers: int = DISPATCH_WORKERS, max_attempts: int = MAX_ATTEMPTS):
+        self.url = TELEGRAM_API_URL.format(token=bot_token)
+        self.session = session or get_shared_session()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._global_bucket = TokenBucket(GLOBAL_MESSAGES_PER_SECOND, period=1.0)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        with self._lock:
+            if chat_id not in self._chat_buckets:
+                # Всплеск ограничен, чтобы сотня сигналов не упиралась в 429 сразу после старта
+                self._chat_buckets[chat_id] = TokenBucket(CHAT_MESSAGES_PER_MINUTE, capacity=5)
+            return self._chat_buckets[chat_id]
+
+    def _send(self, chat_id: str, text: str, delay: float) -> Tuple[str, float]:
+        """
+        Отправляет одно сообщение после паузы delay.
+        Возвращает ('sent' | 'retry' | 'failed', рекомендованная задержка повтора).
+        """
+        if delay > 0:
+            time.sleep(delay)
+        self._chat_bucket(chat_id).acquire()
+        self._global_bucket.acquire()
+        params = {'chat_id': chat_id, 'text': text, 'parse_mode': 'MarkdownV2'}
+        try:
+            response = self.session.post(self.url, json=params, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"    >> ⚠️ Сбой соединения с Telegram: {e}")
+            return 'retry', 0.0
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get('parameters', {}).get('retry_after', 0))
+            except ValueError:
+                retry_after = 0.0
+            logging.warning(f"    >> ⏳ Telegram ограничил частоту, повтор через {retry_after:.0f} с.")
+            return 'retry', retry_after
+        if response.status_code >= 500:
+            return 'retry', 0.0
+        if not response.ok:
+            # 400/403 (неверная разметка, бот удален из чата) повторять бессмысленно
+            logging.error(f"    >> ❌ Ошибка отправки алерта в Telegram: {response.status_code} {response.text}")
+            return 'failed', 0.0
+        return 'sent', 0.0
+
+    def dispatch(self, chat_id: str, alerts: List[Dict[str, Any]], digest_title: str,
+                 digest_threshold: int = DIGEST_THRESHOLD) -> Dict[str, bool]:
+        """
+        Отправляет алерты в чат chat_id.
+
+        Args:
+            alerts: Словари {'key': идентификатор, 'text': полное сообщение, 'summary': строка для сводки}.
+                Текст и строки сводки уже экранированы для MarkdownV2.
+            digest_title: Заголовок сводного сообщения.
+            digest_threshold: При большем числе алертов они отправляются сводкой.
+
+        Returns:
+            Словарь {key: доставлен ли алерт}.
+        """
+        if not alerts:
+            return {}
+        chat_id = str(chat_id)
+        if len(alerts) > digest_threshold:
+            # Строки сводки распределяются по сообщениям по порядку
+            digests = split_digest(digest_title, [alert['summary'] for alert in alerts])
+            messages, position = [], 0
+            for text, count in digests:
+                messages.append({'text': text, 'keys': [a['key'] for a in alerts[position:position + count]], 'attempt': 0})
+                position += count
+            logging.info(f"  - {len(alerts)} сигналов объединены в {len(messages)} сводных сообщений.")
+        else:
+            messages = [{'text': alert['text'], 'keys': [alert['key']], 'attempt': 0} for alert in alerts]
+
+        delivered: Dict[str, bool] = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Очередь повторов: неудачное сообщение снова ставится в пул с задержкой
+            futures = {pool.submit(self._send, chat_id, message['text'], 0.0): message for message in messages}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    message = futures.pop(future)
+                    status, retry_after = future.result()
+                    message['attempt'] += 1
+                    if status == 'retry' and message['attempt'] < self.max_attempts:
+                        delay = max(retry_after, backoff_delay(message['attempt'] - 1))
+                        futures[pool.submit(self._send, chat_id, message['text'], delay)] = message
+                        continue
+                    for key in message['keys']:
+                        delivered[key] = (status == 'sent')
+
+        sent = sum(delivered.values())
+        logging.info(f"  - 📨 Telegram: доставлено {sent} из {len(delivered)} алертов.")
+        return delivered
+
+_dispatchers: Dict[str, TelegramDispatcher] = {}
+
+def get_dispatcher(bot_token: str) -> TelegramDispatcher:
+    """Диспетчер процесса для токена бота: лимиты и пул соединений общие для всех циклов."""
+    if bot_token not in _dispatchers:
+        _dispatchers[bot_token] = TelegramDispatcher(bot_token)
+    return _dispatchers[bot_token]
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+import ohlcv_store
+from alert_ledger import AlertLedger
+
+# Пятница, понедельник, вторник, среда: выходные между ними баров не дают
+DAYS = ['2026-10-09', '2026-10-12', '2026-10-13', '2026-10-14']
+
+
+def _ledger(tmp_path):
+    store_dir = str(tmp_path)
+    ohlcv_store.append_rows([[day, 'D1', 'SBER', 1, 1, 1, 1, 1] for day in DAYS], 'MOEX', store_dir)
+    ledger = AlertLedger(str(tmp_path / 'ledger.db'))
+    ledger.record([('SBER', 'D1', 'Oversold', datetime(2026, 10, 9))])
+    return ledger, store_dir
+
+
+def test_cooldown_counts_stored_bars_not_calendar_days(tmp_path):
+    ledger, store_dir = _ledger(tmp_path)
+    # С пятницы прошло 4 календарных дня, но только 2 бара
+    assert not ledger.should_send('SBER', 'D1', 'Oversold', datetime(2026, 10, 13), 3, store_dir)
+    assert ledger.should_send('SBER', 'D1', 'Oversold', datetime(2026, 10, 14), 3, store_dir)
+
+
+def test_zero_cooldown_only_blocks_the_same_bar(tmp_path):
+    ledger, store_dir = _ledger(tmp_path)
+    assert not ledger.should_send('SBER', 'D1', 'Oversold', datetime(2026, 10, 9), 0, store_dir)
+    assert ledger.should_send('SBER', 'D1', 'Oversold', datetime(2026, 10, 12), 0, store_dir)
+    # Без параметра действует окно по умолчанию (5 баров)
+    assert not ledger.should_send('SBER', 'D1', 'Oversold', datetime(2026, 10, 14), None, store_dir)
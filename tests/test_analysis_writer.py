@@ -0,0 +1,36 @@
+import copy
+
+import analysis_writer
+
+
+class FakeSheet:
+    def __init__(self, values):
+        self.values = values
+        self.batches = []
+
+    def get(self, range_name):
+        return [row[:2] for row in self.values]
+
+    def batch_update(self, updates, **kwargs):
+        self.batches.append(updates)
+
+
+def _row(ticker, rsi, updated):
+    return [ticker, 'D1', 'Neutral', updated, rsi, '1', '1', '1', '1', 'N/A', '-']
+
+
+def test_unchanged_rows_keep_sheet_timestamp_without_mutating_input(tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot.json')
+    old = [_row('SBER', '45', '16.10.2026 19:00:00'), _row('GAZP', '50', '16.10.2026 19:00:00')]
+    analysis_writer.save_snapshot({analysis_writer._row_key(row): row for row in old}, snapshot_path)
+    sheet = FakeSheet([analysis_writer.ANALYSIS_HEADERS] + old)
+
+    rows = [_row('SBER', '45', '17.10.2026 19:00:00'), _row('GAZP', '55', '17.10.2026 19:00:00')]
+    original = copy.deepcopy(rows)
+    stats = analysis_writer.write_analysis_diff(sheet, rows, snapshot_path=snapshot_path)
+
+    assert rows == original
+    assert stats['cells'] == 2  # Last_Update и RSI_14 у GAZP
+    snapshot = analysis_writer.load_snapshot(snapshot_path)
+    assert snapshot['SBER|D1'][analysis_writer.LAST_UPDATE_COL] == '16.10.2026 19:00:00'
+    assert snapshot['GAZP|D1'][analysis_writer.LAST_UPDATE_COL] == '17.10.2026 19:00:00'
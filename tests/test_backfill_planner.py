@@ -0,0 +1,35 @@
+import json
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import backfill_planner
+import data_harvesters
+
+CALENDAR = np.array(['2026-10-12', '2026-10-13', '2026-10-14', '2026-10-15', '2026-10-16'], dtype='datetime64[D]')
+
+
+def test_recent_sessions_are_not_recorded_as_holes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    missing = CALENDAR[1:]
+    # Источник вернул только 13-е: 14-е - старая дыра, 15-е и 16-е могут быть еще не опубликованы
+    frame = pd.DataFrame({'Date': ['2026-10-13'], 'Close': [1.0]})
+    data_harvesters._record_holes([('SBER', 'Stock_MOEX', '2026-10-13', None)], [frame],
+                                  {'SBER': missing}, CALENDAR, 'D1')
+    holes = backfill_planner.load_holes()
+    assert backfill_planner.get_holes(holes, 'SBER', 'D1', 'MOEX') == ['2026-10-14']
+
+
+def test_holes_expire_after_recheck_period(tmp_path):
+    store_dir = str(tmp_path)
+    backfill_planner.record_holes({('SBER', 'D1', 'MOEX'): ['2026-09-01']}, store_dir, today=date(2026, 9, 2))
+    holes = backfill_planner.load_holes(store_dir)
+    assert backfill_planner.get_holes(holes, 'SBER', 'D1', 'MOEX', today=date(2026, 9, 20)) == ['2026-09-01']
+    assert backfill_planner.get_holes(holes, 'SBER', 'D1', 'MOEX', today=date(2026, 10, 17)) == []
+
+
+def test_legacy_hole_lists_are_rechecked(tmp_path):
+    (tmp_path / backfill_planner.HOLES_FILE).write_text(json.dumps({'SBER|D1|MOEX': ['2026-09-01']}))
+    holes = backfill_planner.load_holes(str(tmp_path))
+    assert backfill_planner.get_holes(holes, 'SBER', 'D1', 'MOEX') == []
@@ -0,0 +1,61 @@
+import pytest
+
+import compaction
+
+
+class FakeWorksheet:
+    def __init__(self, title, sheet_id, fail_on_update=False):
+        self.title, self.id, self.fail_on_update = title, sheet_id, fail_on_update
+        self.updates = []
+
+    def update(self, range_name, values, **kwargs):
+        if self.fail_on_update and self.updates:
+            raise RuntimeError("quota exhausted")
+        self.updates.append((range_name, len(values)))
+
+
+class FakeSpreadsheet:
+    def __init__(self, fail_on_update=False):
+        self.history = FakeWorksheet(compaction.HISTORY_SHEET, 1)
+        self.sheets = [self.history]
+        self.fail_on_update = fail_on_update
+        self.batches = []
+
+    def worksheets(self):
+        return list(self.sheets)
+
+    def add_worksheet(self, title, rows, cols):
+        sheet = FakeWorksheet(title, 2, self.fail_on_update)
+        self.sheets.append(sheet)
+        return sheet
+
+    def del_worksheet(self, worksheet):
+        self.sheets.remove(worksheet)
+
+    def batch_update(self, body):
+        self.batches.append(body)
+
+
+ROWS = [['2026-10-16', 'D1', 'SBER', 1, 2, 0.5, 1.5, 100]] * 5
+
+
+def test_rewrite_moves_rows_in_one_batch_update():
+    spreadsheet = FakeSpreadsheet()
+    compaction.rewrite_sheet(spreadsheet, spreadsheet.history, ROWS, chunk_rows=2)
+
+    assert len(spreadsheet.batches) == 1
+    copy, resize = spreadsheet.batches[0]['requests']
+    assert copy['copyPaste']['destination']['sheetId'] == spreadsheet.history.id
+    assert copy['copyPaste']['destination']['endRowIndex'] == len(ROWS) + 1
+    assert resize['updateSheetProperties']['properties']['gridProperties']['rowCount'] == len(ROWS) + 1
+    assert spreadsheet.sheets == [spreadsheet.history]
+
+
+def test_failed_chunk_leaves_history_sheet_untouched():
+    spreadsheet = FakeSpreadsheet(fail_on_update=True)
+    with pytest.raises(RuntimeError):
+        compaction.rewrite_sheet(spreadsheet, spreadsheet.history, ROWS, chunk_rows=2)
+
+    assert spreadsheet.batches == []
+    assert spreadsheet.history.updates == []
+    assert spreadsheet.sheets == [spreadsheet.history]
@@ -0,0 +1,27 @@
+import data_harvesters
+
+
+class FakeSheetsIO:
+    def __init__(self, fail=False):
+        self.fail, self.appended = fail, []
+
+    def append_rows(self, worksheet, rows):
+        if self.fail:
+            raise RuntimeError("quota exhausted")
+        self.appended.extend(rows)
+
+
+ROW_1 = ['2026-10-16 10:00:00', 'm10', 'SBER', 1.0, 2.0, 0.5, 1.5, 100.0]
+ROW_2 = ['2026-10-16 10:10:00', 'm10', 'SBER', 1.5, 2.5, 1.0, 2.0, 50.0]
+
+
+def test_unmirrored_intraday_rows_are_queued_until_the_sheet_accepts_them(tmp_path, monkeypatch):
+    store_dir = str(tmp_path)
+    monkeypatch.setattr(data_harvesters, 'get_sheets_io', lambda: FakeSheetsIO(fail=True))
+    assert not data_harvesters.mirror_to_sheet(None, [ROW_1], store_dir)
+
+    sheets_io = FakeSheetsIO()
+    monkeypatch.setattr(data_harvesters, 'get_sheets_io', lambda: sheets_io)
+    assert data_harvesters.mirror_to_sheet(None, [ROW_2], store_dir)
+    assert sheets_io.appended == [ROW_1, ROW_2]
+    assert not (tmp_path / data_harvesters.PENDING_SHEET_ROWS_FILE).exists()
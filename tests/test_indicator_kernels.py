@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicator_kernels
+from indicator_state import BB_LENGTH, BB_STD, RSI_LENGTH, SMA_FAST, SMA_SLOW
+
+
+def reference_latest(close):
+    """Полный расчет pandas по формулам pandas_ta: rma (ewm adjust=True), SMA, BBands (ddof=0)."""
+    series = pd.Series(close, dtype=np.float64)
+    change = series.diff()
+    positive_avg = change.clip(lower=0).ewm(alpha=1 / RSI_LENGTH, min_periods=RSI_LENGTH).mean()
+    negative_avg = change.clip(upper=0).abs().ewm(alpha=1 / RSI_LENGTH, min_periods=RSI_LENGTH).mean()
+    mean = series.rolling(BB_LENGTH).mean()
+    std = series.rolling(BB_LENGTH).std(ddof=0)
+    columns = {
+        'RSI_14': 100 * positive_avg / (positive_avg + negative_avg),
+        'SMA_20': series.rolling(SMA_FAST).mean(),
+        'SMA_50': series.rolling(SMA_SLOW).mean(),
+        'BBU_20_2.0': mean + BB_STD * std,
+        'BBL_20_2.0': mean - BB_STD * std,
+    }
+    return {key: float(column.iloc[-1]) for key, column in columns.items()}
+
+
+def _cases():
+    rng = np.random.default_rng(0)
+    return {
+        'short': 100 + rng.normal(0, 1, 10).cumsum(),
+        'exactly_50': 100 + rng.normal(0, 1, 50).cumsum(),
+        'random_walk_5000': 100 + rng.normal(0, 1, 5000).cumsum(),
+        'rising': np.linspace(10, 200, 300),
+        'constant': np.full(120, 42.0),
+        'small_prices': 0.001 + np.abs(rng.normal(0, 1e-4, 800)).cumsum(),
+    }
+
+
+CASES = _cases()
+
+
+def assert_matches(actual, expected):
+    for key in indicator_kernels.INDICATOR_KEYS:
+        if np.isnan(expected[key]):
+            assert np.isnan(actual[key]), key
+        else:
+            assert actual[key] == pytest.approx(expected[key], rel=1e-9, abs=1e-9), key
+
+
+@pytest.mark.parametrize('tail', [None, indicator_kernels.TAIL_WINDOW])
+@pytest.mark.parametrize('name', list(CASES))
+def test_latest_indicators_match_reference(name, tail):
+    close = CASES[name]
+    assert_matches(indicator_kernels.latest_indicators(close, tail=tail), reference_latest(close))
+
+
+@pytest.mark.parametrize('tail', [None, indicator_kernels.TAIL_WINDOW])
+def test_batch_matches_reference_per_group(tail):
+    closes = list(CASES.values())
+    offsets = np.concatenate([[0], np.cumsum([len(close) for close in closes])])
+    batch = indicator_kernels.latest_indicators_batch(np.concatenate(closes), offsets, tail=tail)
+    for i, close in enumerate(closes):
+        assert_matches({key: batch[key][i] for key in batch}, reference_latest(close))
+
+
+def test_rsi_series_batch_matches_reference():
+    closes = [CASES['random_walk_5000'][:700], CASES['rising'], CASES['short']]
+    offsets = np.concatenate([[0], np.cumsum([len(close) for close in closes])])
+    series = indicator_kernels.rsi_series_batch(np.concatenate(closes), offsets)
+    for i, close in enumerate(closes):
+        assert series[offsets[i + 1] - 1] == pytest.approx(reference_latest(close)['RSI_14'], rel=1e-9, nan_ok=True)
+
+
+def pandas_ta_latest(close):
+    """Последние значения индикаторов pandas_ta (тот же набор, что в technical_analyzer.compute_indicators)."""
+    pytest.importorskip('pandas_ta')
+    df = pd.DataFrame({'close': np.asarray(close, dtype=np.float64)})
+    df.ta.rsi(length=RSI_LENGTH, append=True)
+    df.ta.sma(length=SMA_FAST, append=True)
+    df.ta.sma(length=SMA_SLOW, append=True)
+    df.ta.bbands(length=BB_LENGTH, std=BB_STD, append=True)
+    latest = df.iloc[-1]
+    return {key: float(latest.get(key, np.nan)) for key in indicator_kernels.INDICATOR_KEYS}
+
+
+@pytest.mark.parametrize('tail', [None, indicator_kernels.TAIL_WINDOW])
+@pytest.mark.parametrize('name', list(CASES))
+def test_latest_indicators_match_pandas_ta(name, tail):
+    close = CASES[name]
+    window = close if tail is None else close[-tail:]
+    assert_matches(indicator_kernels.latest_indicators(close, tail=tail), pandas_ta_latest(window))
+
+
+@pytest.mark.parametrize('tail', [None, indicator_kernels.TAIL_WINDOW])
+def test_batch_matches_pandas_ta(tail):
+    closes = list(CASES.values())
+    offsets = np.concatenate([[0], np.cumsum([len(close) for close in closes])])
+    batch = indicator_kernels.latest_indicators_batch(np.concatenate(closes), offsets, tail=tail)
+    for i, close in enumerate(closes):
+        window = close if tail is None else close[-tail:]
+        assert_matches({key: batch[key][i] for key in batch}, pandas_ta_latest(window))
@@ -0,0 +1,40 @@
+import numpy as np
+
+import indicator_state
+import ohlcv_store
+
+
+def _bars(start, count):
+    data = np.empty(count, dtype=ohlcv_store.OHLCV_DTYPE)
+    data['Date'] = np.datetime64(start, 's') + np.arange(count) * np.timedelta64(600, 's')
+    close = 100 + np.sin(np.arange(count, dtype=np.float64))
+    for field in ['Open', 'High', 'Low', 'Close']:
+        data[field] = close
+    data['Volume'] = 1.0
+    return data
+
+
+def test_ring_shift_advances_without_rebuild(caplog):
+    history = _bars('2026-10-16T10:00:00', 130)
+    state = indicator_state.advance(None, history[:100])
+    caplog.clear()
+
+    # Заполненный буфер: новые бары вытесняют самые старые, число строк не меняется
+    with caplog.at_level('INFO'):
+        state = indicator_state.advance(state, history[30:130])
+    assert state['n'] == 130
+    assert 'История изменилась' not in caplog.text
+
+    full = indicator_state.advance(None, history)
+    assert indicator_state.latest_values(state) == indicator_state.latest_values(full)
+
+
+def test_backfill_into_the_past_rebuilds(caplog):
+    history = _bars('2026-10-16T10:00:00', 100)
+    state = indicator_state.advance(None, history[10:])
+    caplog.clear()
+
+    with caplog.at_level('INFO'):
+        state = indicator_state.advance(state, history)
+    assert state['n'] == 100
+    assert 'История изменилась' in caplog.text
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+import macro_harvester
+import ohlcv_store
+
+
+class FakeSheetsIO:
+    def __init__(self):
+        self.appended = []
+
+    def append_rows(self, worksheet, rows):
+        self.appended.extend(rows)
+
+
+def _run(monkeypatch, bars):
+    frame = pd.DataFrame(bars, columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    monkeypatch.setattr(macro_harvester, 'get_yf_history_batch', lambda tickers, session, start: {'^GSPC': frame})
+    sheets_io = FakeSheetsIO()
+    monkeypatch.setattr(macro_harvester, 'get_sheets_io', lambda: sheets_io)
+    macro_harvester.main_macro_updater(['^GSPC'], history_sheet=None)
+    return sheets_io.appended
+
+
+def test_partial_last_bar_is_refetched_and_replaced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _run(monkeypatch, [['2026-10-15', 10.0, 11.0, 9.0, 10.0, 100], ['2026-10-16', 10.0, 10.5, 9.5, 10.2, 50]])
+
+    # Следующий запуск: бар 16-го завершился, бар 15-го не изменился
+    appended = _run(monkeypatch, [['2026-10-15', 10.0, 11.0, 9.0, 10.0, 100], ['2026-10-16', 10.0, 12.0, 9.5, 11.5, 200],
+                                  ['2026-10-19', 11.5, 12.0, 11.0, 11.8, 150]])
+    assert [row[0] for row in appended] == ['2026-10-16', '2026-10-19']
+    stored = ohlcv_store.read_partition('^GSPC', 'D1')
+    assert stored['Close'].tolist() == [10.0, 11.5, 11.8]
+
+    assert _run(monkeypatch, [['2026-10-19', 11.5, 12.0, 11.0, 11.8, 150]]) == []
+
+
+def test_failed_sheet_append_leaves_store_untouched(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frame = pd.DataFrame([['2026-10-16', 10.0, 11.0, 9.0, 10.0, 100]],
+                         columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    monkeypatch.setattr(macro_harvester, 'get_yf_history_batch', lambda tickers, session, start: {'^GSPC': frame})
+
+    class FailingSheetsIO:
+        def append_rows(self, worksheet, rows):
+            raise RuntimeError("quota exhausted")
+
+    monkeypatch.setattr(macro_harvester, 'get_sheets_io', FailingSheetsIO)
+    with pytest.raises(RuntimeError):
+        macro_harvester.main_macro_updater(['^GSPC'], history_sheet=None)
+    assert ohlcv_store.read_partition('^GSPC', 'D1').shape[0] == 0
+    assert ohlcv_store.load_watermarks() == {}
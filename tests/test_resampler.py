@@ -0,0 +1,66 @@
+import numpy as np
+
+import ohlcv_store
+import resampler
+
+
+def _d1_rows(ticker, days, close):
+    return [[day, 'D1', ticker, close, close + 1, close - 1, close, 1000] for day in days]
+
+
+def _derived(days, close):
+    bars = np.empty(len(days), dtype=ohlcv_store.OHLCV_DTYPE)
+    bars['Date'] = np.array(days, dtype='datetime64[s]')
+    for field in ['Open', 'Close']:
+        bars[field] = close
+    bars['High'], bars['Low'], bars['Volume'] = close + 1, close - 1, 1000
+    return bars
+
+
+def test_resampled_bars_do_not_move_exchange_watermark(tmp_path):
+    store_dir = str(tmp_path)
+    ohlcv_store.append_rows(_d1_rows('SBER', ['2026-10-12', '2026-10-13'], 100.0), 'MOEX', store_dir)
+    ohlcv_store.append_rows(_d1_rows('SBER', ['2026-10-15', '2026-10-16'], 200.0), resampler.D1_SOURCE, store_dir)
+    assert resampler.exchange_daily_watermark('SBER', store_dir) == np.datetime64('2026-10-13', 's')
+
+    # Биржа дописывает день поверх собранного бара и один из уже собранных дней
+    ohlcv_store.append_rows(_d1_rows('SBER', ['2026-10-14', '2026-10-15'], 100.0), 'MOEX', store_dir)
+    index = ohlcv_store.load_watermarks(store_dir)
+    assert index['SBER|D1|MOEX'].startswith('2026-10-15')
+    assert index['SBER|D1|RESAMPLED'].startswith('2026-10-16')
+    assert resampler.exchange_daily_watermark('SBER', store_dir) == np.datetime64('2026-10-15', 's')
+
+
+def test_check_daily_compares_only_exchange_days(tmp_path):
+    store_dir = str(tmp_path)
+    ohlcv_store.append_rows(_d1_rows('SBER', ['2026-10-14', '2026-10-15'], 100.0), 'MOEX', store_dir)
+    ohlcv_store.append_rows(_d1_rows('SBER', ['2026-10-16'], 200.0), resampler.D1_SOURCE, store_dir)
+
+    mismatches = resampler.check_daily('SBER', _derived(['2026-10-15', '2026-10-16'], 150.0), store_dir)
+    assert set(mismatches) == {f"2026-10-15 {field}" for field in ['Open', 'High', 'Low', 'Close']}
+    assert mismatches['2026-10-15 Close'] == (150.0, 100.0)
+
+
+def test_only_resampled_days_have_no_exchange_watermark(tmp_path):
+    store_dir = str(tmp_path)
+    ohlcv_store.append_rows(_d1_rows('SBER', ['2026-10-16'], 200.0), resampler.D1_SOURCE, store_dir)
+    assert resampler.exchange_daily_watermark('SBER', store_dir) is None
+    assert resampler.check_daily('SBER', _derived(['2026-10-16'], 150.0), store_dir) == {}
+
+
+def test_chain_builds_m30_branch_from_m10(tmp_path, monkeypatch):
+    import candle_buffer
+    import pandas as pd
+
+    monkeypatch.setattr(candle_buffer, '_rings', {})
+    store_dir = str(tmp_path)
+    dates = pd.date_range('2026-10-16 10:00', periods=9, freq='10min')
+    candles = pd.DataFrame({'Date': dates, 'Open': np.arange(9.0), 'High': np.arange(9.0) + 1,
+                            'Low': np.arange(9.0) - 1, 'Close': np.arange(9.0), 'Volume': 10.0})
+    candle_buffer.append_candles('SBER', 'm10', candles, store_dir)
+
+    rows = resampler.resample_chain('SBER', 'm10', store_dir)
+    m30 = [row for row in rows if row[1] == 'm30']
+    assert [row[0] for row in m30] == ['2026-10-16 10:00:00', '2026-10-16 10:30:00', '2026-10-16 11:00:00']
+    assert m30[0][3:] == [0.0, 3.0, -1.0, 2.0, 30.0]
+    assert ohlcv_store.read_partition('SBER', 'm30', store_dir).shape[0] == 3
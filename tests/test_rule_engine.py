@@ -0,0 +1,28 @@
+import pandas as pd
+
+import rule_engine
+
+
+def test_all_invalid_rules_fall_back_to_defaults(caplog):
+    config = {'ALERT_RULE_BROKEN': 'RSI_14 <', 'ALERT_RULE_CALL': '__import__("os")'}
+    rules = rule_engine.load_rules(config, rule_engine.ALERT_RULE_PREFIX, rule_engine.DEFAULT_ALERT_RULES)
+    assert [rule.name for rule in rules] == list(rule_engine.DEFAULT_ALERT_RULES)
+    assert 'правила по умолчанию' in caplog.text
+
+
+def test_valid_rule_replaces_defaults():
+    config = {'ALERT_RULE_DEEP': 'RSI_14 < 20 and timeframe == D1', 'ALERT_RULE_BROKEN': 'RSI_14 <'}
+    rules = rule_engine.load_rules(config, rule_engine.ALERT_RULE_PREFIX, rule_engine.DEFAULT_ALERT_RULES)
+    assert [rule.name for rule in rules] == ['DEEP']
+
+    frame = pd.DataFrame({'Ticker': ['SBER', 'GAZP'], 'Timeframe': ['D1', 'D1'], 'RSI_14': ['18,5', '25'],
+                          'State': ['Oversold', 'Oversold']})
+    matches = rule_engine.evaluate_rules(frame, rules, config)
+    assert matches['Ticker'].tolist() == ['SBER']
+
+
+def test_numeric_column_reads_locale_formatted_numbers():
+    values = pd.Series(['1\xa0234,56', '2 500,5', '28,5', 'N/A', ''])
+    result = rule_engine.numeric_column(values)
+    assert result[:3].tolist() == [1234.56, 2500.5, 28.5]
+    assert all(pd.isna(result[3:]))